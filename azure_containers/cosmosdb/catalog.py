@@ -0,0 +1,257 @@
+"""
+In-memory catalog of the databases and containers of the Cosmos DB account.
+
+Agents call the metadata tools at the start of almost every conversation. The
+catalog keeps a snapshot of databases, containers, partition keys, vector and
+full-text policies and sampled schemas, refreshed by a background thread, so
+those tools answer from memory instead of querying the account each time.
+"""
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, Any, List, Optional, Tuple
+from azure.cosmos import CosmosClient
+from cosmosdb_core import CosmosData, SYSTEM_PROPERTIES  # noqa: F401
+from cosmosdb_core.telemetry import record_request_charge
+
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+# How long a database or container found missing is answered as missing without asking the account
+CATALOG_MISS_SECONDS = float(os.getenv("CATALOG_MISS_SECONDS", "30"))
+
+logger = logging.getLogger("catalog")
+
+
+def container_info(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Summary of the container properties returned by list_containers or read.
+    """
+    indexing = properties.get("indexingPolicy") or {}
+    vector_policy = properties.get("vectorEmbeddingPolicy") or {}
+    full_text_policy = properties.get("fullTextPolicy") or {}
+    return {
+        "id": properties["id"],
+        "partition_key": (properties.get("partitionKey") or {}).get("paths", []),
+        "default_ttl": properties.get("defaultTtl"),
+        "vector_embeddings": vector_policy.get("vectorEmbeddings", []),
+        "vector_indexes": indexing.get("vectorIndexes", []),
+        "full_text_paths": [p["path"] for p in full_text_policy.get("fullTextPaths", [])],
+        "full_text_indexes": [p["path"] for p in indexing.get("fullTextIndexes", [])],
+    }
+
+
+def sample_schema(client: CosmosClient, database: str, container: str) -> Optional[Dict[str, str]]:
+    """
+    Field names and types of one sampled document, or None for an empty container.
+    """
+    sampled = CosmosData(client, response_hook=record_request_charge).schema(database, container)
+    return sampled["result"] if sampled else None
+
+
+def approximate_count(client: CosmosClient, database: str, container: str) -> Optional[int]:
+    """
+    Document count from the quota usage the service reports when reading the container.
+    Costs a metadata read instead of a cross-partition COUNT, but can lag recent writes.
+    """
+    headers: Dict[str, Any] = {}
+
+    def hook(response_headers, *_):
+        record_request_charge(response_headers)
+        headers.update(response_headers)
+
+    container_proxy = client.get_database_client(database).get_container_client(container)
+    container_proxy.read(populate_quota_info=True, response_hook=hook)
+    for part in (headers.get("x-ms-resource-usage") or "").split(";"):
+        key, _, value = part.partition("=")
+        if key == "documentsCount":
+            return int(value)
+    return None
+
+
+class Catalog:
+    """
+    Snapshot of the account metadata. Readers get the current snapshot without locking;
+    a refresh builds a new snapshot and swaps it in, so readers never see a partial one.
+    Lookups of a database or container missing from the snapshot list the containers of
+    that database only, and remember the miss for miss_seconds. Lookups never load the
+    whole account themselves: the first snapshot is loaded by the background thread.
+    """
+    def __init__(self, client: CosmosClient, refresh_seconds: float = CATALOG_REFRESH_SECONDS,
+                 miss_seconds: float = CATALOG_MISS_SECONDS):
+        self.client = client
+        self.refresh_seconds = refresh_seconds
+        self.miss_seconds = miss_seconds
+        self._databases: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._schemas: Dict[Tuple[str, str], Dict[str, str]] = {}
+        # (database, container or None) -> monotonic time until which it is known to be missing
+        self._misses: Dict[Tuple[str, Optional[str]], float] = {}
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = threading.RLock()
+        # Guards the copy-and-swap of the snapshot dicts; held only for the swap itself
+        self._swap_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load_database(self, database: str) -> Dict[str, Dict[str, Any]]:
+        db_client = self.client.get_database_client(database)
+        containers = {}
+        for properties in db_client.list_containers(response_hook=record_request_charge):
+            containers[properties["id"]] = container_info(properties)
+        return containers
+
+    def refresh(self, database: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Reload all databases, or one database, and re-sample the schemas already cached.
+        """
+        with self._refresh_lock:
+            started = time.perf_counter()
+            if database:
+                databases = dict(self._databases)
+                databases[database] = self._load_database(database)
+            else:
+                names = [db["id"] for db in self.client.list_databases(response_hook=record_request_charge)]
+                databases = {name: self._load_database(name) for name in names}
+
+            schemas = {}
+            for (db, container), schema in self._schemas.items():
+                if container not in databases.get(db, {}):
+                    continue
+                if database and db != database:
+                    schemas[(db, container)] = schema
+                    continue
+                try:
+                    schemas[(db, container)] = sample_schema(self.client, db, container) or schema
+                except Exception as e:
+                    logger.warning(f"Keeping cached schema of {db}/{container}: {e}")
+                    schemas[(db, container)] = schema
+
+            with self._swap_lock:
+                # Keep the schemas sampled by lookups while this refresh ran
+                for (db, container), schema in self._schemas.items():
+                    if (db, container) not in schemas and container in databases.get(db, {}):
+                        schemas[(db, container)] = schema
+                self._databases = databases
+                self._schemas = schemas
+                self._misses = {}
+                self._refreshed_at = time.time()
+            return {
+                "databases": len(databases),
+                "containers": sum(len(c) for c in databases.values()),
+                "schemas": len(schemas),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+
+    def _ensure_loaded(self):
+        # Never load or wait for the first snapshot on the caller's thread (the event loop
+        # for sync tools): while the background thread loads it, lookups fall back to
+        # loading the database they need
+        self.start()
+
+    def loading(self) -> bool:
+        """
+        True until the first snapshot has been loaded.
+        """
+        return self._refreshed_at is None
+
+    def _missed(self, database: str, container: Optional[str] = None) -> bool:
+        expires = self._misses.get((database, container))
+        return expires is not None and expires > time.monotonic()
+
+    def _miss(self, database: str, container: Optional[str] = None):
+        now = time.monotonic()
+        misses = {key: expires for key, expires in self._misses.items() if expires > now}
+        misses[(database, container)] = now + self.miss_seconds
+        self._misses = misses
+
+    def _reload_database(self, database: str) -> bool:
+        """
+        List the containers of one database into the snapshot, without re-sampling
+        schemas. Returns False, and remembers the miss, when the database cannot be loaded.
+        """
+        try:
+            containers = self._load_database(database)
+        except Exception as e:
+            logger.error(f"Error loading database {database}: {e}")
+            self._miss(database)
+            return False
+        with self._swap_lock:
+            databases = dict(self._databases)
+            databases[database] = containers
+            self._databases = databases
+        return True
+
+    def start(self):
+        """
+        Start the background refresh thread (once). It loads the first snapshot right
+        away if nothing has been loaded yet; with refresh_seconds <= 0 that is all it does.
+        """
+        if self._thread is not None or (self.refresh_seconds <= 0 and not self.loading()):
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        wait = 0 if self._refreshed_at is None else self.refresh_seconds
+        while not self._stop.wait(wait):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Catalog refresh failed, serving the previous snapshot: {e}")
+            if self.refresh_seconds <= 0:
+                return
+            wait = self.refresh_seconds
+
+    def databases(self) -> List[str]:
+        self._ensure_loaded()
+        if self.loading():
+            # The first snapshot is still loading in the background
+            return [db["id"] for db in self.client.list_databases(response_hook=record_request_charge)]
+        return list(self._databases)
+
+    def containers(self, database: str) -> Optional[List[str]]:
+        """
+        Container names of a database; a database missing from the snapshot is loaded on
+        first use. Returns None when the database does not exist.
+        """
+        self._ensure_loaded()
+        if database not in self._databases:
+            if self._missed(database) or not self._reload_database(database):
+                return None
+        return list(self._databases.get(database, {}))
+
+    def container(self, database: str, container: str) -> Optional[Dict[str, Any]]:
+        if self.containers(database) is None:
+            return None
+        info = self._databases.get(database, {}).get(container)
+        if info is None and not self._missed(database, container):
+            # Created after the last refresh
+            if self._reload_database(database):
+                info = self._databases.get(database, {}).get(container)
+            if info is None:
+                self._miss(database, container)
+        return info
+
+    def schema(self, database: str, container: str) -> Optional[Dict[str, str]]:
+        """
+        Cached field types of a container, sampled on first use.
+        """
+        schema = self._schemas.get((database, container))
+        if schema is not None:
+            return schema
+        schema = sample_schema(self.client, database, container)
+        if schema is not None:
+            with self._swap_lock:
+                schemas = dict(self._schemas)
+                schemas[(database, container)] = schema
+                self._schemas = schemas
+        return schema
+
+    def age_seconds(self) -> Optional[float]:
+        return None if self._refreshed_at is None else round(time.time() - self._refreshed_at, 1)
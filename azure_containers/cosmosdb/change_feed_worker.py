@@ -0,0 +1,232 @@
+from azure.core import MatchConditions
+from azure.cosmos import CosmosClient, ContainerProxy
+from azure.identity import DefaultAzureCredential
+from typing import Dict, Any, List, Optional
+from embeddings import generate_embeddings_batch, text_hash
+from cosmosdb_core import as_list
+from cosmosdb_core.telemetry import registry
+from dotenv import load_dotenv
+import argparse
+import json
+import logging
+import os
+import time
+
+load_dotenv()
+
+ACCOUNT_KEY = os.getenv("ACCOUNT_KEY")
+ACCOUNT_ENDPOINT = os.getenv("ACCOUNT_ENDPOINT")
+
+# Documents are embedded in groups of this size
+WRITE_BATCH_SIZE = int(os.getenv("CHANGE_FEED_WRITE_BATCH_SIZE", "50"))
+POLL_INTERVAL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_INTERVAL_SECONDS", "5"))
+# Cosmos DB transactional batches are limited to 100 operations and 2 MB; a 3072-float
+# embedding is about 60 KB of JSON, so write-backs are chunked by size as well
+MAX_TRANSACTIONAL_BATCH = 100
+MAX_BATCH_BYTES = 1_800_000
+
+logger = logging.getLogger("change_feed_worker")
+
+registry.counter("change_feed_documents_total", "Change feed documents by outcome (read, embedded, skipped, written, failed).")
+# container -> seconds between the newest document of the last page and its processing
+_lag_seconds: Dict[str, float] = {}
+registry.gauge("change_feed_lag_seconds", "Age of the newest change feed document when it was processed.",
+               lambda: [({"container": container}, lag) for container, lag in list(_lag_seconds.items())])
+
+
+class ChangeFeedStats:
+    """
+    Counters reported after every poll of the change feed, and exported as metrics.
+    """
+    def __init__(self, container: str = ""):
+        self.container = container
+        self.started = time.time()
+        self.read = 0
+        self.embedded = 0
+        self.skipped = 0
+        self.written = 0
+        self.failed = 0
+        self.lag_seconds = 0.0
+
+    def count(self, outcome: str, documents: int):
+        setattr(self, outcome, getattr(self, outcome) + documents)
+        registry.add("change_feed_documents_total", documents, container=self.container, outcome=outcome)
+
+    def set_lag(self, seconds: float):
+        self.lag_seconds = seconds
+        _lag_seconds[self.container] = seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "read": self.read,
+            "embedded": self.embedded,
+            "skipped": self.skipped,
+            "written": self.written,
+            "failed": self.failed,
+            "lag_seconds": round(self.lag_seconds, 3),
+            "read_per_second": round(self.read / elapsed, 2),
+            "embedded_per_second": round(self.embedded / elapsed, 2),
+        }
+
+
+class ReembeddingWorker:
+    """
+    Keeps the `embedding` field of a passage container in sync with `passage`.
+
+    The worker follows the container's change feed and hashes every passage.
+    Only documents whose stored `passage_hash` differs from the hash of their
+    current text are re-embedded, so the write-back of a fresh embedding (which
+    shows up on the change feed again) is recognized and skipped.
+    """
+    def __init__(self, container: ContainerProxy, state_path: str,
+                 text_field: str = "passage", vector_field: str = "embedding",
+                 hash_field: str = "passage_hash"):
+        self.container = container
+        self.state_path = state_path
+        self.text_field = text_field
+        self.vector_field = vector_field
+        self.hash_field = hash_field
+        self.partition_key_path = container.read()["partitionKey"]["paths"][0]
+        self.continuation = self._load_state()
+        self.stats = ChangeFeedStats(container.id)
+
+    def _load_state(self) -> Optional[str]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as state_file:
+            return json.load(state_file).get("continuation")
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as state_file:
+            json.dump({"continuation": self.continuation, "updated": time.time()}, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def _partition_key_value(self, document: Dict[str, Any]):
+        value = document
+        for part in self.partition_key_path.strip("/").split("/"):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _needs_embedding(self, document: Dict[str, Any]) -> bool:
+        text = document.get(self.text_field)
+        if not isinstance(text, str) or not text:
+            return False
+        if document.get(self.vector_field) is None:
+            return True
+        return document.get(self.hash_field) != text_hash(text)
+
+    def _chunks(self, documents: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        # Chunks that fit one transactional batch by operation count and by size
+        chunks: List[List[Dict[str, Any]]] = []
+        size = 0
+        for document in documents:
+            document_size = len(json.dumps(document))
+            if not chunks or len(chunks[-1]) >= MAX_TRANSACTIONAL_BATCH or size + document_size > MAX_BATCH_BYTES:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(document)
+            size += document_size
+        return chunks
+
+    def _write_back(self, documents: List[Dict[str, Any]]):
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for document in documents:
+            key = json.dumps(self._partition_key_value(document))
+            groups.setdefault(key, []).append(document)
+
+        for key, group in groups.items():
+            partition_key = json.loads(key)
+            for chunk in self._chunks(group):
+                if len(chunk) == 1:
+                    self._write_individually(chunk)
+                    continue
+                try:
+                    # Replace with the etag we read so a concurrent edit is not overwritten;
+                    # the newer version will come through the change feed on its own.
+                    operations = [
+                        ("replace", (doc["id"], doc), {"if_match_etag": doc["_etag"]})
+                        for doc in chunk
+                    ]
+                    self.container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+                    self.stats.count("written", len(chunk))
+                except Exception as e:
+                    logger.warning(f"Batch write failed for partition {partition_key}, retrying per document: {e}")
+                    self._write_individually(chunk)
+
+    def _write_individually(self, documents: List[Dict[str, Any]]):
+        for document in documents:
+            try:
+                self.container.replace_item(item=document["id"], body=document,
+                                            etag=document["_etag"], match_condition=MatchConditions.IfNotModified)
+                self.stats.count("written", 1)
+            except Exception as e:
+                self.stats.count("failed", 1)
+                logger.error(f"Error writing embedding for document {document.get('id')}: {e}")
+
+    def process(self, documents: List[Dict[str, Any]]):
+        self.stats.count("read", len(documents))
+        if documents:
+            newest = max(doc.get("_ts", 0) for doc in documents)
+            self.stats.set_lag(max(time.time() - newest, 0.0))
+
+        stale = [doc for doc in documents if self._needs_embedding(doc)]
+        self.stats.count("skipped", len(documents) - len(stale))
+
+        for start in range(0, len(stale), WRITE_BATCH_SIZE):
+            chunk = stale[start:start + WRITE_BATCH_SIZE]
+            embeddings = generate_embeddings_batch([doc[self.text_field] for doc in chunk])
+            for document, embedding in zip(chunk, embeddings):
+                document[self.vector_field] = as_list(embedding)
+                document[self.hash_field] = text_hash(document[self.text_field])
+            self.stats.count("embedded", len(chunk))
+            self._write_back(chunk)
+
+    def poll(self) -> int:
+        """
+        Drain the change feed from the stored continuation and return the number of documents read.
+        """
+        if self.continuation:
+            feed = self.container.query_items_change_feed(continuation=self.continuation, max_item_count=WRITE_BATCH_SIZE)
+        else:
+            feed = self.container.query_items_change_feed(start_time="Beginning", max_item_count=WRITE_BATCH_SIZE)
+
+        total = 0
+        for page in feed.by_page():
+            documents = list(page)
+            self.process(documents)
+            total += len(documents)
+            self.continuation = self.container.client_connection.last_response_headers.get("etag", self.continuation)
+            self._save_state()
+        return total
+
+    def run(self, once: bool = False):
+        while True:
+            read = self.poll()
+            logger.info(f"Change feed poll: {json.dumps(self.stats.to_dict())}")
+            if once:
+                return
+            if read == 0:
+                time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def get_cosmos_client() -> CosmosClient:
+    if ACCOUNT_KEY is not None:
+        return CosmosClient(url=ACCOUNT_ENDPOINT, credential=ACCOUNT_KEY)
+    return CosmosClient(url=ACCOUNT_ENDPOINT, credential=DefaultAzureCredential())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed changed passages using the Cosmos DB change feed.")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--container", required=True)
+    parser.add_argument("--state", default=None, help="Path of the continuation state file.")
+    parser.add_argument("--once", action="store_true", help="Drain the feed once and exit.")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    client = get_cosmos_client()
+    container = client.get_database_client(args.database).get_container_client(args.container)
+    state_path = args.state or f".change_feed_{args.database}_{args.container}.json"
+    ReembeddingWorker(container, state_path).run(once=args.once)
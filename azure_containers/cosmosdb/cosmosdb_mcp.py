@@ -1,45 +1,46 @@
-from azure.cosmos import CosmosClient, ContainerProxy
-from azure.core.paging import ItemPaged
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from mcp.server.fastmcp import FastMCP
-from azure.identity import DefaultAzureCredential
 from embeddings import generate_embeddings
-import requests
+from cosmosdb_core import CosmosData, DEFAULT_SIMILARITY_THRESHOLD, DOCUMENT_CACHE_ENABLED, DocumentCache, as_list, encode_result, queries, shared_client
+from cosmosdb_core.telemetry import instrument_tool, record_document_cache, record_request_charge, record_result_size
+from cosmosdb_core.profiling import segment
+from cosmosdb_core.result_format import compact_value
+from singleflight import SingleFlight, coalesce, metadata_flight
+from catalog import Catalog, SYSTEM_PROPERTIES, approximate_count
+from federated_search import federated_search, parse_targets, vector_settings
+from memory_index import MemoryIndexes
+import asyncio
+import logging
 import os
 
 mcp = FastMCP("cosmosdb")
+logger = logging.getLogger("cosmosdb_mcp")
 
-cosmosClient = None
 ACCOUNT_KEY = os.getenv("ACCOUNT_KEY")
 ACCOUNT_ENDPOINT = os.getenv("ACCOUNT_ENDPOINT")
-EMBEDDING_DIMENSIONS = os.getenv("openai_embeddings_dimensions")
+EMBEDDING_DIMENSIONS = int(os.getenv("openai_embeddings_dimensions", "0"))
+DESCRIBE_SAMPLE_MAX_CHARS = int(os.getenv("DESCRIBE_SAMPLE_MAX_CHARS", "200"))
 
-if ACCOUNT_KEY is not None:
-    cosmosClient = CosmosClient(
-        url=ACCOUNT_ENDPOINT,
-        credential=ACCOUNT_KEY,
-    )
-else:
-    cosmosClient = CosmosClient(
-        url=os.getenv("ACCOUNT_ENDPOINT"),
-        credential=DefaultAzureCredential(),
-    )
+# Authenticates with DefaultAzureCredential when ACCOUNT_KEY is not set
+cosmosClient = shared_client(ACCOUNT_ENDPOINT, ACCOUNT_KEY)
+# Queries and result shapes shared with the Azure Functions server; repeated
+# field-filter lookups are served from the document cache
+document_cache = DocumentCache(on_event=record_document_cache) if DOCUMENT_CACHE_ENABLED else None
+data = CosmosData(cosmosClient, response_hook=record_request_charge, document_cache=document_cache,
+                  segment=segment)
+
+catalog = Catalog(cosmosClient)
+# Exact in-memory vector search for the containers in MEMORY_VECTOR_SEARCH_CONTAINERS
+memory_indexes = MemoryIndexes(cosmosClient)
 
 def get_count_of_documents(database: str, collection: str):
     """
     Get the count of documents in the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        documentIterator: ItemPaged[Dict[str, Any]] = container.query_items(
-            query="SELECT VALUE COUNT(1) FROM c",
-            enable_cross_partition_query=True,
-        )
-        count = documentIterator.next()
-        return {"result": str(count), "query": "SELECT VALUE COUNT(1) FROM c"}
+        return data.count(database, collection)
     except Exception as e:
-        print(f"Error retrieving document count: {e}")
+        logger.error(f"Error retrieving document count: {e}")
         return None
 
 def get_document_by_field_filter(database: str, collection: str, field: str, value: str, fields: List[str] = ["*"]):
@@ -47,17 +48,9 @@ def get_document_by_field_filter(database: str, collection: str, field: str, val
     Get a document from the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        fields = list(map(lambda x: f"c.{x}", fields)) if fields != ["*"] else ["*"]
-        result: ItemPaged[Dict[str, Any]] = container.query_items(
-            query=f'SELECT {",".join(fields)} FROM c WHERE c.{field} = "{value}"',
-            enable_cross_partition_query=True,
-        )
-        data = result.next()
-        return {"result": data, "query": f'SELECT {",".join(fields)} FROM c WHERE c.{field} = "{value}"'}
+        return data.document_by_field(database, collection, field, value, fields)
     except Exception as e:
-        print(f"Error retrieving document: {e}")
+        logger.error(f"Error retrieving document: {e}")
         return None
 
 def get_collection_schema(database: str, collection: str):
@@ -65,78 +58,113 @@ def get_collection_schema(database: str, collection: str):
     Get the schema of the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        documentIterator: ItemPaged[Dict[str, Any]] = container.query_items(
-            query="SELECT TOP 1 * FROM c",
-            enable_cross_partition_query=True,
-        )
-        data = documentIterator.next()
-        schema = {}
-        for key in data.keys():
-            if key not in ["_rid", "_self", "_etag", "_attachments", "_ts"]:
-                schema[key] = type(data[key]).__name__
+        schema = catalog.schema(database, collection)
+        if schema is None:
+            return None
         return {"result": schema, "query": "SELECT TOP 1 * FROM c"}
     except Exception as e:
-        print(f"Error retrieving collection schema: {e}")
+        logger.error(f"Error retrieving collection schema: {e}")
         return None
     
-# Function to perform vector search in container
-def cdb_vector_search(container_passage: ContainerProxy, query_vector, top_k=5):
-    # Perform vector search
-    return container_passage.query_items( 
-            query='SELECT TOP @top_k c.pid, c.passage, VectorDistance(c.embedding,@embedding) AS SimilarityScore FROM c ORDER BY VectorDistance(c.embedding,@embedding)', 
-            parameters=[ 
-                {"name": "@embedding", "value": query_vector},
-                {"name": "@top_k", "value": top_k},
-            ], enable_cross_partition_query=True)
+def get_compact_samples(database: str, collection: str, n: int):
+    """
+    Get n documents without system properties, with long values shortened.
+    """
+    items = data.query(database, collection, queries.sample(n))
+    return [{k: compact_value(v, max_chars=DESCRIBE_SAMPLE_MAX_CHARS) for k, v in item.items() if k not in SYSTEM_PROPERTIES}
+            for item in items]
 
-#Function to perform hybrid search in container
-def cdb_hybrid_search(container_passage: ContainerProxy, query_text, query_vector, top_k=5):
-    query = f'SELECT TOP {top_k} c.pid, c.passage FROM c ORDER BY RANK RRF(FullTextScore(c.passage, {query_text.split()}), VectorDistance(c.embedding, {query_vector}))'
-    return container_passage.query_items(
-            query = query, 
-            enable_cross_partition_query=True)
+def search_capabilities(info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Vector and full-text search capabilities of a container from its catalog entry.
+    """
+    index_types = {index["path"]: index.get("type") for index in info["vector_indexes"]}
+    vector = [{
+        "path": embedding["path"],
+        "dimensions": embedding.get("dimensions"),
+        "distance_function": embedding.get("distanceFunction"),
+        "index_type": index_types.get(embedding["path"]),
+    } for embedding in info["vector_embeddings"]]
+    return {
+        "vector_search": vector,
+        "full_text_search": info["full_text_indexes"] or info["full_text_paths"],
+        "hybrid_search": bool(vector) and bool(info["full_text_indexes"]),
+    }
 
 @mcp.tool(
     name="get_databases",
     description="Get all databases in the Cosmos DB account."
 )
-def get_databases():
+@instrument_tool("get_databases")
+async def get_databases():
     """
     Get all databases in the Cosmos DB account.
     """
     try:
-        databases = cosmosClient.list_databases()
-        database_list = [db['id'] for db in databases]
-        return ",".join(database_list)
+        return ",".join(await asyncio.to_thread(catalog.databases))
     except Exception as e:
-        print(f"Error retrieving databases: {e}")
+        logger.error(f"Error retrieving databases: {e}")
         return str(e)
     
 @mcp.tool(
     name="get_collections_of_database",
     description="Get all collections in the specified database."
 )
-def get_collections_of_database(database: str) -> str:
+@instrument_tool("get_collections_of_database")
+async def get_collections_of_database(database: str) -> str:
     """
     Get all collections in the specified database.
     """
-    db_client = cosmosClient.get_database_client(database)
-    containers = db_client.list_containers()
-    return [container['id'] for container in containers]
+    containers = await asyncio.to_thread(catalog.containers, database)
+    if containers is None:
+        return {"error": f"Database {database} not found."}
+    return containers
+
+@mcp.tool(
+    name="get_container_metadata",
+    description="Get the partition key, vector embedding and full-text policies of the specified database and collection."
+)
+@instrument_tool("get_container_metadata")
+async def get_container_metadata(database: str, container: str) -> str:
+    """
+    Get the partition key, vector embedding and full-text policies of a container.
+    """
+    info = await asyncio.to_thread(catalog.container, database, container)
+    if info is None:
+        return {"error": f"Container {database}/{container} not found."}
+    return {"result": info, "catalog_age_seconds": catalog.age_seconds()}
+
+@mcp.tool(
+    name="refresh_catalog",
+    description="Reload the cached list of databases, containers and schemas, for example after creating a container. Pass a database to reload only that database."
+)
+@instrument_tool("refresh_catalog")
+@coalesce("refresh_catalog", SingleFlight())
+def refresh_catalog(database: str = "") -> str:
+    """
+    Reload the cached catalog of databases, containers and schemas.
+    """
+    try:
+        summary = catalog.refresh(database or None)
+        metadata_flight.invalidate()
+        return {"result": summary}
+    except Exception as e:
+        logger.error(f"Error refreshing catalog: {e}")
+        return {"error": str(e)}
 
 @mcp.tool(
     name="get_document_by_field_filter",
-    description="Get a document from the specified database and collection by field filter."
+    description="Get a document from the specified database and collection by field filter. format: compact (default: no system fields, long values shortened), json (as stored) or table (CSV)."
 )
-def get_document_by_field_filter_tool(database: str, container: str, field: str, value: str, fields: str = "*") -> str:
+@instrument_tool("get_document_by_field_filter")
+def get_document_by_field_filter_tool(database: str, container: str, field: str, value: str, fields: str = "*",
+                                      format: str = "") -> str:
     """
     Get a document from the specified database and collection by field filter.
     """
-    document = get_document_by_field_filter(database, container, field, value, fields.split(","))
+    document = get_document_by_field_filter(database, container, field, value, fields)
     if document:
-        return document
+        return encode_result(document, format, on_size=record_result_size)
     else:
         return "Document not found"
     
@@ -144,6 +172,8 @@ def get_document_by_field_filter_tool(database: str, container: str, field: str,
     name="get_count_of_documents",
     description="Get the count of documents in the specified database and collection."
 )
+@instrument_tool("get_count_of_documents")
+@coalesce("get_count_of_documents")
 def get_count_of_documents_tool(database: str, container: str) -> str:
     """
     Get the count of documents in the specified database and collection.
@@ -158,6 +188,8 @@ def get_count_of_documents_tool(database: str, container: str) -> str:
     name="get_collection_schema",
     description="Get the schema of the specified database and collection."
 )
+@instrument_tool("get_collection_schema")
+@coalesce("get_collection_schema")
 def get_collection_schema_tool(database: str, container: str) -> str:
     """
     Get the schema of the specified database and collection.
@@ -170,89 +202,128 @@ def get_collection_schema_tool(database: str, container: str) -> str:
 
 @mcp.tool(
     name="get_sample_documents",
-    description="Get a sample document from the specified database and collection."
+    description="Get a sample document from the specified database and collection. format: columns (default: field names once, then one row per document), compact, json (as stored) or table (CSV)."
 )
-def get_sample_documents(database: str, container: str, n: int = 1, fields: List = ["*"]) -> str:
+@instrument_tool("get_sample_documents")
+def get_sample_documents(database: str, container: str, n: int = 1, fields: List = ["*"], format: str = "") -> str:
     """
     Get a sample document from the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(container)
-        fields = list(map(lambda x: f"c.{x}", fields)) if fields != ["*"] else ["*"]
-        documentIterator: ItemPaged[Dict[str, Any]] = container.query_items(
-            query=f"SELECT TOP {n} {','.join(fields)} FROM c",
-            enable_cross_partition_query=True,
-        )
-        results = []
-        for item in documentIterator:
-            results.append(item)
-        return {"result": results, "query": f"SELECT TOP {n} c.passage FROM c"}
+        return encode_result(data.sample_documents(database, container, n, fields), format, on_size=record_result_size)
     except Exception as e:
-        print(f"Error retrieving sample document: {e}")
+        logger.error(f"Error retrieving sample document: {e}")
         return None
     
+@mcp.tool(
+    name="describe_container",
+    description="Describe a collection in one call: partition key, fields and types, approximate document count, a few truncated sample documents and its vector/full-text search capabilities. Prefer this over calling the schema, count and sample tools one by one."
+)
+@instrument_tool("describe_container")
+async def describe_container(database: str, container: str, samples: int = 3) -> str:
+    """
+    Describe a collection: schema, approximate count, samples and search capabilities.
+    """
+    info, schema, count, documents = await asyncio.gather(
+        asyncio.to_thread(catalog.container, database, container),
+        asyncio.to_thread(catalog.schema, database, container),
+        asyncio.to_thread(approximate_count, cosmosClient, database, container),
+        asyncio.to_thread(get_compact_samples, database, container, max(0, min(samples, 10))),
+        return_exceptions=True,
+    )
+    if info is None or isinstance(info, Exception):
+        return {"error": f"Container {database}/{container} not found."}
+
+    errors = {}
+    for name, value in (("fields", schema), ("approximate_count", count), ("samples", documents)):
+        if isinstance(value, Exception):
+            logger.error(f"Error describing {database}/{container} ({name}): {value}")
+            errors[name] = str(value)
+    result = {
+        "container": container,
+        "partition_key": info["partition_key"],
+        "fields": None if "fields" in errors else schema,
+        "approximate_count": None if "approximate_count" in errors else count,
+        "samples": [] if "samples" in errors else documents,
+        "capabilities": search_capabilities(info),
+    }
+    if errors:
+        result["errors"] = errors
+    return {"result": result}
+
 @mcp.tool(
     name="do_vector_search",
-    description="Get the matching documents using vector search."
+    description="Get the matching documents using vector search. similarity_threshold is the minimum similarity for cosine and dotproduct containers and the maximum distance for euclidean ones."
 )
-def do_vector_search(database: str, container: str, query: str, top_k: int = 5, similarity_threshold: float = 0.5):
+@instrument_tool("do_vector_search")
+def do_vector_search(database: str, container: str, query: str, top_k: int = 5, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
     """
     Get the matching documents using vector search.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container_proxy = database_proxy.get_container_client(container)
         query_vector = generate_embeddings(query)
-
-        results = cdb_vector_search(container_proxy, query_vector, top_k)
-        result = []
-        for item in results:
-            if item['SimilarityScore'] >= similarity_threshold:
-                result.append(item['passage'])
-
-        return {"result": result, "query": f'SELECT TOP {top_k} c.pid, c.passage, VectorDistance(c.embedding,{query_vector}) AS SimilarityScore FROM c ORDER BY VectorDistance(c.embedding, {query_vector})'}
+        found = memory_indexes.search(database, container, query_vector, top_k, similarity_threshold)
+        if found is not None:
+            return {"result": found, "query": queries.vector_search(query_vector, top_k).query}
+        distance_function = vector_settings(catalog, database, container)["distance_function"]
+        return data.vector_search(database, container, query_vector, top_k, similarity_threshold, distance_function)
     except Exception as e:
-        print(f"Error retrieving matching documents: {e}")
+        logger.error(f"Error retrieving matching documents: {e}")
         return None
     
+@mcp.tool(
+    name="do_federated_vector_search",
+    description="Get the matching documents using vector search across several collections at once. Pass targets as a list of 'database/collection' strings; results from all of them are merged by score. similarity_threshold is applied per collection with its own distance function: the minimum similarity for cosine and dotproduct collections, the maximum distance for euclidean ones."
+)
+@instrument_tool("do_federated_vector_search")
+async def do_federated_vector_search(targets: List[str], query: str, top_k: int = 5,
+                                     similarity_threshold: Optional[float] = None, timeout_seconds: Optional[float] = None):
+    """
+    Get the matching documents using vector search across several collections.
+    """
+    try:
+        parsed = parse_targets(targets)
+    except ValueError as e:
+        return {"error": str(e)}
+    try:
+        query_vector = await asyncio.to_thread(generate_embeddings, query)
+        return await federated_search(cosmosClient, catalog, parsed, query_vector, top_k,
+                                      timeout_seconds, similarity_threshold)
+    except Exception as e:
+        logger.error(f"Error in federated vector search: {e}")
+        return None
+
 @mcp.tool(
     name="do_hybrid_search",
     description="Get the matching documents using hybrid search."
 )
+@instrument_tool("do_hybrid_search")
 def do_hybrid_search(database: str, container: str, query: str, top_k: int):
     """
     Get the matching documents using hybrid search.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container_proxy = database_proxy.get_container_client(container)
         query_vector = generate_embeddings(query)
-
-        results = cdb_hybrid_search(container_proxy, query, query_vector, top_k)
-        result = []
-        for item in results:
-            result.append(item['passage'])
-
-        return {"result": result, "query": f'SELECT TOP {top_k} c.pid, c.passage FROM c ORDER BY RANK RRF(FullTextScore(c.passage, {query.split()}), VectorDistance(c.embedding, {query_vector}))'}
+        return data.hybrid_search(database, container, query, query_vector, top_k)
     except Exception as e:
-        print(f"Error retrieving matching documents: {e}")
+        logger.error(f"Error retrieving matching documents: {e}")
         return None
 
 @mcp.tool(
     name="get_embedding",
     description="Get the embedding of the specified text."
 )
+@instrument_tool("get_embedding")
 def get_embedding(text: str) -> str:
     """
     Get the embedding of the specified text.
     """
     try:
         embedding = generate_embeddings(text)
-        if len(embedding) == EMBEDDING_DIMENSIONS:
-            return {"result": embedding, "embedding_model": os.getenv("openai_embeddings_model")}
+        if not EMBEDDING_DIMENSIONS or len(embedding) == EMBEDDING_DIMENSIONS:
+            return {"result": as_list(embedding), "embedding_model": os.getenv("openai_embeddings_model")}
         else:
             return {"error": "Embedding generation using openai large model failed."}
     except Exception as e:
-        print(f"Error retrieving embedding: {e}")
+        logger.error(f"Error retrieving embedding: {e}")
         return None
\ No newline at end of file
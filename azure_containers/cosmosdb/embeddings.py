@@ -1,33 +1,41 @@
-from openai import AzureOpenAI
-import os
-import tiktoken
-
-OPENAI_API_KEY = os.getenv('openai_key')
-OPENAI_API_ENDPOINT = os.getenv('openai_endpoint')
-OPENAI_API_VERSION = os.getenv('openai_api_version') # at the time of authoring, the api version is 2024-02-01
-EMBEDDING_MODEL_DEPLOYMENT_NAME = os.getenv('openai_embeddings_deployment')
-EMBEDDING_MODEL_NAME = os.getenv('openai_embeddings_model')
-
-# Load tokenizer for text-embedding-3-large
-tokenizer = tiktoken.get_encoding("cl100k_base")
-AOAI_client = AzureOpenAI(
-    api_key=OPENAI_API_KEY,
-    azure_endpoint=OPENAI_API_ENDPOINT,  # type: ignore
-    azure_deployment=EMBEDDING_MODEL_DEPLOYMENT_NAME,
-    api_version=OPENAI_API_VERSION)
-
-def truncate_text(text, max_tokens=8192):
-    tokens = tokenizer.encode(text)
-    if len(tokens) > max_tokens:
-        truncated_tokens = tokens[:max_tokens]
-        text = tokenizer.decode(truncated_tokens)
-    return text
-
-def generate_embeddings(text: str):
-    if EMBEDDING_MODEL_NAME is None:
-        raise ValueError("Embedding model deployment name is not set.")
-    
-    text = truncate_text(text)
-    response = AOAI_client.embeddings.create(input=text, model=EMBEDDING_MODEL_NAME)
-    embeddings = response.model_dump()
-    return embeddings['data'][0]['embedding']
\ No newline at end of file
+from typing import Any, List
+import os
+
+from cosmosdb_core import Embedder, text_hash  # noqa: F401
+from cosmosdb_core.http_clients import azure_openai_client
+from cosmosdb_core.telemetry import record_embedding_tokens
+from cosmosdb_core.profiling import segment
+
+OPENAI_API_KEY = os.getenv('openai_key')
+OPENAI_API_ENDPOINT = os.getenv('openai_endpoint')
+OPENAI_API_VERSION = os.getenv('openai_api_version') # at the time of authoring, the api version is 2024-02-01
+EMBEDDING_MODEL_DEPLOYMENT_NAME = os.getenv('openai_embeddings_deployment')
+EMBEDDING_MODEL_NAME = os.getenv('openai_embeddings_model')
+EMBEDDING_CACHE_SIZE = int(os.getenv('openai_embeddings_cache_size', '4096'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('openai_embeddings_batch_size', '16'))
+
+# Shares the process-wide connection pool with the other OpenAI clients
+AOAI_client = azure_openai_client(
+    api_key=OPENAI_API_KEY,
+    azure_endpoint=OPENAI_API_ENDPOINT,  # type: ignore
+    azure_deployment=EMBEDDING_MODEL_DEPLOYMENT_NAME,
+    api_version=OPENAI_API_VERSION)
+
+# Truncation and the LRU cache keyed on the hash of the (truncated) input text live in cosmosdb_core
+embedder = Embedder(EMBEDDING_MODEL_NAME, lambda: AOAI_client,
+                    cache_size=EMBEDDING_CACHE_SIZE, batch_size=EMBEDDING_BATCH_SIZE,
+                    on_usage=record_embedding_tokens, segment=segment)
+tokenizer = embedder.tokenizer
+
+def truncate_text(text, max_tokens=8192):
+    return embedder.truncate(text, max_tokens)
+
+def generate_embeddings(text: str):
+    return embedder.embed(text)
+
+def generate_embeddings_batch(texts: List[str]) -> List[Any]:
+    """
+    Embed several texts, serving repeated inputs from the cache and sending
+    the misses to Azure OpenAI in batches of EMBEDDING_BATCH_SIZE.
+    """
+    return embedder.embed_batch(texts)
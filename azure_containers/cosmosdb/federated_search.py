@@ -0,0 +1,165 @@
+"""
+Vector search across several containers, possibly in different databases.
+
+The query is embedded once, every target is searched concurrently with its own
+timeout, and the per-target results (already ordered by the service) are merged
+into one global top-k with a heap. Targets that fail or time out are reported
+next to the results instead of failing the whole search.
+
+Scores are only comparable between targets that use the same distance function.
+When the targets mix functions, each target's results are scored by their rank in
+that target instead (1 / (RANK_CONSTANT + rank)), as in reciprocal rank fusion.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+from azure.cosmos import CosmosClient
+from cosmosdb_core import as_list, queries
+from cosmosdb_core.telemetry import record_request_charge
+from catalog import Catalog
+
+FEDERATED_SEARCH_TIMEOUT_SECONDS = float(os.getenv("FEDERATED_SEARCH_TIMEOUT_SECONDS", "5"))
+FEDERATED_SEARCH_MAX_TARGETS = int(os.getenv("FEDERATED_SEARCH_MAX_TARGETS", "32"))
+RANK_CONSTANT = 60
+
+# Searches run in their own pool so a slow fan-out cannot starve the default executor
+_executor = ThreadPoolExecutor(max_workers=FEDERATED_SEARCH_MAX_TARGETS, thread_name_prefix="federated-search")
+
+
+def parse_targets(targets: List[str]) -> List[Dict[str, str]]:
+    """
+    Parse "database/container" strings, dropping duplicates but keeping their order.
+    """
+    parsed, seen = [], set()
+    for target in targets:
+        database, _, container = target.strip().partition("/")
+        if not database or not container:
+            raise ValueError(f"Target '{target}' must be in the form database/container")
+        if (database, container) not in seen:
+            seen.add((database, container))
+            parsed.append({"database": database, "container": container})
+    if len(parsed) > FEDERATED_SEARCH_MAX_TARGETS:
+        raise ValueError(f"At most {FEDERATED_SEARCH_MAX_TARGETS} targets can be searched at once")
+    return parsed
+
+
+def vector_settings(catalog: Catalog, database: str, container: str) -> Dict[str, str]:
+    """
+    Vector path and distance function of a container, from its vector embedding policy.
+    Containers without a policy are assumed to use /embedding with cosine distance.
+    """
+    info = catalog.container(database, container)
+    if info is None:
+        raise LookupError(f"Container {database}/{container} not found")
+    embeddings = info["vector_embeddings"]
+    if not embeddings:
+        return {"path": "/embedding", "distance_function": "cosine"}
+    return {"path": embeddings[0]["path"], "distance_function": embeddings[0].get("distanceFunction", "cosine")}
+
+
+def search_target(client: CosmosClient, catalog: Catalog, database: str, container: str,
+                  query_vector: List[float], top_k: int,
+                  cancelled: Optional[threading.Event] = None) -> List[Dict[str, Any]]:
+    """
+    Top-k passages of one container, best first, with a score where higher is better.
+    Stops before the next page once cancelled is set (the sync SDK cannot abort a request).
+    """
+    cancelled = cancelled or threading.Event()
+    if cancelled.is_set():
+        # Timed out while waiting for a worker
+        return []
+    settings = vector_settings(catalog, database, container)
+    spec = queries.vector_search(query_vector, top_k, settings["path"])
+    container_proxy = client.get_database_client(database).get_container_client(container)
+    items = container_proxy.query_items(
+        query=spec.query,
+        parameters=spec.parameters,
+        enable_cross_partition_query=True,
+        response_hook=record_request_charge,
+    )
+    # Euclidean distance is lower-is-better; negate it so every target sorts the same way
+    sign = -1.0 if settings["distance_function"] == "euclidean" else 1.0
+    hits = []
+    for page in items.by_page():
+        if cancelled.is_set():
+            break
+        hits.extend({
+            "pid": item.get("pid"),
+            "passage": item.get("passage"),
+            "distance": item["SimilarityScore"],
+            "distance_function": settings["distance_function"],
+            "score": sign * item["SimilarityScore"],
+        } for item in page)
+    return hits
+
+
+async def _run_target(client: CosmosClient, catalog: Catalog, target: Dict[str, str], query_vector: List[float],
+                      top_k: int, timeout: float) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    name = f"{target['database']}/{target['container']}"
+    report: Dict[str, Any] = {"target": name}
+    cancelled = threading.Event()
+    try:
+        # Copy the context so RU charges are attributed to the calling tool
+        context = contextvars.copy_context()
+        hits = await asyncio.wait_for(
+            loop.run_in_executor(_executor, context.run, search_target, client, catalog,
+                                 target["database"], target["container"], query_vector, top_k, cancelled),
+            timeout,
+        )
+        report.update(status="ok", results=len(hits))
+    except asyncio.TimeoutError:
+        # Frees the worker at the next page, or before it starts if still queued
+        cancelled.set()
+        hits = []
+        report.update(status="timeout", error=f"No response within {timeout}s")
+    except Exception as e:
+        hits = []
+        report.update(status="error", error=str(e))
+    report["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    for hit in hits:
+        hit["target"] = name
+    return {"report": report, "hits": hits}
+
+
+async def federated_search(client: CosmosClient, catalog: Catalog, targets: List[Dict[str, str]],
+                           query_vector: List[float], top_k: int = 5, timeout: Optional[float] = None,
+                           min_score: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Search all targets concurrently and merge their results into a global top-k.
+    min_score applies to each target's own VectorDistance, before any rank scoring: a
+    minimum similarity for cosine and dotproduct, a maximum distance for euclidean.
+    """
+    timeout = timeout or FEDERATED_SEARCH_TIMEOUT_SECONDS
+    # Serialized into every target's query parameters, so convert the float32 buffer once
+    query_vector = as_list(query_vector)
+    outcomes = await asyncio.gather(*[
+        _run_target(client, catalog, target, query_vector, top_k, timeout) for target in targets
+    ])
+    hit_lists = [outcome["hits"] for outcome in outcomes]
+    if min_score is not None:
+        hit_lists = [[hit for hit in hits if queries.within_threshold(hit["distance"], min_score, hit["distance_function"])]
+                     for hits in hit_lists]
+    functions = {hit["distance_function"] for hits in hit_lists for hit in hits}
+    scale = "rank" if len(functions) > 1 else "score"
+    if scale == "rank":
+        for hits in hit_lists:
+            for rank, hit in enumerate(hits, start=1):
+                hit["score"] = 1.0 / (RANK_CONSTANT + rank)
+    # Every list is already ordered best first, so a k-way heap merge yields the global order
+    merged = heapq.merge(*hit_lists, key=lambda hit: hit["score"], reverse=True)
+    reports = [outcome["report"] for outcome in outcomes]
+    return {
+        "result": list(itertools.islice(merged, top_k)),
+        "targets": reports,
+        "score_scale": scale,
+        "partial": any(report["status"] != "ok" for report in reports),
+    }
@@ -1,17 +1,67 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends
+from fastapi.responses import PlainTextResponse
 from mcp.server.sse import SseServerTransport
-from starlette.routing import Mount
-from cosmosdb_mcp import mcp
+from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+from starlette.routing import Mount, Route
+from cosmosdb_mcp import mcp, catalog, memory_indexes
+from cosmosdb_core.telemetry import render_prometheus
+import argparse
+import logging
+import os
 import uvicorn
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(docs_url=None, redoc_url=None)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+# Stateless streamable HTTP keeps no per-session state in the process, so any worker
+# (or replica behind a load balancer) can serve any request. SSE sessions live in the
+# worker that opened the stream and need sticky routing.
+STATELESS_HTTP = os.getenv("MCP_STATELESS_HTTP", "true").lower() == "true"
+JSON_RESPONSE = os.getenv("MCP_JSON_RESPONSE", "false").lower() == "true"
+
+session_manager = StreamableHTTPSessionManager(
+    app=mcp._mcp_server,
+    json_response=JSON_RESPONSE,
+    stateless=STATELESS_HTTP,
+)
+
+
+class StreamableHTTPEndpoint:
+    """
+    ASGI endpoint forwarding /mcp requests to the streamable HTTP session manager.
+    """
+    async def __call__(self, scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the metadata catalog in the background so startup does not wait for Cosmos DB
+    catalog.start()
+    memory_indexes.start()
+    async with session_manager.run():
+        yield
+    memory_indexes.stop()
+    catalog.stop()
+
+
+app = FastAPI(docs_url=None, redoc_url=None, lifespan=lifespan)
 
 sse = SseServerTransport("/messages/")
 app.router.routes.append(Mount("/messages", app=sse.handle_post_message))
+app.router.routes.append(Route("/mcp", endpoint=StreamableHTTPEndpoint(), methods=["GET", "POST", "DELETE"]))
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health", tags=["Monitoring"])
+async def health():
+    return {"status": "ok"}
 
 @app.get("/sse", tags=["MCP"])
 async def handle_sse(request: Request):
@@ -27,5 +77,45 @@ async def handle_sse(request: Request):
             init_options,
         )
 
-        if __name__ == "__main__":
-            uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+
+def serve(host: str, port: int, workers: int, keep_alive: int, limit_concurrency: int | None, graceful_shutdown: int,
+          forwarded_allow_ips: str = "127.0.0.1"):
+    """
+    Run the server with uvicorn. On SIGTERM uvicorn stops accepting connections and
+    waits up to graceful_shutdown seconds for in-flight requests and streams to finish.
+    X-Forwarded-For and X-Forwarded-Proto are only honoured from forwarded_allow_ips.
+    """
+    if workers > 1:
+        logging.getLogger("main").warning(
+            "Running %d workers: SSE sessions are bound to one worker, connect clients to /mcp instead of /sse", workers)
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_keep_alive=keep_alive,
+        limit_concurrency=limit_concurrency,
+        timeout_graceful_shutdown=graceful_shutdown,
+        proxy_headers=True,
+        forwarded_allow_ips=forwarded_allow_ips,
+    )
+
+
+if __name__ == "__main__":
+    limit = os.getenv("LIMIT_CONCURRENCY")
+    parser = argparse.ArgumentParser(description="Cosmos DB MCP server (SSE at /sse, streamable HTTP at /mcp).")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="Worker processes; use stateless streamable HTTP (/mcp) when running more than one.")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("TIMEOUT_KEEP_ALIVE", "30")),
+                        help="Seconds to keep idle HTTP connections open.")
+    parser.add_argument("--limit-concurrency", type=int, default=int(limit) if limit else None,
+                        help="Maximum concurrent connections per worker before responding with 503.")
+    parser.add_argument("--graceful-shutdown", type=int, default=int(os.getenv("TIMEOUT_GRACEFUL_SHUTDOWN", "30")),
+                        help="Seconds to drain in-flight requests on shutdown.")
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="Comma-separated proxy addresses trusted to set X-Forwarded-For and X-Forwarded-Proto.")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.keep_alive, args.limit_concurrency, args.graceful_shutdown,
+          args.forwarded_allow_ips)
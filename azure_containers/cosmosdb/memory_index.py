@@ -0,0 +1,460 @@
+"""
+In-memory exact vector search for small and hot passage containers.
+
+For a container of up to a few hundred thousand passages, scoring every passage
+locally is faster than a Cosmos DB round trip. Containers listed in
+MEMORY_VECTOR_SEARCH_CONTAINERS are loaded into one contiguous float32 matrix,
+filled page by page from the change feed; a query is a single matrix-vector
+product followed by an argpartition top-k. Scores are exact and use the distance
+function of the container's vector embedding policy (cosine, dotproduct or
+euclidean), so results are ranked and thresholded like the Cosmos DB query.
+
+The index is loaded from the container's change feed and then follows it, so
+inserts and updates show up within MEMORY_VECTOR_SEARCH_POLL_SECONDS. The change
+feed does not report deletes, so the index is rebuilt every
+MEMORY_VECTOR_SEARCH_RELOAD_SECONDS. With MEMORY_VECTOR_SEARCH_SNAPSHOT_DIR set,
+the matrix is saved there and memory-mapped on the next start, so a restart
+serves queries before the feed has been read again.
+
+Searches fall back to the Cosmos DB query while an index loads, when the container
+holds more than MEMORY_VECTOR_SEARCH_MAX_PASSAGES passages, or when the query
+vector does not match the index dimensions.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Tuple
+from azure.cosmos import CosmosClient
+from cosmosdb_core import DEFAULT_TOP_K, queries
+from cosmosdb_core.telemetry import record_request_charge, registry
+from catalog import approximate_count
+from federated_search import parse_targets
+
+MEMORY_VECTOR_SEARCH_CONTAINERS = [t for t in os.getenv("MEMORY_VECTOR_SEARCH_CONTAINERS", "").split(",") if t.strip()]
+MEMORY_VECTOR_SEARCH_MAX_PASSAGES = int(os.getenv("MEMORY_VECTOR_SEARCH_MAX_PASSAGES", "300000"))
+MEMORY_VECTOR_SEARCH_SNAPSHOT_DIR = os.getenv("MEMORY_VECTOR_SEARCH_SNAPSHOT_DIR", "")
+MEMORY_VECTOR_SEARCH_POLL_SECONDS = float(os.getenv("MEMORY_VECTOR_SEARCH_POLL_SECONDS", "5"))
+MEMORY_VECTOR_SEARCH_RELOAD_SECONDS = float(os.getenv("MEMORY_VECTOR_SEARCH_RELOAD_SECONDS", "3600"))
+
+# Rows read from the change feed per page
+FEED_PAGE_SIZE = 1000
+DISTANCE_FUNCTIONS = ("cosine", "dotproduct", "euclidean")
+
+registry.counter("memory_vector_searches_total", "Vector searches by where they were answered (memory, fallback).")
+
+logger = logging.getLogger("memory_index")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _grown(matrix: np.ndarray, count: int, needed: int, dimensions: int, limit: int) -> np.ndarray:
+    """
+    matrix with room for at least needed rows: its filled rows (up to count) copied
+    into a new allocation half again as large (at most limit rows), or matrix itself.
+    A matrix without columns only reserves its row count for the first allocation.
+    """
+    if matrix.shape[1] == 0:
+        return np.empty((max(matrix.shape[0], needed), dimensions), dtype=np.float32)
+    if needed <= matrix.shape[0]:
+        return matrix
+    capacity = min(max(needed, matrix.shape[0] + matrix.shape[0] // 2, FEED_PAGE_SIZE), max(limit, needed))
+    grown = np.empty((capacity, matrix.shape[1]), dtype=np.float32)
+    count = min(count, matrix.shape[0])
+    grown[:count] = matrix[:count]
+    return grown
+
+
+def vector_distance_function(properties: Dict[str, Any], vector_field: str) -> str:
+    """
+    Distance function of vector_field in the vector embedding policy of a container's
+    properties; cosine when the policy does not list it.
+    """
+    for embedding in (properties.get("vectorEmbeddingPolicy") or {}).get("vectorEmbeddings", []):
+        if embedding.get("path", "").strip("/") == vector_field:
+            function = str(embedding.get("distanceFunction", "cosine")).lower()
+            return function if function in DISTANCE_FUNCTIONS else "cosine"
+    return "cosine"
+
+
+class _Snapshot:
+    """
+    One immutable-size generation of the index. Rows are updated in place; an insert
+    beyond the capacity builds a larger generation that replaces this one. Rows are
+    normalized for cosine; for euclidean their squared norms are kept alongside.
+    """
+    def __init__(self, matrix: np.ndarray, count: int, keys: List[str], pids: List[Any], passages: List[str],
+                 distance_function: str = "cosine", squared_norms: Optional[np.ndarray] = None):
+        self.matrix = matrix
+        self.count = count
+        self.keys = keys
+        self.pids = pids
+        self.passages = passages
+        self.distance_function = distance_function
+        if distance_function == "euclidean" and squared_norms is None:
+            squared_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self.squared_norms = squared_norms
+        self.rows = {key: row for row, key in enumerate(keys)}
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1]
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        return _normalize(vectors) if self.distance_function == "cosine" else vectors
+
+    def set_rows(self, rows, vectors: np.ndarray):
+        self.matrix[rows] = self.prepare(vectors)
+        if self.squared_norms is not None:
+            self.squared_norms[rows] = np.einsum("...j,...j->...", self.matrix[rows], self.matrix[rows])
+
+    def scores(self, query_vector) -> np.ndarray:
+        """
+        VectorDistance of every row to the query, as Cosmos DB computes it.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        matrix = self.matrix[:self.count]
+        if self.distance_function == "cosine":
+            return matrix @ _normalize(query)
+        if self.distance_function == "dotproduct":
+            return matrix @ query
+        squared = self.squared_norms[:self.count] - 2 * (matrix @ query) + float(query @ query)
+        return np.sqrt(np.maximum(squared, 0))
+
+
+class MemoryVectorIndex:
+    """
+    Exact vector search over the passages of one container, kept in sync
+    with its change feed.
+    """
+    def __init__(self, client: CosmosClient, database: str, container: str,
+                 max_passages: int = MEMORY_VECTOR_SEARCH_MAX_PASSAGES,
+                 snapshot_dir: str = MEMORY_VECTOR_SEARCH_SNAPSHOT_DIR,
+                 text_field: str = "passage", vector_field: str = "embedding", id_field: str = "pid"):
+        self.client = client
+        self.database = database
+        self.container = container
+        self.max_passages = max_passages
+        self.snapshot_dir = snapshot_dir
+        self.text_field = text_field
+        self.vector_field = vector_field
+        self.id_field = id_field
+        self.too_large = False
+        self.loaded_at: Optional[float] = None
+        self.continuation: Optional[str] = None
+        self.distance_function = "cosine"
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self._partition_key_path: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None and not self.too_large
+
+    def __len__(self) -> int:
+        snapshot = self._snapshot
+        return snapshot.count if snapshot else 0
+
+    def _proxy(self):
+        return self.client.get_database_client(self.database).get_container_client(self.container)
+
+    def _key(self, document: Dict[str, Any]) -> str:
+        # Ids are unique per logical partition, so rows are keyed on both
+        value = document
+        for part in (self._partition_key_path or "/id").strip("/").split("/"):
+            value = value.get(part) if isinstance(value, dict) else None
+        return json.dumps([document.get("id"), value])
+
+    # -- Loading and following the change feed --------------------------------
+
+    def _read_feed(self, proxy, continuation: Optional[str]):
+        if continuation:
+            feed = proxy.query_items_change_feed(continuation=continuation, max_item_count=FEED_PAGE_SIZE,
+                                                 response_hook=record_request_charge)
+        else:
+            feed = proxy.query_items_change_feed(start_time="Beginning", max_item_count=FEED_PAGE_SIZE,
+                                                 response_hook=record_request_charge)
+        for page in feed.by_page():
+            documents = list(page)
+            continuation = proxy.client_connection.last_response_headers.get("etag", continuation)
+            yield documents, continuation
+
+    def load(self):
+        """
+        Build the index from the beginning of the change feed and swap it in.
+        """
+        proxy = self._proxy()
+        properties = proxy.read(response_hook=record_request_charge)
+        self._partition_key_path = properties["partitionKey"]["paths"][0]
+        self.distance_function = vector_distance_function(properties, self.vector_field)
+        count = approximate_count(self.client, self.database, self.container)
+        if count is not None and count > self.max_passages:
+            self._too_large(count)
+            return
+
+        # The matrix is allocated up front from the estimated count and grown in chunks,
+        # so each page's vectors go straight into float32 rows
+        building = _Snapshot(np.empty((min(count or 0, self.max_passages), 0), dtype=np.float32), 0, [], [], [],
+                             self.distance_function, np.empty(0, dtype=np.float32) if self.distance_function == "euclidean" else None)
+        continuation = None
+        dimensions = 0
+        for documents, continuation in self._read_feed(proxy, None):
+            rows, vectors = [], []
+            for document in documents:
+                vector = document.get(self.vector_field)
+                if not isinstance(vector, list) or not vector:
+                    continue
+                dimensions = dimensions or len(vector)
+                if len(vector) != dimensions:
+                    continue
+                key = self._key(document)
+                row = building.rows.get(key)
+                if row is None:
+                    row = building.rows[key] = building.count
+                    building.count += 1
+                    building.keys.append(key)
+                    building.pids.append(None)
+                    building.passages.append(None)
+                building.pids[row] = document.get(self.id_field)
+                building.passages[row] = document.get(self.text_field)
+                rows.append(row)
+                vectors.append(vector)
+            if building.count > self.max_passages:
+                self._too_large(building.count)
+                return
+            if rows:
+                self._reserve(building, building.count, dimensions)
+                building.set_rows(rows, np.asarray(vectors, dtype=np.float32))
+
+        if dimensions == 0:
+            building.matrix = np.zeros((0, 0), dtype=np.float32)
+        with self._lock:
+            self._snapshot = building
+            self.continuation = continuation
+            self.too_large = False
+            self.loaded_at = time.time()
+        logger.info(f"Loaded {building.count} passages of {self.database}/{self.container} into memory")
+        self.save()
+
+    def _too_large(self, count: int):
+        logger.warning(f"{self.database}/{self.container} has {count} passages, more than "
+                       f"{self.max_passages}; vector searches stay on Cosmos DB")
+        with self._lock:
+            self._snapshot = None
+            self.too_large = True
+
+    def poll(self) -> int:
+        """
+        Apply the changes since the last poll and return the number of documents read.
+        """
+        if self._snapshot is None or self.continuation is None:
+            return 0
+        total = 0
+        for documents, continuation in self._read_feed(self._proxy(), self.continuation):
+            for document in documents:
+                self._apply(document)
+            total += len(documents)
+            self.continuation = continuation
+        return total
+
+    def _apply(self, document: Dict[str, Any]):
+        vector = document.get(self.vector_field)
+        if not isinstance(vector, list) or not vector:
+            return
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            if snapshot.count and len(vector) != snapshot.dimensions:
+                return
+            key = self._key(document)
+            row = snapshot.rows.get(key)
+            if row is None:
+                if snapshot.count >= self.max_passages:
+                    return
+                if snapshot.count == snapshot.matrix.shape[0]:
+                    snapshot = self._grow(snapshot, len(vector))
+                row = snapshot.count
+                snapshot.rows[key] = row
+                snapshot.keys.append(key)
+                snapshot.pids.append(None)
+                snapshot.passages.append(None)
+            snapshot.set_rows(row, np.asarray(vector, dtype=np.float32))
+            snapshot.pids[row] = document.get(self.id_field)
+            snapshot.passages[row] = document.get(self.text_field)
+            snapshot.count = max(snapshot.count, row + 1)
+
+    def _reserve(self, snapshot: _Snapshot, needed: int, dimensions: int):
+        # Only used on a snapshot that is still being built, so it is grown in place
+        snapshot.matrix = _grown(snapshot.matrix, snapshot.count, needed, dimensions, self.max_passages)
+        if snapshot.squared_norms is not None and snapshot.squared_norms.shape[0] < snapshot.matrix.shape[0]:
+            squared_norms = np.empty(snapshot.matrix.shape[0], dtype=np.float32)
+            squared_norms[:snapshot.squared_norms.shape[0]] = snapshot.squared_norms
+            snapshot.squared_norms = squared_norms
+
+    def _grow(self, snapshot: _Snapshot, dimensions: int) -> _Snapshot:
+        # Searches keep using the previous generation until this one is swapped in
+        matrix = _grown(snapshot.matrix, snapshot.count, snapshot.count + 1, dimensions, self.max_passages)
+        squared_norms = None
+        if snapshot.squared_norms is not None:
+            squared_norms = np.empty(matrix.shape[0], dtype=np.float32)
+            squared_norms[:snapshot.count] = snapshot.squared_norms[:snapshot.count]
+        grown = _Snapshot(matrix, snapshot.count, list(snapshot.keys), list(snapshot.pids), list(snapshot.passages),
+                          snapshot.distance_function, squared_norms)
+        self._snapshot = grown
+        return grown
+
+    # -- Snapshots on disk -----------------------------------------------------
+
+    def _snapshot_paths(self) -> Tuple[str, str]:
+        base = os.path.join(self.snapshot_dir, f"{self.database}__{self.container}")
+        return f"{base}.npy", f"{base}.json"
+
+    def save(self):
+        if not self.snapshot_dir:
+            return
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            matrix = np.array(snapshot.matrix[:snapshot.count])
+            meta = {"keys": snapshot.keys[:snapshot.count], "pids": snapshot.pids[:snapshot.count],
+                    "passages": snapshot.passages[:snapshot.count], "continuation": self.continuation,
+                    "partition_key_path": self._partition_key_path, "distance_function": snapshot.distance_function,
+                    "saved_at": time.time()}
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        matrix_path, meta_path = self._snapshot_paths()
+        with open(f"{matrix_path}.tmp", "wb") as matrix_file:
+            np.save(matrix_file, matrix)
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def restore(self) -> bool:
+        """
+        Memory-map the saved snapshot (copy-on-write, so updates stay in this process).
+        """
+        if not self.snapshot_dir:
+            return False
+        matrix_path, meta_path = self._snapshot_paths()
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return False
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            matrix = np.load(matrix_path, mmap_mode="c")
+        except Exception as e:
+            logger.warning(f"Ignoring the snapshot of {self.database}/{self.container}: {e}")
+            return False
+        if matrix.ndim != 2 or len(meta["keys"]) != matrix.shape[0] or matrix.shape[0] > self.max_passages:
+            return False
+        distance_function = meta.get("distance_function", "cosine")
+        with self._lock:
+            self._snapshot = _Snapshot(matrix, matrix.shape[0], meta["keys"], meta["pids"], meta["passages"], distance_function)
+            self.distance_function = distance_function
+            self.continuation = meta.get("continuation")
+            self._partition_key_path = meta.get("partition_key_path")
+            self.loaded_at = meta.get("saved_at")
+        logger.info(f"Restored {matrix.shape[0]} passages of {self.database}/{self.container} from {matrix_path}")
+        return True
+
+    # -- Search ------------------------------------------------------------------
+
+    def search(self, query_vector: List[float], top_k: Optional[int], similarity_threshold: float) -> Optional[List[Tuple[str, float]]]:
+        """
+        The top_k (passage, score) pairs within the threshold, best first, or None when
+        this index cannot answer the query. Scores are the container's VectorDistance:
+        higher is better, except for euclidean distance, where the threshold is a maximum.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or self.too_large:
+            return None
+        count = snapshot.count
+        if count == 0:
+            return []
+        if len(query_vector) != snapshot.dimensions:
+            return None
+        scores = snapshot.scores(query_vector)
+        k = min(int(top_k or DEFAULT_TOP_K), count)
+        if k <= 0:
+            return []
+        # Best first, in the order of the Cosmos DB query's ORDER BY VectorDistance
+        order = scores if snapshot.distance_function == "euclidean" else -scores
+        top = np.argpartition(order, k - 1)[:k] if k < count else np.arange(count)
+        top = top[np.argsort(order[top], kind="stable")]
+        return [(snapshot.passages[row], float(scores[row])) for row in top
+                if queries.within_threshold(float(scores[row]), similarity_threshold, snapshot.distance_function)]
+
+
+class MemoryIndexes:
+    """
+    The in-memory indexes of the configured containers and the thread that keeps them fresh.
+    """
+    def __init__(self, client: CosmosClient, targets: List[str] = MEMORY_VECTOR_SEARCH_CONTAINERS,
+                 poll_seconds: float = MEMORY_VECTOR_SEARCH_POLL_SECONDS,
+                 reload_seconds: float = MEMORY_VECTOR_SEARCH_RELOAD_SECONDS, **index_options):
+        self.indexes: Dict[Tuple[str, str], MemoryVectorIndex] = {
+            (target["database"], target["container"]): MemoryVectorIndex(client, target["database"], target["container"], **index_options)
+            for target in parse_targets(targets)
+        }
+        self.poll_seconds = poll_seconds
+        self.reload_seconds = reload_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, database: str, container: str) -> Optional[MemoryVectorIndex]:
+        return self.indexes.get((database, container))
+
+    def search(self, database: str, container: str, query_vector: List[float], top_k: int,
+               similarity_threshold: float) -> Optional[List[str]]:
+        """
+        Passages found in memory, or None when the caller should query Cosmos DB.
+        """
+        index = self.indexes.get((database, container))
+        if index is None:
+            return None
+        found = index.search(query_vector, top_k, similarity_threshold)
+        registry.add("memory_vector_searches_total", 1, outcome="fallback" if found is None else "memory")
+        return None if found is None else [passage for passage, _ in found]
+
+    def start(self):
+        if not self.indexes or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for index in self.indexes.values():
+            try:
+                index.save()
+            except Exception as e:
+                logger.error(f"Error saving the snapshot of {index.database}/{index.container}: {e}")
+
+    def _run(self):
+        for index in self.indexes.values():
+            if not index.restore():
+                self._load(index)
+        while not self._stop.wait(self.poll_seconds):
+            for index in self.indexes.values():
+                if index.loaded_at is None or time.time() - index.loaded_at > self.reload_seconds:
+                    self._load(index)
+                    continue
+                try:
+                    index.poll()
+                except Exception as e:
+                    logger.error(f"Change feed poll of {index.database}/{index.container} failed: {e}")
+
+    def _load(self, index: MemoryVectorIndex):
+        try:
+            index.load()
+        except Exception as e:
+            logger.error(f"Loading {index.database}/{index.container} into memory failed: {e}")
@@ -0,0 +1,130 @@
+"""
+Request coalescing for MCP tools.
+
+Concurrent calls of the same tool with the same arguments share one in-flight
+backend request instead of each running its own query, and successful results
+can be kept for a short TTL. This flattens bursts of identical metadata calls,
+for example when many chat sessions start against the same container after a
+deploy or a cache expiry.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from cosmosdb_core.telemetry import registry
+
+METADATA_CACHE_TTL_SECONDS = float(os.getenv("METADATA_CACHE_TTL_SECONDS", "30"))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
+
+registry.counter("mcp_coalesced_calls_total", "Tool calls by coalescing outcome (miss, shared, cached).")
+
+
+def _cacheable(result) -> bool:
+    return result is not None and not (isinstance(result, dict) and "error" in result)
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time; concurrent callers with the same key await the
+    same task. Successful results are cached for ttl_seconds (0 disables caching).
+    """
+    def __init__(self, ttl_seconds: float = 0.0, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def _cached(self, key: str):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._results[key]
+                return False, None
+            self._results.move_to_end(key)
+            return True, entry[1]
+
+    def _store(self, key: str, result):
+        if self.ttl_seconds <= 0 or not _cacheable(result):
+            return
+        with self._lock:
+            self._results[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    async def _run(self, key: str, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]):
+        if inspect.iscoroutinefunction(fn):
+            result = await fn(*args, **kwargs)
+        else:
+            result = await asyncio.to_thread(fn, *args, **kwargs)
+        self._store(key, result)
+        return result
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller went away
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, str]:
+        """
+        Return (result, outcome) where outcome is "cached", "shared" or "miss".
+        Blocking functions run in a worker thread so they do not hold the event loop.
+        The call runs in its own task, so a caller that is cancelled does not cancel it
+        for the others.
+        """
+        hit, result = self._cached(key)
+        if hit:
+            return result, "cached"
+        task = self._in_flight.get(key)
+        outcome = "shared"
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn, args, kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            outcome = "miss"
+        return await asyncio.shield(task), outcome
+
+    def invalidate(self, prefix: str = ""):
+        with self._lock:
+            for key in [k for k in self._results if k.startswith(prefix)]:
+                del self._results[key]
+
+
+metadata_flight = SingleFlight(METADATA_CACHE_TTL_SECONDS, METADATA_CACHE_SIZE)
+
+
+def call_key(tool_name: str, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> str:
+    """
+    Key of a call: the tool name plus its arguments bound to the signature, with
+    defaults applied and keys sorted, so equivalent calls produce the same key.
+    """
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tool_name + ":" + json.dumps(bound.arguments, sort_keys=True, default=str)
+
+
+def coalesce(tool_name: str, flight: Optional[SingleFlight] = None):
+    """
+    Decorator sharing in-flight calls (and cached results) of a tool between identical
+    concurrent calls. The decorated tool becomes async; sync tools run in a worker thread.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            target = flight or metadata_flight
+            result, outcome = await target.do(call_key(tool_name, fn, args, kwargs), fn, *args, **kwargs)
+            registry.add("mcp_coalesced_calls_total", 1, tool=tool_name, outcome=outcome)
+            return result
+        return wrapper
+    return decorator
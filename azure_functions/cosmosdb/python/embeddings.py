@@ -1,7 +1,9 @@
-from openai import AzureOpenAI
 import os
-import tiktoken
+from cosmosdb_core import Embedder
 from dotenv import load_dotenv
+from cosmosdb_core.http_clients import azure_openai_client, async_azure_openai_client
+from cosmosdb_core.telemetry import record_embedding_tokens
+from cosmosdb_core.profiling import segment
 
 load_dotenv()
 
@@ -10,27 +12,38 @@ OPENAI_API_ENDPOINT = os.getenv('openai_endpoint')
 OPENAI_API_VERSION = os.getenv('openai_api_version') # at the time of authoring, the api version is 2024-02-01
 EMBEDDING_MODEL_DEPLOYMENT_NAME = os.getenv('openai_embeddings_deployment')
 EMBEDDING_MODEL_NAME = os.getenv('openai_embeddings_model')
+EMBEDDING_CACHE_SIZE = int(os.getenv('openai_embeddings_cache_size', '4096'))
 
-# Load tokenizer for text-embedding-3-large
-tokenizer = tiktoken.get_encoding("cl100k_base")
-AOAI_client = AzureOpenAI(
+# Shares the process-wide connection pool with the other OpenAI clients
+AOAI_client = azure_openai_client(
     api_key=OPENAI_API_KEY,
     azure_endpoint=OPENAI_API_ENDPOINT,  # type: ignore
     azure_deployment=EMBEDDING_MODEL_DEPLOYMENT_NAME,
     api_version=OPENAI_API_VERSION)
 
+def async_openai_client():
+    # One async client per event loop, sharing that loop's connection pool
+    return async_azure_openai_client(
+        api_key=OPENAI_API_KEY,
+        azure_endpoint=OPENAI_API_ENDPOINT,  # type: ignore
+        azure_deployment=EMBEDDING_MODEL_DEPLOYMENT_NAME,
+        api_version=OPENAI_API_VERSION)
+
+# Truncation and the embedding cache are shared with the container server (cosmosdb_core)
+embedder = Embedder(EMBEDDING_MODEL_NAME, lambda: AOAI_client, async_openai_client,
+                    cache_size=EMBEDDING_CACHE_SIZE, on_usage=record_embedding_tokens,
+                    segment=segment)
+tokenizer = embedder.tokenizer
+
 def truncate_text(text, max_tokens=8192):
-    tokens = tokenizer.encode(text)
-    if len(tokens) > max_tokens:
-        truncated_tokens = tokens[:max_tokens]
-        text = tokenizer.decode(truncated_tokens)
-    return text
+    return embedder.truncate(text, max_tokens)
 
 def generate_embeddings(text: str):
-    if EMBEDDING_MODEL_NAME is None:
-        raise ValueError("Embedding model deployment name is not set.")
-    
-    text = truncate_text(text)
-    response = AOAI_client.embeddings.create(input=text, model=EMBEDDING_MODEL_NAME)
-    embeddings = response.model_dump()
-    return embeddings['data'][0]['embedding']
\ No newline at end of file
+    return embedder.embed(text)
+
+async def generate_embeddings_async(text: str):
+    """
+    Async version of generate_embeddings for the async triggers; the request does
+    not hold a worker thread while it waits on Azure OpenAI.
+    """
+    return await embedder.embed_async(text)
@@ -1,19 +1,20 @@
 import json
+import logging
 import os
 import azure.functions as func
 
-from azure.core.paging import ItemPaged
 from typing import Dict, Any, List
-import os
 from dotenv import load_dotenv
-from azure.cosmos import CosmosClient, ContainerProxy
 from tool_property import ToolProperty
-import requests
-from embeddings import generate_embeddings
+from embeddings import generate_embeddings_async, tokenizer
+from cosmosdb_core import AsyncCosmosData, DEFAULT_SIMILARITY_THRESHOLD, DOCUMENT_CACHE_ENABLED, DocumentCache, as_list, encode_result, shared_client
+from cosmosdb_core.telemetry import instrument_tool, record_document_cache, record_request_charge, record_result_size
+from cosmosdb_core.profiling import segment
 
 load_dotenv(dotenv_path=".env")
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+logger = logging.getLogger("function_app")
 
 DATABASE_TOOL_PROPERTY = ToolProperty("database", "string", "The name of the Cosmos DB database.")
 CONTAINER_TOOL_PROPERTY = ToolProperty("container", "string", "The name of the container in a Cosmos DB database.")
@@ -21,15 +22,21 @@ FIELD_TOOL_PROPERTY = ToolProperty("field", "string", "The field to be used in t
 VALUE_TOOL_PROPERTY = ToolProperty("value", "string", "The value to be used in the query.")
 FIELDS_TOOL_PROPERTY = ToolProperty("fields", "string", "The fields to be used in the query.")
 SAMPLE_N_TOOL_PROPERTY = ToolProperty("n", "integer", "The number of sample documents to retrieve.")
+FORMAT_TOOL_PROPERTY = ToolProperty("format", "string", "The result format: columns (field names once, then one row per document), compact, json (as stored) or table (CSV).")
 QUERY_TOOL_PROPERTY = ToolProperty("query", "string", "The query provided by the user.")
 TOP_K_TOOL_PROPERTY = ToolProperty("top_k", "integer", "The number of top K results to retrieve.")
 SIMILARITY_THRESHOLD_TOOL_PROPERTY = ToolProperty("similarity_threshold", "string", "The similarity threshold for the vector query.")
 DOCUMENTS_LIST_TOOL_PROPERTY = ToolProperty("documents", "object", "The List of strings of documents to be reranked which are returned from either vector search or hybrid search.")
+# Read by instrument_tool, not by the handlers: true writes a profile of the call (see profiling.py)
+PROFILE_TOOL_PROPERTY = ToolProperty("profile", "boolean", "Set to true to record a latency profile of this call.")
 
-GET_DATABASES_PROPERTIES = []
+GET_DATABASES_PROPERTIES = [
+    PROFILE_TOOL_PROPERTY,
+]
 
 GET_CONTAINER_PROPERTIES = [
     DATABASE_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 GET_COLLECTION_PROPERTIES = [
@@ -38,23 +45,29 @@ GET_COLLECTION_PROPERTIES = [
     FIELD_TOOL_PROPERTY,
     VALUE_TOOL_PROPERTY,
     FIELDS_TOOL_PROPERTY,
+    FORMAT_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 GET_COUNT_PROPERTIES = [
     DATABASE_TOOL_PROPERTY,
-    CONTAINER_TOOL_PROPERTY
+    CONTAINER_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 GET_SCHEMA_PROPERTIES = [
     DATABASE_TOOL_PROPERTY,
-    CONTAINER_TOOL_PROPERTY
+    CONTAINER_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 GET_SAMPLE_PROPERTIES = [
     DATABASE_TOOL_PROPERTY,
     CONTAINER_TOOL_PROPERTY,
     SAMPLE_N_TOOL_PROPERTY,
-    FIELDS_TOOL_PROPERTY
+    FIELDS_TOOL_PROPERTY,
+    FORMAT_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 VECTOR_SEARCH_PROPERTIES = [
@@ -63,17 +76,20 @@ VECTOR_SEARCH_PROPERTIES = [
     QUERY_TOOL_PROPERTY,
     TOP_K_TOOL_PROPERTY,
     SIMILARITY_THRESHOLD_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 HYBRID_SEARCH_PROPERTIES = [
     DATABASE_TOOL_PROPERTY,
     CONTAINER_TOOL_PROPERTY,
     QUERY_TOOL_PROPERTY,
-    TOP_K_TOOL_PROPERTY
+    TOP_K_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 EMBEDDINGS_PROPERTIES = [
     QUERY_TOOL_PROPERTY,
+    PROFILE_TOOL_PROPERTY,
 ]
 
 GET_DATABASES_PROPERTIES_JSON = json.dumps([prop.to_dict() for prop in GET_DATABASES_PROPERTIES])
@@ -86,103 +102,86 @@ VECTOR_SEARCH_PROPERTIES_JSON = json.dumps([prop.to_dict() for prop in VECTOR_SE
 HYBRID_SEARCH_PROPERTIES_JSON = json.dumps([prop.to_dict() for prop in HYBRID_SEARCH_PROPERTIES])
 EMBEDDINGS_PROPERTIES_JSON = json.dumps([prop.to_dict() for prop in EMBEDDINGS_PROPERTIES])
 
-cosmosClient = CosmosClient(
-    url=os.getenv("AZURE_COSMOSDB_ENDPOINT"),
-    credential=os.getenv("AZURE_COSMOSDB_KEY"),
-)
+# Async client shared by every invocation of this worker process. The triggers are
+# async, so they run on the worker's event loop and do not hold a thread while they
+# wait on Cosmos DB or Azure OpenAI.
+cosmosClient = shared_client(os.getenv("AZURE_COSMOSDB_ENDPOINT"), os.getenv("AZURE_COSMOSDB_KEY"), asynchronous=True)
+# Queries and result shapes shared with the container server; repeated
+# field-filter lookups are served from the document cache
+document_cache = DocumentCache(on_event=record_document_cache) if DOCUMENT_CACHE_ENABLED else None
+data = AsyncCosmosData(cosmosClient, response_hook=record_request_charge, document_cache=document_cache,
+                       segment=segment)
+
+def tool_arguments(req: str) -> Dict[str, Any]:
+    """
+    Arguments of an MCP tool invocation, parsed once per call.
+    """
+    return json.loads(req).get("arguments", {})
 
-def get_count_of_documents(database: str, collection: str):
+async def get_count_of_documents(database: str, collection: str):
     """
     Get the count of documents in the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        documentIterator: ItemPaged[Dict[str, Any]] = container.query_items(
-            query="SELECT VALUE COUNT(1) FROM c",
-            enable_cross_partition_query=True,
-        )
-        count = documentIterator.next()
-        return {"result": str(count), "query": "SELECT VALUE COUNT(1) FROM c"}
+        return await data.count(database, collection)
     except Exception as e:
-        print(f"Error retrieving document count: {e}")
+        logger.error(f"Error retrieving document count: {e}")
         return None
 
-def get_document_by_field_filter(database: str, collection: str, field: str, value: str, fields: str =""):
+async def get_document_by_field_filter(database: str, collection: str, field: str, value: str, fields: str = ""):
     """
     Get a document from the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        fields = list(map(lambda x: f"c.{x}", fields.split(","))) if fields != "" else ["*"]
-        result: ItemPaged[Dict[str, Any]] = container.query_items(
-            query=f'SELECT {",".join(fields)} FROM c WHERE c.{field} = "{value}"',
-            enable_cross_partition_query=True,
-        )
-        data = result.next()
-        return {"result": data, "query": f'SELECT {",".join(fields)} FROM c WHERE c.{field} = "{value}"'}
+        return await data.document_by_field(database, collection, field, value, fields)
     except Exception as e:
-        print(f"Error retrieving document: {e}")
+        logger.error(f"Error retrieving document: {e}")
         return None
 
-def get_sample_documents(database: str, collection: str, n_sample = 5, fields: str = ""):
+async def get_sample_documents(database: str, collection: str, n_sample = 5, fields: str = ""):
     """
     Get a document from the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        fields = list(map(lambda x: f"c.{x}", fields.split(","))) if fields != "" else ["*"]
-        result: ItemPaged[Dict[str, Any]] = container.query_items(
-            query=f'SELECT TOP {n_sample} {",".join(fields)} FROM c',
-            enable_cross_partition_query=True,
-        )
-        results = []
-        for item in result:
-            results.append(item)
-        return {"result": results, "query": f'SELECT TOP {n_sample} {",".join(fields)} FROM c'}
+        return await data.sample_documents(database, collection, n_sample, fields)
     except Exception as e:
-        print(f"Error retrieving document: {e}")
+        logger.error(f"Error retrieving document: {e}")
         return None
 
-def get_collection_schema(database: str, collection: str):
+async def get_collection_schema(database: str, collection: str):
     """
     Get the schema of the specified database and collection.
     """
     try:
-        database_proxy = cosmosClient.get_database_client(database)
-        container = database_proxy.get_container_client(collection)
-        documentIterator: ItemPaged[Dict[str, Any]] = container.query_items(
-            query="SELECT TOP 1 * FROM c",
-            enable_cross_partition_query=True,
-        )
-        data = documentIterator.next()
-        schema = {}
-        for key in data.keys():
-            if key not in ["_rid", "_self", "_etag", "_attachments", "_ts"]:
-                schema[key] = type(data[key]).__name__
-        return {"result": schema, "query": "SELECT TOP 1 * FROM c"}
+        return await data.schema(database, collection)
     except Exception as e:
-        print(f"Error retrieving collection schema: {e}")
+        logger.error(f"Error retrieving collection schema: {e}")
         return None
-    
-# Function to perform vector search in container
-def cdb_vector_search(container_passage: ContainerProxy, query_vector, top_k=5):
-    # Perform vector search
-    return container_passage.query_items( 
-            query='SELECT TOP @top_k c.pid, c.passage, VectorDistance(c.embedding,@embedding) AS SimilarityScore FROM c ORDER BY VectorDistance(c.embedding,@embedding)', 
-            parameters=[ 
-                {"name": "@embedding", "value": query_vector},
-                {"name": "@top_k", "value": top_k},
-            ], enable_cross_partition_query=True)
 
-# Function to perform hybrid search in container
-def cdb_hybrid_search(container_passage: ContainerProxy, query_text, query_vector, top_k=5):
-    query = f'SELECT TOP {top_k} c.pid, c.passage FROM c ORDER BY RANK RRF(FullTextScore(c.passage, {query_text.split()}), VectorDistance(c.embedding, {query_vector}))'
-    return container_passage.query_items(
-            query = query, 
-            enable_cross_partition_query=True)
+async def warm_up():
+    """
+    Open the Cosmos DB and Azure OpenAI connections of this worker before it takes
+    traffic, so the first tool calls do not pay for connection setup. Azure OpenAI
+    is reached with a one-token embedding request; the client alone connects lazily.
+    """
+    tokenizer.encode("warm up")
+    async for _ in cosmosClient.list_databases(response_hook=record_request_charge):
+        pass
+    try:
+        await generate_embeddings_async("warm")
+    except Exception as e:
+        logger.warning(f"Azure OpenAI warm-up request failed: {e}")
+
+@app.warm_up_trigger("warmup")
+async def warmup(warmup) -> None:
+    """
+    Runs when the platform adds an instance (Premium and Flex Consumption plans).
+    """
+    try:
+        await warm_up()
+        logger.info("Worker warmed up")
+    except Exception as e:
+        logger.error(f"Error warming up the worker: {e}")
     
 @app.generic_trigger(
     arg_name="req",
@@ -191,16 +190,17 @@ def cdb_hybrid_search(container_passage: ContainerProxy, query_text, query_vecto
     description="Get all databases in the Cosmos DB account.",
     toolProperties=GET_DATABASES_PROPERTIES_JSON,
 )
-def get_databases(req: str) -> str:
+@instrument_tool("get_databases")
+async def get_databases(req: str) -> str:
     """
     Get all databases in the Cosmos DB account.
     """
     try:
-        databases = cosmosClient.list_databases()
-        database_list = [db['id'] for db in databases]
+        databases = cosmosClient.list_databases(response_hook=record_request_charge)
+        database_list = [db['id'] async for db in databases]
         return ",".join(database_list)
     except Exception as e:
-        print(f"Error retrieving databases: {e}")
+        logger.error(f"Error retrieving databases: {e}")
         return str(e)
     
 @app.generic_trigger(
@@ -210,10 +210,11 @@ def get_databases(req: str) -> str:
     description="Get all containers in the specified database.",
     toolProperties=GET_CONTAINER_PROPERTIES_JSON,
 )
-def get_collections_of_database(req: str) -> str:
-    db_client = cosmosClient.get_database_client(json.loads(req)["arguments"]["database"])
-    containers = db_client.list_containers()
-    return [container['id'] for container in containers]
+@instrument_tool("get_containers")
+async def get_collections_of_database(req: str) -> str:
+    db_client = cosmosClient.get_database_client(tool_arguments(req)["database"])
+    containers = db_client.list_containers(response_hook=record_request_charge)
+    return [container['id'] async for container in containers]
 
 @app.generic_trigger(
     arg_name="req",
@@ -222,14 +223,16 @@ def get_collections_of_database(req: str) -> str:
     description="Get a document from the specified database and collection by field filter.",
     toolProperties=GET_COLLECTION_PROPERTIES_JSON,
 )
-def get_document_by_field_filter_tool(req: str) -> str:
-    document = get_document_by_field_filter(json.loads(req)["arguments"]["database"],
-                                               json.loads(req)["arguments"]["container"],
-                                               json.loads(req)["arguments"]["field"],
-                                               json.loads(req)["arguments"]["value"],
-                                               json.loads(req)["arguments"]["fields"])
+@instrument_tool("get_document_by_field_filter")
+async def get_document_by_field_filter_tool(req: str) -> str:
+    arguments = tool_arguments(req)
+    document = await get_document_by_field_filter(arguments["database"],
+                                                  arguments["container"],
+                                                  arguments["field"],
+                                                  arguments["value"],
+                                                  arguments.get("fields", ""))
     if document:
-        return document
+        return encode_result(document, arguments.get("format"), on_size=record_result_size)
     else:
         return "Document not found"
     
@@ -240,9 +243,10 @@ def get_document_by_field_filter_tool(req: str) -> str:
     description="Get the count of documents in the specified database and collection.",
     toolProperties=GET_COUNT_PROPERTIES_JSON,
 )
-def get_count_of_documents_tool(req: str) -> str:
-    count = get_count_of_documents(json.loads(req)["arguments"]["database"],
-                                   json.loads(req)["arguments"]["container"])
+@instrument_tool("get_count_of_documents")
+async def get_count_of_documents_tool(req: str) -> str:
+    arguments = tool_arguments(req)
+    count = await get_count_of_documents(arguments["database"], arguments["container"])
     if count:
         return count
     else:
@@ -255,9 +259,10 @@ def get_count_of_documents_tool(req: str) -> str:
     description="Get the schema of the specified database and collection.",
     toolProperties=GET_SCHEMA_PROPERTIES_JSON,
 )
-def get_collection_schema_tool(req: str) -> str:
-    schema = get_collection_schema(json.loads(req)["arguments"]["database"],
-                                   json.loads(req)["arguments"]["container"])
+@instrument_tool("get_collection_schema")
+async def get_collection_schema_tool(req: str) -> str:
+    arguments = tool_arguments(req)
+    schema = await get_collection_schema(arguments["database"], arguments["container"])
     if schema:
         return schema
     else:
@@ -270,19 +275,22 @@ def get_collection_schema_tool(req: str) -> str:
     description="Get a sample document from the specified database and collection.",
     toolProperties=GET_SAMPLE_PROPERTIES_JSON,
 )
-def get_sample_documents_tool(req):
+@instrument_tool("get_sample_documents")
+async def get_sample_documents_tool(req):
     """
     Get a sample document from the specified database and collection.
     """
     try:
-        database = json.loads(req)["arguments"]["database"]
-        container = json.loads(req)["arguments"]["container"]
-        n_sample = json.loads(req)["arguments"]["n"]
-        fields = json.loads(req)["arguments"]["fields"] if "fields" in json.loads(req)["arguments"] else ""
+        arguments = tool_arguments(req)
+        database = arguments["database"]
+        container = arguments["container"]
+        n_sample = arguments["n"]
+        fields = arguments.get("fields", "")
 
-        return get_sample_documents(database, container, n_sample, fields)
+        documents = await get_sample_documents(database, container, n_sample, fields)
+        return encode_result(documents, arguments.get("format"), on_size=record_result_size)
     except Exception as e:
-        print(f"Error retrieving sample document: {e}")
+        logger.error(f"Error retrieving sample document: {e}")
         return None
     
 @app.generic_trigger(
@@ -292,30 +300,23 @@ def get_sample_documents_tool(req):
     description="Perform vector search in the specified database and collection.",
     toolProperties=VECTOR_SEARCH_PROPERTIES_JSON,
 )
-def vector_search_tool(req: str) -> str:
+@instrument_tool("vector_search")
+async def vector_search_tool(req: str) -> str:
     """
     Perform vector search in the specified database and collection.
     """
     try:
-        database = json.loads(req)["arguments"]["database"]
-        container = json.loads(req)["arguments"]["container"]
-        query = json.loads(req)["arguments"]["query"]
-        top_k = json.loads(req)["arguments"]["top_k"] if "top_k" in json.loads(req)["arguments"] else 5
-        similarity_threshold = json.loads(req)["arguments"]["similarity_threshold"] if "similarity_threshold" in json.loads(req)["arguments"] else 0.3
-
-        database_proxy = cosmosClient.get_database_client(database)
-        container_passage = database_proxy.get_container_client(container)
-        query_vector = generate_embeddings(query)
+        arguments = tool_arguments(req)
+        database = arguments["database"]
+        container = arguments["container"]
+        query = arguments["query"]
+        top_k = arguments.get("top_k", 5)
+        similarity_threshold = float(arguments.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD))
 
-        results = cdb_vector_search(container_passage, query_vector, top_k)
-        result = []
-        for item in results:
-            if float(item['SimilarityScore']) >= similarity_threshold:
-                result.append(item['passage'])
-
-        return {"result": result, "query": f"SELECT TOP @top_k c.pid, c.passage FROM c ORDER BY VectorDistance(c.embedding,@embedding)"}
+        query_vector = await generate_embeddings_async(query)
+        return await data.vector_search(database, container, query_vector, top_k, similarity_threshold)
     except Exception as e:
-        print(f"Error performing vector search: {e}")
+        logger.error(f"Error performing vector search: {e}")
         return None
     
 @app.generic_trigger(
@@ -325,28 +326,22 @@ def vector_search_tool(req: str) -> str:
     description="Perform hybrid search in the specified database and collection.",
     toolProperties=HYBRID_SEARCH_PROPERTIES_JSON,
 )
-def hybrid_search_tool(req: str) -> str:
+@instrument_tool("hybrid_search")
+async def hybrid_search_tool(req: str) -> str:
     """
     Perform hybrid search in the specified database and collection.
     """
     try:
-        database = json.loads(req)["arguments"]["database"]
-        container = json.loads(req)["arguments"]["container"]
-        query = json.loads(req)["arguments"]["query"]
-        top_k = json.loads(req)["arguments"]["top_k"] if "top_k" in json.loads(req)["arguments"] else 5
-
-        database_proxy = cosmosClient.get_database_client(database)
-        container_passage = database_proxy.get_container_client(container)
-        query_vector = generate_embeddings(query)
-
-        results = cdb_hybrid_search(container_passage, query, query_vector, top_k)
-        result = []
-        for item in results:
-            result.append(item['passage'])
+        arguments = tool_arguments(req)
+        database = arguments["database"]
+        container = arguments["container"]
+        query = arguments["query"]
+        top_k = arguments.get("top_k", 5)
 
-        return {"result": result, "query": f"SELECT TOP @top_k c.pid, c.passage FROM c ORDER BY RANK RRF(FullTextScore(c.passage, ['your','query', 'here']), VectorDistance(c.embedding, @embedding))"}
+        query_vector = await generate_embeddings_async(query)
+        return await data.hybrid_search(database, container, query, query_vector, top_k)
     except Exception as e:
-        print(f"Error performing hybrid search: {e}")
+        logger.error(f"Error performing hybrid search: {e}")
         return None
     
 @app.generic_trigger(
@@ -356,14 +351,15 @@ def hybrid_search_tool(req: str) -> str:
     description="Get the embeddings for the specified input.",
     toolProperties=EMBEDDINGS_PROPERTIES_JSON,
 )
-def get_embeddings_tool(req: str) -> str:
+@instrument_tool("get_embeddings")
+async def get_embeddings_tool(req: str) -> str:
     """
     Get the embeddings for the specified input.
     """
     try:
-        query = json.loads(req)["arguments"]["query"]
-        embeddings = generate_embeddings(query)
-        return {"result": embeddings, "embedding_model": os.getenv("openai_embeddings_model")}
+        query = tool_arguments(req)["query"]
+        embeddings = await generate_embeddings_async(query)
+        return {"result": as_list(embeddings), "embedding_model": os.getenv("openai_embeddings_model")}
     except Exception as e:
-        print(f"Error generating embeddings: {e}")
+        logger.error(f"Error generating embeddings: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Performance conformance suite for the two MCP server hosts.
+
+Runs the same tool calls against the container server (azure_containers/cosmosdb)
+and the Azure Functions server (azure_functions/cosmosdb/python), each in its own
+process with the fake Cosmos DB client and the fake Azure OpenAI server, and checks
+for every case that:
+
+    - both hosts return the same payload,
+    - the first (cold) call stays within the case's budget of Cosmos DB requests,
+    - the p95 latency of the --iterations calls that follow stays within --latency-budget-ms.
+
+Both hosts run their queries through cosmosdb_core, so a difference here means a
+host bypasses or wraps the shared data access in a way the other does not.
+
+    python benchmarks/conformance.py
+    python benchmarks/conformance.py --cosmos-latency-ms 20 --latency-budget-ms 150
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from typing import Dict, Any, List
+
+from run import (CONTAINER, DATABASE, FUNCTIONS_DIR, SERVER_DIR, Services, add_shared_arguments,
+                 fake_environment, install_fake_cosmos, percentile)
+
+QUERY = "how are passages indexed"
+
+# Each case names the tool and arguments on both hosts and the most Cosmos DB
+# requests its first call may make
+CASES: List[Dict[str, Any]] = [
+    {
+        "case": "databases",
+        "container": ("get_databases", {}),
+        "functions": ("get_databases", {}),
+        "max_requests": 1,
+    },
+    {
+        "case": "count",
+        "container": ("get_count_of_documents", {"database": DATABASE, "container": CONTAINER}),
+        "functions": ("get_count_of_documents_tool", {"database": DATABASE, "container": CONTAINER}),
+        "max_requests": 1,
+    },
+    {
+        "case": "schema",
+        "container": ("get_collection_schema", {"database": DATABASE, "container": CONTAINER}),
+        "functions": ("get_collection_schema_tool", {"database": DATABASE, "container": CONTAINER}),
+        "max_requests": 1,
+    },
+    {
+        "case": "sample",
+        "container": ("get_sample_documents", {"database": DATABASE, "container": CONTAINER, "n": 3, "fields": ["pid", "passage"]}),
+        "functions": ("get_sample_documents_tool", {"database": DATABASE, "container": CONTAINER, "n": 3, "fields": "pid,passage"}),
+        "max_requests": 1,
+    },
+    {
+        "case": "document",
+        "container": ("get_document_by_field_filter", {"database": DATABASE, "container": CONTAINER, "field": "pid", "value": "7", "fields": "pid, passage"}),
+        "functions": ("get_document_by_field_filter_tool", {"database": DATABASE, "container": CONTAINER, "field": "pid", "value": "7", "fields": "pid,passage"}),
+        "max_requests": 1,
+    },
+    {
+        "case": "document_by_id",
+        "container": ("get_document_by_field_filter", {"database": DATABASE, "container": CONTAINER, "field": "id", "value": "7"}),
+        "functions": ("get_document_by_field_filter_tool", {"database": DATABASE, "container": CONTAINER, "field": "id", "value": "7"}),
+        # Reads the partition key path once, then revalidates with point reads
+        "max_requests": 2,
+    },
+    {
+        "case": "vector_search",
+        "container": ("do_vector_search", {"database": DATABASE, "container": CONTAINER, "query": QUERY}),
+        "functions": ("vector_search_tool", {"database": DATABASE, "container": CONTAINER, "query": QUERY}),
+        "max_requests": 1,
+    },
+    {
+        "case": "vector_search_all",
+        "container": ("do_vector_search", {"database": DATABASE, "container": CONTAINER, "query": QUERY, "top_k": 3, "similarity_threshold": 0.0}),
+        "functions": ("vector_search_tool", {"database": DATABASE, "container": CONTAINER, "query": QUERY, "top_k": 3, "similarity_threshold": 0.0}),
+        "max_requests": 1,
+    },
+    {
+        "case": "hybrid_search",
+        "container": ("do_hybrid_search", {"database": DATABASE, "container": CONTAINER, "query": QUERY, "top_k": 5}),
+        "functions": ("hybrid_search_tool", {"database": DATABASE, "container": CONTAINER, "query": QUERY, "top_k": 5}),
+        "max_requests": 1,
+    },
+]
+
+
+def _normalize(result) -> Any:
+    # Round trip through JSON so both hosts' payloads compare as plain data
+    if isinstance(result, str):
+        try:
+            return json.loads(result)
+        except ValueError:
+            return result
+    return json.loads(json.dumps(result, default=str))
+
+
+def container_invoker():
+    sys.path.insert(0, SERVER_DIR)
+    import cosmosdb_mcp
+
+    cosmosdb_mcp.catalog.refresh()
+
+    async def invoke(name: str, arguments: Dict[str, Any]):
+        content = await cosmosdb_mcp.mcp.call_tool(name, arguments)
+        texts = [item.text for item in content]
+        return _normalize(texts[0] if len(texts) == 1 else texts)
+
+    return invoke, None
+
+
+def functions_invoker():
+    sys.path.insert(0, FUNCTIONS_DIR)
+    import function_app
+
+    handlers = {}
+    for function in function_app.app.get_functions():
+        handler = function.get_user_function()
+        handlers[handler.__name__] = handler
+
+    async def invoke(name: str, arguments: Dict[str, Any]):
+        return _normalize(await handlers[name](json.dumps({"arguments": arguments})))
+
+    return invoke, function_app.warm_up
+
+
+def run_host(args: argparse.Namespace):
+    """
+    Run every case on one host (used as a child process); prints the measurements as JSON.
+    """
+    os.environ.update(fake_environment(args.openai_url))
+    fake_cosmos = install_fake_cosmos(args)
+    invoke, warm_up = container_invoker() if args.host == "container" else functions_invoker()
+
+    async def main():
+        if warm_up is not None:
+            await warm_up()
+        report = {}
+        for case in CASES:
+            name, arguments = case[args.host]
+            requests, charge = fake_cosmos.stats.requests, fake_cosmos.stats.request_charge
+            started = time.perf_counter()
+            result = await invoke(name, arguments)
+            first = time.perf_counter() - started
+            first_requests = fake_cosmos.stats.requests - requests
+            first_charge = fake_cosmos.stats.request_charge - charge
+            latencies = []
+            requests, charge = fake_cosmos.stats.requests, fake_cosmos.stats.request_charge
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                await invoke(name, arguments)
+                latencies.append(time.perf_counter() - started)
+            repeats = max(1, args.iterations)
+            report[case["case"]] = {
+                "result": result,
+                "requests": first_requests,
+                "request_charge": round(first_charge, 2),
+                "first_ms": round(first * 1000.0, 2),
+                "repeat_requests": round((fake_cosmos.stats.requests - requests) / repeats, 2),
+                "repeat_request_charge": round((fake_cosmos.stats.request_charge - charge) / repeats, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000.0, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000.0, 2),
+            }
+        return report
+
+    print(json.dumps(asyncio.run(main())))
+
+
+def _comparable(value):
+    # System properties (_etag, _ts, ...) differ between the hosts' separately seeded stores
+    if isinstance(value, dict):
+        return {key: _comparable(item) for key, item in value.items() if not key.startswith("_")}
+    if isinstance(value, list):
+        return [_comparable(item) for item in value]
+    return value
+
+
+def check(reports: Dict[str, Dict[str, Any]], latency_budget_ms: float) -> List[str]:
+    failures = []
+    for case in CASES:
+        name = case["case"]
+        container, functions = reports["container"][name], reports["functions"][name]
+        if _comparable(container["result"]) != _comparable(functions["result"]):
+            failures.append(f"{name}: results differ: container {json.dumps(container['result'])[:200]} "
+                            f"functions {json.dumps(functions['result'])[:200]}")
+        for host, measured in (("container", container), ("functions", functions)):
+            if measured["result"] is None:
+                failures.append(f"{name}: {host} returned no result")
+            if measured["requests"] > case["max_requests"]:
+                failures.append(f"{name}: {host} made {measured['requests']} Cosmos DB requests "
+                                f"(budget {case['max_requests']})")
+            if measured["p95_ms"] > latency_budget_ms:
+                failures.append(f"{name}: {host} p95 {measured['p95_ms']} ms (budget {latency_budget_ms} ms)")
+    return failures
+
+
+def run_suite(args: argparse.Namespace) -> int:
+    services = Services(args, with_server=False)
+    try:
+        reports = {}
+        # The hosts import modules of the same names, so each runs in its own process
+        for host, directory in (("container", SERVER_DIR), ("functions", FUNCTIONS_DIR)):
+            command = [sys.executable, os.path.abspath(__file__), "host", "--host", host,
+                       "--openai-url", services.openai_url, "--iterations", str(args.iterations),
+                       "--cosmos-latency-ms", str(args.cosmos_latency_ms), "--cosmos-query-ru", str(args.cosmos_query_ru),
+                       "--passages", str(args.passages), "--dimensions", str(args.dimensions)]
+            output = subprocess.run(command, cwd=directory, stdout=subprocess.PIPE, text=True)
+            if output.returncode != 0:
+                raise RuntimeError(f"The {host} host exited with code {output.returncode}")
+            reports[host] = json.loads(output.stdout.strip().splitlines()[-1])
+    finally:
+        services.close()
+
+    failures = check(reports, args.latency_budget_ms)
+    summary = {
+        host: {name: {key: value for key, value in measured.items() if key != "result"}
+               for name, measured in report.items()}
+        for host, report in reports.items()
+    }
+    print(json.dumps({"cases": summary, "failures": failures}, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    suite = commands.add_parser("suite", help="Run the suite against both hosts (default).")
+    suite.add_argument("--iterations", type=int, default=20, help="Calls per case and host after the first one.")
+    suite.add_argument("--latency-budget-ms", type=float, default=200.0)
+    suite.add_argument("--embedding-latency-ms", type=float, default=10.0)
+    suite.add_argument("--first-token-latency-ms", type=float, default=0.0)
+    suite.add_argument("--token-interval-ms", type=float, default=0.0)
+    add_shared_arguments(suite)
+
+    host = commands.add_parser("host", help=argparse.SUPPRESS)
+    host.add_argument("--host", choices=["container", "functions"], required=True)
+    host.add_argument("--openai-url", required=True)
+    host.add_argument("--iterations", type=int, required=True)
+    add_shared_arguments(host)
+
+    argv = sys.argv[1:]
+    if not argv or argv[0].startswith("-"):
+        argv = ["suite"] + argv
+    args = parser.parse_args(argv)
+    if args.command == "host":
+        run_host(args)
+    else:
+        sys.exit(run_suite(args))
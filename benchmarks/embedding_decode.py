@@ -0,0 +1,104 @@
+"""
+Parse time and memory per vector of embeddings responses, as lists of floats and as
+base64 decoded into float32 buffers.
+
+Each variant parses the same Azure OpenAI embeddings response body, built by
+fake_openai.py, the way the clients and servers read it:
+
+    list          encoding_format="float": json.loads, one Python float per dimension
+    list_numpy    the same, then np.asarray(float32)
+    base64        encoding_format="base64": json.loads, then cosmosdb_core.vectors.decode
+                  (NumPy float32, or array("f") without NumPy)
+    base64_array  base64 decoded into array("f")
+
+Memory per vector is the traced allocation of the parsed vectors (tracemalloc),
+divided by their count.
+
+    python benchmarks/embedding_decode.py
+    python benchmarks/embedding_decode.py --dimensions 1536 --batch 16 --iterations 50
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+from array import array
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_openai import fake_embedding
+from cosmosdb_core.vectors import decode, np
+
+
+def response_body(dimensions: int, batch: int, encoding_format: str) -> str:
+    data = []
+    for index in range(batch):
+        vector = fake_embedding(f"text {index}", dimensions)
+        if encoding_format == "base64":
+            vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+        data.append({"object": "embedding", "index": index, "embedding": vector})
+    return json.dumps({"object": "list", "data": data, "model": "embeddings"})
+
+
+def _base64_array(embedding: str) -> array:
+    vector = array("f")
+    vector.frombytes(base64.b64decode(embedding))
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+
+VARIANTS = {
+    "list": ("float", lambda embedding: embedding),
+    "base64": ("base64", decode),
+    "base64_array": ("base64", _base64_array),
+}
+if np is not None:
+    VARIANTS["list_numpy"] = ("float", lambda embedding: np.asarray(embedding, dtype=np.float32))
+
+
+def parse(body: str, convert):
+    return [convert(item["embedding"]) for item in json.loads(body)["data"]]
+
+
+def measure(name: str, dimensions: int, batch: int, iterations: int):
+    encoding_format, convert = VARIANTS[name]
+    body = response_body(dimensions, batch, encoding_format)
+    parse(body, convert)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        parse(body, convert)
+    seconds = (time.perf_counter() - started) / (iterations * batch)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    vectors = parse(body, convert)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del vectors
+    return {
+        "variant": name,
+        "response_bytes_per_vector": round(len(body) / batch),
+        "parse_us_per_vector": round(seconds * 1e6, 1),
+        "memory_bytes_per_vector": round(allocated / batch),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--batch", type=int, default=16, help="Embeddings per response.")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [measure(name, args.dimensions, args.batch, args.iterations) for name in VARIANTS]
+    print(json.dumps({"dimensions": args.dimensions, "batch": args.batch, "results": results}, indent=2))
@@ -0,0 +1,543 @@
+"""
+In-process stand-in for the azure-cosmos CosmosClient used by the benchmarks.
+
+It implements the subset of the SDK used by the servers and clients (databases,
+containers, queries, point reads with If-None-Match, writes, all-or-nothing batches with
+create conflicts and If-Match etags, and the change feed) on top of
+in-memory dictionaries, plus an azure.cosmos.aio flavour that waits with
+asyncio.sleep instead of blocking its thread. Every request sleeps for a configurable latency, reports
+a configurable RU charge through response_hook and last_response_headers, and is
+counted so the benchmark can report backend load.
+
+Queries are not parsed as SQL. The features the app relies on are recognized
+from the query text: VALUE COUNT(1), DISTINCT VALUE c.<field>, TOP n, equality
+filters on c.<field>, NOT IS_DEFINED(c.<field>), ARRAY_CONTAINS(@ids, c.id),
+ORDER BY c.<field> [ASC|DESC] and ORDER BY VectorDistance(c.<field>, @param), scored
+with the distance function of the container's vector embedding policy.
+"""
+import asyncio
+import copy
+import math
+import re
+import threading
+import time
+import uuid
+
+from typing import Dict, Any, List, Optional
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosResourceExistsError, CosmosResourceNotFoundError
+
+
+class FakeCosmosSettings:
+    latency_ms = 5.0
+    query_charge = 2.8
+    charge_per_document = 0.3
+    write_charge = 6.0
+    read_charge = 1.0
+
+
+class FakeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_charge = 0.0
+
+    def record(self, charge: float):
+        with self.lock:
+            self.requests += 1
+            self.request_charge += charge
+
+
+stats = FakeStats()
+# Set while an async fake runs the sync implementation: it has already awaited the latency
+_async_call = threading.local()
+_store: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_store_lock = threading.RLock()
+
+
+def seed(database: str, container: str, documents: List[Dict[str, Any]], partition_key_path: str = "/id",
+         vector_embedding_policy: Optional[Dict[str, Any]] = None):
+    with _store_lock:
+        db = _store.setdefault(database, {})
+        entry = db.setdefault(container, {"partition_key": partition_key_path, "items": {}, "lsn": 0})
+        if vector_embedding_policy is not None:
+            entry["vector_embedding_policy"] = vector_embedding_policy
+        for document in documents:
+            _write(entry, document)
+
+
+def _write(entry: Dict[str, Any], document: Dict[str, Any]) -> Dict[str, Any]:
+    entry["lsn"] += 1
+    document = copy.deepcopy(document)
+    document.setdefault("id", str(uuid.uuid4()))
+    document["_etag"] = f'"{uuid.uuid4()}"'
+    document["_ts"] = int(time.time())
+    document["_lsn"] = entry["lsn"]
+    entry["items"][document["id"]] = document
+    return document
+
+
+def _respond(connection, response_hook, charge: float, result=None, extra: Optional[Dict[str, str]] = None):
+    if not getattr(_async_call, "active", False):
+        time.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+    headers = {"x-ms-request-charge": str(round(charge, 2))}
+    headers.update(extra or {})
+    connection.last_response_headers = headers
+    stats.record(charge)
+    if response_hook is not None:
+        response_hook(headers, result)
+
+
+class _Connection:
+    def __init__(self):
+        self.last_response_headers: Dict[str, str] = {}
+
+
+class FakeItemPaged:
+    def __init__(self, pages: List[List[Dict[str, Any]]], on_page):
+        self._pages = pages
+        self._on_page = on_page
+        self._iterator = None
+
+    def by_page(self, continuation_token=None):
+        for page in self._pages:
+            self._on_page(page)
+            yield iter(page)
+
+    def __iter__(self):
+        for page in self.by_page():
+            for item in page:
+                yield item
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self)
+        return next(self._iterator)
+
+    next = __next__
+
+
+def _param(parameters, name):
+    for parameter in parameters or []:
+        if parameter["name"] == name:
+            return parameter["value"]
+    return None
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _distance(function: str, a, b) -> float:
+    if function == "dotproduct":
+        return sum(x * y for x, y in zip(a, b))
+    if function == "euclidean":
+        return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+    return _cosine(a, b)
+
+
+def _distance_function(policy: Optional[Dict[str, Any]], field: str) -> str:
+    for embedding in (policy or {}).get("vectorEmbeddings", []):
+        if embedding.get("path", "").strip("/") == field:
+            return embedding.get("distanceFunction", "cosine")
+    return "cosine"
+
+
+def _run_query(items: List[Dict[str, Any]], query: str, parameters,
+               vector_embedding_policy: Optional[Dict[str, Any]] = None) -> List[Any]:
+    # (NOT IS_DEFINED(c.field) OR c.field = value): applied here and removed from the other filters
+    for clause, field, value in re.findall(r'(\(NOT IS_DEFINED\(c\.(\w+)\) OR c\.\2\s*=\s*(@\w+|"[^"]*"|\'[^\']*\')\))', query):
+        expected = _param(parameters, value) if value.startswith("@") else value[1:-1]
+        items = [item for item in items if field not in item or item[field] == expected]
+        query = query.replace(clause, "")
+    for field, value in re.findall(r'c\.(\w+)\s*=\s*(@\w+|"[^"]*"|\'[^\']*\')', query):
+        expected = _param(parameters, value) if value.startswith("@") else value[1:-1]
+        items = [item for item in items if item.get(field) == expected]
+    contains = re.search(r"ARRAY_CONTAINS\((@\w+),\s*c\.(\w+)\)", query)
+    if contains:
+        allowed = set(_param(parameters, contains.group(1)) or [])
+        items = [item for item in items if item.get(contains.group(2)) in allowed]
+    for field in re.findall(r"NOT IS_DEFINED\(c\.(\w+)\)", query):
+        items = [item for item in items if field not in item]
+    if "COUNT(1)" in query:
+        return [len(items)]
+    distinct = re.search(r"SELECT DISTINCT VALUE c\.(\w+)", query)
+    if distinct:
+        return list(dict.fromkeys(item[distinct.group(1)] for item in items if distinct.group(1) in item))
+    order = re.search(r"ORDER BY\s+c\.(\w+)(?:\s+(ASC|DESC))?", query)
+    if order:
+        items = sorted(items, key=lambda item: item.get(order.group(1), ""), reverse=order.group(2) == "DESC")
+
+    vector = re.search(r"ORDER BY\s+VectorDistance\(c\.(\w+),\s*(@\w+|\[[^\]]*\])\)", query)
+    if vector is None:
+        vector = re.search(r"VectorDistance\(c\.(\w+),\s*(@\w+|\[[^\]]*\])\)", query) if "RANK RRF" in query else None
+    if vector:
+        field, reference = vector.groups()
+        query_vector = _param(parameters, reference) if reference.startswith("@") else [float(v) for v in reference.strip("[]").split(",") if v.strip()]
+        function = _distance_function(vector_embedding_policy, field)
+        scored = []
+        for item in items:
+            if isinstance(item.get(field), list) and query_vector is not None:
+                scored.append(dict(item, SimilarityScore=_distance(function, item[field], query_vector)))
+        # Euclidean distance sorts closest first, the similarities highest first
+        sign = 1 if function == "euclidean" else -1
+        items = sorted(scored, key=lambda item: sign * item["SimilarityScore"])
+
+    top = re.search(r"TOP\s+(@\w+|\d+)", query)
+    if top:
+        limit = _param(parameters, top.group(1)) if top.group(1).startswith("@") else int(top.group(1))
+        items = items[:int(limit)]
+    return [_project(item, query) for item in items]
+
+
+def _project(item: Dict[str, Any], query: str) -> Dict[str, Any]:
+    clause = re.search(r"SELECT\s+(?:TOP\s+\S+\s+)?(.*?)\s+FROM\s", query, re.S)
+    if clause is None or clause.group(1).strip() == "*":
+        return copy.deepcopy(item)
+    # Drop function arguments so the select list can be split on commas
+    flat = re.sub(r"\([^()]*\)", "", clause.group(1))
+    keys = []
+    for part in flat.split(","):
+        alias = re.search(r"AS\s+(\w+)", part)
+        field = re.match(r"\s*c\.(\w+)", part)
+        keys.append(alias.group(1) if alias else field.group(1) if field else None)
+    return {key: copy.deepcopy(item[key]) for key in keys if key is not None and key in item}
+
+
+class FakeContainerProxy:
+    def __init__(self, connection: _Connection, database: str, container: str):
+        self.client_connection = connection
+        self.database = database
+        self.id = container
+
+    def _entry(self) -> Dict[str, Any]:
+        with _store_lock:
+            entry = _store.get(self.database, {}).get(self.id)
+        if entry is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"Container {self.id} not found")
+        return entry
+
+    def read(self, populate_quota_info=None, **kwargs):
+        entry = self._entry()
+        extra = None
+        if populate_quota_info:
+            with _store_lock:
+                extra = {"x-ms-resource-usage": f"documentSize=0;documentsSize=0;documentsCount={len(entry['items'])}"}
+        _respond(self.client_connection, kwargs.get("response_hook"), FakeCosmosSettings.read_charge, extra=extra)
+        return self._properties(entry)
+
+    def _properties(self, entry=None) -> Dict[str, Any]:
+        entry = entry or self._entry()
+        return {"id": self.id, "partitionKey": {"paths": [entry["partition_key"]], "kind": "Hash"},
+                "indexingPolicy": entry.get("indexing_policy", {}),
+                "vectorEmbeddingPolicy": entry.get("vector_embedding_policy", {}),
+                "fullTextPolicy": entry.get("full_text_policy", {}),
+                "defaultTtl": entry.get("default_ttl")}
+
+    def query_items(self, query: str, parameters=None, response_hook=None, max_item_count=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            items = list(entry["items"].values())
+        results = _run_query(items, query, parameters, entry.get("vector_embedding_policy"))
+        page_size = max_item_count or 100
+        pages = [results[i:i + page_size] for i in range(0, len(results), page_size)] or [[]]
+        charge = lambda page: FakeCosmosSettings.query_charge + FakeCosmosSettings.charge_per_document * len(page)
+        return FakeItemPaged(pages, lambda page: _respond(self.client_connection, response_hook, charge(page), page))
+
+    def query_items_change_feed(self, continuation=None, start_time=None, max_item_count=None, **kwargs):
+        entry = self._entry()
+        since = int(continuation or 0)
+        with _store_lock:
+            items = sorted((i for i in entry["items"].values() if i["_lsn"] > since), key=lambda i: i["_lsn"])
+        page_size = max_item_count or 100
+        pages = [items[i:i + page_size] for i in range(0, len(items), page_size)] or [[]]
+
+        def on_page(page):
+            lsn = page[-1]["_lsn"] if page else since
+            _respond(self.client_connection, kwargs.get("response_hook"), FakeCosmosSettings.query_charge, page, {"etag": str(lsn)})
+        return FakeItemPaged([copy.deepcopy(page) for page in pages], on_page)
+
+    def read_item(self, item: str, partition_key=None, response_hook=None, etag=None, match_condition=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            document = entry["items"].get(item)
+        if document is None:
+            _respond(self.client_connection, response_hook, FakeCosmosSettings.read_charge)
+            raise CosmosResourceNotFoundError(status_code=404, message=f"Item {item} not found")
+        if match_condition == MatchConditions.IfModified and etag == document["_etag"]:
+            # 304 Not Modified: the SDK returns an empty item
+            _respond(self.client_connection, response_hook, FakeCosmosSettings.read_charge, None, {"etag": etag})
+            return {}
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.read_charge, document, {"etag": document["_etag"]})
+        return copy.deepcopy(document)
+
+    def create_item(self, body: Dict[str, Any], response_hook=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            if body.get("id") in entry["items"]:
+                raise CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+            document = _write(entry, body)
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.write_charge, document)
+        return copy.deepcopy(document)
+
+    def upsert_item(self, body: Dict[str, Any], response_hook=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            document = _write(entry, body)
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.write_charge, document)
+        return copy.deepcopy(document)
+
+    def replace_item(self, item: str, body: Dict[str, Any], response_hook=None, **kwargs):
+        return self.upsert_item(dict(body, id=item), response_hook=response_hook)
+
+    def patch_item(self, item: str, partition_key, patch_operations, response_hook=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            document = copy.deepcopy(entry["items"][item])
+            for operation in patch_operations:
+                field = operation["path"].strip("/")
+                if operation["op"] in ("add", "set", "replace"):
+                    document[field] = operation["value"]
+                elif operation["op"] == "remove":
+                    document.pop(field, None)
+                elif operation["op"] == "incr":
+                    document[field] = document.get(field, 0) + operation["value"]
+            document = _write(entry, document)
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.write_charge, document)
+        return copy.deepcopy(document)
+
+    def delete_item(self, item: str, partition_key=None, response_hook=None, **kwargs):
+        entry = self._entry()
+        with _store_lock:
+            entry["items"].pop(item, None)
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.write_charge)
+
+    def execute_item_batch(self, batch_operations, partition_key=None, response_hook=None, **kwargs):
+        entry = self._entry()
+        results = []
+        with _store_lock:
+            # All or nothing, like a transactional batch
+            failure = _batch_failure(entry, batch_operations)
+            if failure is not None:
+                index, status_code = failure
+                raise CosmosBatchOperationError(error_index=index, headers={}, status_code=status_code,
+                                                message=f"Batch operation {index} failed with status {status_code}",
+                                                operation_responses=[])
+            for operation, args, *_ in batch_operations:
+                if operation in ("upsert", "create"):
+                    results.append(_write(entry, args[0]))
+                elif operation == "replace":
+                    results.append(_write(entry, dict(args[1], id=args[0])))
+                elif operation == "delete":
+                    entry["items"].pop(args[0], None)
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.write_charge * len(batch_operations), results)
+        return results
+
+
+def _batch_failure(entry: Dict[str, Any], batch_operations) -> Optional[tuple]:
+    """
+    (index, status code) of the first batch operation that would fail, or None.
+    """
+    for index, (operation, args, *options) in enumerate(batch_operations):
+        if operation == "create" and args[0].get("id") in entry["items"]:
+            return index, 409
+        if operation == "replace":
+            current = entry["items"].get(args[0])
+            if current is None:
+                return index, 404
+            etag = (options[0] if options else {}).get("if_match_etag")
+            if etag is not None and etag != current["_etag"]:
+                return index, 412
+    return None
+
+
+class FakeDatabaseProxy:
+    def __init__(self, connection: _Connection, database: str):
+        self.client_connection = connection
+        self.id = database
+
+    def list_containers(self, response_hook=None, **kwargs):
+        with _store_lock:
+            if self.id not in _store:
+                raise CosmosResourceNotFoundError(status_code=404, message=f"Database {self.id} not found")
+            names = list(_store[self.id].keys())
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.query_charge)
+        # Like the service, list_containers returns the full container properties
+        return iter([self.get_container_client(name)._properties() for name in names])
+
+    def get_container_client(self, container: str) -> FakeContainerProxy:
+        return FakeContainerProxy(self.client_connection, self.id, container)
+
+    def create_container_if_not_exists(self, id: str, partition_key=None, response_hook=None, **kwargs):
+        with _store_lock:
+            db = _store.setdefault(self.id, {})
+            if id not in db:
+                path = getattr(partition_key, "path", None) or (partition_key or {}).get("paths", ["/id"])[0]
+                db[id] = {"partition_key": path, "items": {}, "lsn": 0,
+                          "indexing_policy": kwargs.get("indexing_policy", {}),
+                          "vector_embedding_policy": kwargs.get("vector_embedding_policy", {}),
+                          "full_text_policy": kwargs.get("full_text_policy", {}),
+                          "default_ttl": kwargs.get("default_ttl")}
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.read_charge)
+        return self.get_container_client(id)
+
+    create_container = create_container_if_not_exists
+
+    def delete_container(self, container: str, **kwargs):
+        with _store_lock:
+            _store.get(self.id, {}).pop(container, None)
+
+
+class FakeCosmosClient:
+    def __init__(self, url: str = None, credential=None, **kwargs):
+        self.client_connection = _Connection()
+
+    def list_databases(self, response_hook=None, **kwargs):
+        with _store_lock:
+            names = list(_store.keys())
+        _respond(self.client_connection, response_hook, FakeCosmosSettings.query_charge)
+        return iter([{"id": name} for name in names])
+
+    def get_database_client(self, database: str) -> FakeDatabaseProxy:
+        return FakeDatabaseProxy(self.client_connection, database)
+
+    def create_database_if_not_exists(self, id: str, **kwargs) -> FakeDatabaseProxy:
+        with _store_lock:
+            _store.setdefault(id, {})
+        _respond(self.client_connection, kwargs.get("response_hook"), FakeCosmosSettings.read_charge)
+        return self.get_database_client(id)
+
+
+def _without_sleep(fn, *args, **kwargs):
+    _async_call.active = True
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _async_call.active = False
+
+
+class FakeAsyncItemPaged:
+    def __init__(self, query):
+        # The query is evaluated in a thread, like the service does it off the client's loop
+        self._query = query
+        self._iterator = None
+
+    async def _items(self):
+        paged = await asyncio.to_thread(self._query)
+        for page in paged._pages:
+            await asyncio.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+            _without_sleep(paged._on_page, page)
+            for item in page:
+                yield item
+
+    def __aiter__(self):
+        return self._items()
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = self._items()
+        return await self._iterator.__anext__()
+
+
+class FakeAsyncContainerProxy:
+    def __init__(self, container: FakeContainerProxy):
+        self._sync = container
+        self.id = container.id
+
+    async def _call(self, name: str, *args, **kwargs):
+        await asyncio.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+        return _without_sleep(getattr(self._sync, name), *args, **kwargs)
+
+    def query_items(self, query: str, **kwargs):
+        return FakeAsyncItemPaged(lambda: self._sync.query_items(query, **kwargs))
+
+    def query_items_change_feed(self, **kwargs):
+        return FakeAsyncItemPaged(lambda: self._sync.query_items_change_feed(**kwargs))
+
+    async def read(self, **kwargs):
+        return await self._call("read", **kwargs)
+
+    async def read_item(self, item: str, partition_key=None, **kwargs):
+        return await self._call("read_item", item, partition_key=partition_key, **kwargs)
+
+    async def create_item(self, body: Dict[str, Any], **kwargs):
+        return await self._call("create_item", body, **kwargs)
+
+    async def upsert_item(self, body: Dict[str, Any], **kwargs):
+        return await self._call("upsert_item", body, **kwargs)
+
+    async def replace_item(self, item: str, body: Dict[str, Any], **kwargs):
+        return await self._call("replace_item", item, body, **kwargs)
+
+    async def patch_item(self, item: str, partition_key, patch_operations, **kwargs):
+        return await self._call("patch_item", item, partition_key, patch_operations, **kwargs)
+
+    async def delete_item(self, item: str, partition_key=None, **kwargs):
+        return await self._call("delete_item", item, partition_key=partition_key, **kwargs)
+
+    async def execute_item_batch(self, batch_operations, partition_key=None, **kwargs):
+        return await self._call("execute_item_batch", batch_operations, partition_key=partition_key, **kwargs)
+
+
+async def _async_items(items):
+    await asyncio.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+    for item in items:
+        yield item
+
+
+class FakeAsyncDatabaseProxy:
+    def __init__(self, database: FakeDatabaseProxy):
+        self._sync = database
+        self.id = database.id
+
+    def list_containers(self, **kwargs):
+        return _async_items(list(_without_sleep(self._sync.list_containers, **kwargs)))
+
+    def get_container_client(self, container: str) -> FakeAsyncContainerProxy:
+        return FakeAsyncContainerProxy(self._sync.get_container_client(container))
+
+    async def create_container_if_not_exists(self, id: str, partition_key=None, **kwargs):
+        await asyncio.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+        _without_sleep(self._sync.create_container_if_not_exists, id, partition_key=partition_key, **kwargs)
+        return self.get_container_client(id)
+
+    create_container = create_container_if_not_exists
+
+
+class FakeAsyncCosmosClient:
+    def __init__(self, url: str = None, credential=None, **kwargs):
+        self._sync = FakeCosmosClient(url, credential)
+        self.client_connection = self._sync.client_connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    def list_databases(self, **kwargs):
+        return _async_items(list(_without_sleep(self._sync.list_databases, **kwargs)))
+
+    def get_database_client(self, database: str) -> FakeAsyncDatabaseProxy:
+        return FakeAsyncDatabaseProxy(self._sync.get_database_client(database))
+
+    async def create_database_if_not_exists(self, id: str, **kwargs) -> FakeAsyncDatabaseProxy:
+        await asyncio.sleep(FakeCosmosSettings.latency_ms / 1000.0)
+        _without_sleep(self._sync.create_database_if_not_exists, id, **kwargs)
+        return self.get_database_client(id)
+
+
+def install():
+    """
+    Replace the SDK client classes so modules importing them afterwards use the fakes.
+    """
+    import azure.cosmos
+    import azure.cosmos.aio
+
+    azure.cosmos.CosmosClient = FakeCosmosClient
+    azure.cosmos.aio.CosmosClient = FakeAsyncCosmosClient
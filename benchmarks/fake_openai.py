@@ -0,0 +1,183 @@
+"""
+Local stand-in for Azure OpenAI used by the benchmarks.
+
+Serves the Azure routes used by the app:
+
+    POST /openai/deployments/{deployment}/embeddings
+    POST /openai/deployments/{deployment}/chat/completions
+
+Embeddings are deterministic unit vectors derived from the input text. Chat
+completions follow a tool script: while fewer tool results than scripted tool
+calls follow the last user message, the next scripted tool call is returned,
+otherwise a short answer is streamed. Latencies are configurable so the
+benchmarks can model the real service.
+
+    python fake_openai.py --port 8100 --tool-script '[{"name": "get_databases", "arguments": {}}]'
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import struct
+import time
+import uuid
+
+from typing import Dict, Any, List
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeOpenAISettings:
+    dimensions = 3072
+    embedding_latency_ms = 40.0
+    first_token_latency_ms = 300.0
+    token_interval_ms = 15.0
+    answer_tokens = 40
+    argument_chunks = 6
+    tool_script: List[Dict[str, Any]] = [{"name": "get_databases", "arguments": {}}]
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _pending_tool_call(messages: List[Dict[str, Any]]):
+    # Count tool results after the last user message; both the "tool" role (Chainlit)
+    # and system messages describing a tool response (Gradio) count
+    results = 0
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            break
+        content = message.get("content")
+        if message.get("role") == "tool" or (message.get("role") == "system" and isinstance(content, str)
+                                              and content.startswith("The response from the tool")):
+            results += 1
+    script = FakeOpenAISettings.tool_script
+    return script[results] if results < len(script) else None
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason=None) -> str:
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+
+app = FastAPI(docs_url=None, redoc_url=None)
+
+
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def embeddings(deployment: str, request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or FakeOpenAISettings.dimensions
+    await asyncio.sleep(FakeOpenAISettings.embedding_latency_ms / 1000.0)
+    data = []
+    for index, text in enumerate(inputs):
+        vector = fake_embedding(str(text), dimensions)
+        if body.get("encoding_format") == "base64":
+            vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+        data.append({"object": "embedding", "index": index, "embedding": vector})
+    tokens = sum(_tokens(str(text)) for text in inputs)
+    return JSONResponse({
+        "object": "list",
+        "data": data,
+        "model": deployment,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    })
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    prompt_tokens = _tokens(json.dumps(messages)) + _tokens(json.dumps(body.get("tools", [])))
+    tool_call = _pending_tool_call(messages) if body.get("tools") else None
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    answer = " ".join(["token"] * FakeOpenAISettings.answer_tokens)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": FakeOpenAISettings.answer_tokens,
+             "total_tokens": prompt_tokens + FakeOpenAISettings.answer_tokens}
+
+    if not body.get("stream"):
+        await asyncio.sleep((FakeOpenAISettings.first_token_latency_ms
+                             + FakeOpenAISettings.token_interval_ms * FakeOpenAISettings.answer_tokens) / 1000.0)
+        message: Dict[str, Any] = {"role": "assistant", "content": None if tool_call else answer}
+        if tool_call:
+            message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                                      "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])}}]
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": deployment,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": usage,
+        })
+
+    async def stream():
+        await asyncio.sleep(FakeOpenAISettings.first_token_latency_ms / 1000.0)
+        interval = FakeOpenAISettings.token_interval_ms / 1000.0
+        if tool_call:
+            arguments = json.dumps(tool_call["arguments"])
+            yield _chunk(completion_id, deployment, {"role": "assistant", "tool_calls": [{
+                "index": 0, "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                "function": {"name": tool_call["name"], "arguments": ""}}]})
+            size = max(1, -(-len(arguments) // FakeOpenAISettings.argument_chunks))
+            for start in range(0, len(arguments), size):
+                await asyncio.sleep(interval)
+                yield _chunk(completion_id, deployment, {"tool_calls": [{
+                    "index": 0, "function": {"arguments": arguments[start:start + size]}}]})
+            yield _chunk(completion_id, deployment, {}, "tool_calls")
+        else:
+            yield _chunk(completion_id, deployment, {"role": "assistant", "content": ""})
+            for index in range(FakeOpenAISettings.answer_tokens):
+                await asyncio.sleep(interval)
+                yield _chunk(completion_id, deployment, {"content": "token" if index == 0 else " token"})
+            yield _chunk(completion_id, deployment, {}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk",
+                                         "created": int(time.time()), "model": deployment,
+                                         "choices": [], "usage": usage}) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def configure(args: argparse.Namespace):
+    FakeOpenAISettings.dimensions = args.dimensions
+    FakeOpenAISettings.embedding_latency_ms = args.embedding_latency_ms
+    FakeOpenAISettings.first_token_latency_ms = args.first_token_latency_ms
+    FakeOpenAISettings.token_interval_ms = args.token_interval_ms
+    FakeOpenAISettings.answer_tokens = args.answer_tokens
+    if args.tool_script:
+        FakeOpenAISettings.tool_script = json.loads(args.tool_script)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--dimensions", type=int, default=FakeOpenAISettings.dimensions)
+    parser.add_argument("--embedding-latency-ms", type=float, default=FakeOpenAISettings.embedding_latency_ms)
+    parser.add_argument("--first-token-latency-ms", type=float, default=FakeOpenAISettings.first_token_latency_ms)
+    parser.add_argument("--token-interval-ms", type=float, default=FakeOpenAISettings.token_interval_ms)
+    parser.add_argument("--answer-tokens", type=int, default=FakeOpenAISettings.answer_tokens)
+    parser.add_argument("--tool-script", help="JSON list of {name, arguments} tool calls made before answering.")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,45 @@
+"""
+Scripted MCP client used to drive the MCP servers in the benchmarks.
+
+A session connects over SSE (URLs ending in /sse) or streamable HTTP (URLs
+ending in /mcp), initializes, then runs a fixed list of tool calls
+and records the latency and outcome of each one.
+"""
+import time
+
+from typing import Dict, Any, List, Optional, Tuple
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+Sample = Tuple[str, float, bool]
+
+
+def _connect(url: str, headers: Optional[Dict[str, str]]):
+    if url.rstrip("/").endswith("/mcp"):
+        return streamablehttp_client(url=url, headers=headers)
+    return sse_client(url=url, headers=headers)
+
+
+async def run_session(url: str, steps: List[Dict[str, Any]], headers: Optional[Dict[str, str]] = None) -> List[Sample]:
+    samples: List[Sample] = []
+    async with _connect(url, headers) as streams:
+        async with ClientSession(streams[0], streams[1]) as session:
+            await session.initialize()
+            for step in steps:
+                started = time.perf_counter()
+                try:
+                    result = await session.call_tool(step["name"], step.get("arguments", {}))
+                    ok = not result.isError
+                except Exception as e:
+                    print(f"Tool {step['name']} failed: {e}")
+                    ok = False
+                samples.append((step["name"], time.perf_counter() - started, ok))
+    return samples
+
+
+async def list_tools(url: str, headers: Optional[Dict[str, str]] = None) -> List[Any]:
+    async with _connect(url, headers) as streams:
+        async with ClientSession(streams[0], streams[1]) as session:
+            await session.initialize()
+            return (await session.list_tools()).tools
@@ -0,0 +1,618 @@
+"""
+Load and latency benchmarks for the MCP servers and chat clients.
+
+Every scenario runs against local stand-ins: a fake Azure OpenAI server
+(fake_openai.py), an in-process fake Cosmos DB client with configurable latency
+and RU charge (fake_cosmos.py) and a scripted MCP client (mcp_sse_client.py).
+
+Scenarios:
+    sse        main.py's SSE endpoint, driven by scripted MCP sessions
+    http       main.py's stateless streamable HTTP endpoint, same sessions
+    functions  the Azure Functions tool handlers, invoked in one or more simulated
+               worker processes (--worker-processes, --threadpool-threads)
+    gradio     MCPClientWrapper chat turns against the SSE server
+    chainlit   ChatService chat turns against the SSE server
+
+Each run reports p50/p95/p99 latency, throughput and peak memory. Results are
+compared with the baseline stored in benchmarks/baselines/<scenario>.json, and
+--save-baseline records a new one. A scenario without a baseline is reported as a
+regression.
+
+    python benchmarks/run.py --scenario sse --concurrency 16 --iterations 20
+    python benchmarks/run.py --scenario all --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from typing import Dict, Any, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SERVER_DIR = os.path.join(ROOT_DIR, "azure_containers", "cosmosdb")
+FUNCTIONS_DIR = os.path.join(ROOT_DIR, "azure_functions", "cosmosdb", "python")
+GRADIO_DIR = os.path.join(ROOT_DIR, "mcp_client", "gradio")
+CHAINLIT_DIR = os.path.join(ROOT_DIR, "mcp_client", "chainlit")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+SCENARIOS = ["sse", "http", "functions", "gradio", "chainlit"]
+
+# The shared cosmosdb_core and chat_core packages are imported from the repository root
+sys.path.insert(0, ROOT_DIR)
+
+DATABASE = "bench"
+CONTAINER = "passages"
+
+SERVER_STEPS = [
+    {"name": "get_databases", "arguments": {}},
+    {"name": "get_collections_of_database", "arguments": {"database": DATABASE}},
+    {"name": "get_collection_schema", "arguments": {"database": DATABASE, "container": CONTAINER}},
+    {"name": "get_count_of_documents", "arguments": {"database": DATABASE, "container": CONTAINER}},
+    {"name": "get_sample_documents", "arguments": {"database": DATABASE, "container": CONTAINER, "n": 3}},
+    {"name": "do_vector_search", "arguments": {"database": DATABASE, "container": CONTAINER, "query": "how are passages indexed"}},
+]
+
+FUNCTIONS_STEPS = [
+    {"name": "get_databases", "arguments": {}},
+    {"name": "get_collections_of_database", "arguments": {"database": DATABASE}},
+    {"name": "get_collection_schema_tool", "arguments": {"database": DATABASE, "container": CONTAINER}},
+    {"name": "get_count_of_documents_tool", "arguments": {"database": DATABASE, "container": CONTAINER}},
+    {"name": "get_sample_documents_tool", "arguments": {"database": DATABASE, "container": CONTAINER, "n": 3}},
+    {"name": "vector_search_tool", "arguments": {"database": DATABASE, "container": CONTAINER, "query": "how are passages indexed"}},
+]
+
+CHAT_TOOL_SCRIPT = [
+    {"name": "get_collection_schema", "arguments": {"database": DATABASE, "container": CONTAINER}},
+    {"name": "do_vector_search", "arguments": {"database": DATABASE, "container": CONTAINER, "query": "how are passages indexed"}},
+]
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process {' '.join(process.args[1:3])} exited with code {process.returncode}")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port}")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def process_memory_mb(pid: Optional[int] = None) -> Dict[str, float]:
+    """
+    Peak and current resident memory of a process, read from /proc on Linux.
+    """
+    path = f"/proc/{pid or 'self'}/status"
+    values = {}
+    if os.path.exists(path):
+        with open(path, "r") as status:
+            for line in status:
+                if line.startswith(("VmHWM:", "VmRSS:")):
+                    key, amount = line.split(":")
+                    values[key] = round(int(amount.split()[0]) / 1024.0, 1)
+    if pid is None and "VmHWM" not in values:
+        values["VmHWM"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    return {"peak_rss_mb": values.get("VmHWM", 0.0), "rss_mb": values.get("VmRSS", 0.0)}
+
+
+def summarize(samples: List[tuple], elapsed: float) -> Dict[str, Any]:
+    latencies = [seconds * 1000.0 for _, seconds, _ in samples]
+    by_name: Dict[str, List[float]] = {}
+    for name, seconds, _ in samples:
+        by_name.setdefault(name, []).append(seconds * 1000.0)
+    return {
+        "operations": len(samples),
+        "errors": sum(1 for _, _, ok in samples if not ok),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "throughput_ops": round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        "per_operation_p95_ms": {name: round(percentile(values, 95), 2) for name, values in sorted(by_name.items())},
+    }
+
+
+def fake_environment(openai_url: str) -> Dict[str, str]:
+    return {
+        "openai_key": "benchmark",
+        "openai_endpoint": openai_url,
+        "openai_api_version": "2025-01-01-preview",
+        "openai_embeddings_deployment": "bench-embeddings",
+        "openai_embeddings_model": "bench-embeddings",
+        "openai_embeddings_dimensions": "3072",
+        "ACCOUNT_ENDPOINT": "https://fake-cosmos.localhost:8081/",
+        "ACCOUNT_KEY": "ZmFrZQ==",
+        "AZURE_COSMOSDB_ENDPOINT": "https://fake-cosmos.localhost:8081/",
+        "AZURE_COSMOSDB_KEY": "ZmFrZQ==",
+        "COSMOSDB_ACCOUNT_ENDPOINT": "https://fake-cosmos.localhost:8081/",
+        "COSMOSDB_ACCOUNT_KEY": "ZmFrZQ==",
+        "CHAT_MODEL_NAME": "bench-chat",
+        "CHAT_MODEL_BASE_URL": openai_url,
+        "CHAT_MODEL_API_KEY": "benchmark",
+        "CHAT_MODEL_API_VERSION": "2025-01-01-preview",
+    }
+
+
+def install_fake_cosmos(args: argparse.Namespace):
+    sys.path.insert(0, BENCH_DIR)
+    import fake_cosmos
+    from fake_openai import fake_embedding
+
+    fake_cosmos.FakeCosmosSettings.latency_ms = args.cosmos_latency_ms
+    fake_cosmos.FakeCosmosSettings.query_charge = args.cosmos_query_ru
+    fake_cosmos.install()
+    rng = random.Random(3)
+    words = ["vector", "index", "partition", "container", "query", "embedding", "latency", "throughput"]
+    fake_cosmos.seed(DATABASE, CONTAINER, [
+        {
+            "id": str(i),
+            "pid": str(i),
+            "passage": " ".join(rng.choice(words) for _ in range(40)),
+            "embedding": fake_embedding(f"passage {i}", args.dimensions),
+        } for i in range(args.passages)
+    ], partition_key_path="/pid")
+    return fake_cosmos
+
+
+class Services:
+    """
+    Fake OpenAI and, optionally, the SSE MCP server running as child processes.
+    """
+    def __init__(self, args: argparse.Namespace, tool_script=None, with_server: bool = True):
+        self.processes: List[subprocess.Popen] = []
+        self.server = None
+        self.server_url = None
+        self.server_base_url = None
+        self.openai_port = free_port()
+        self.openai_url = f"http://127.0.0.1:{self.openai_port}"
+        openai_args = [sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(self.openai_port),
+                       "--dimensions", str(args.dimensions),
+                       "--embedding-latency-ms", str(args.embedding_latency_ms),
+                       "--first-token-latency-ms", str(args.first_token_latency_ms),
+                       "--token-interval-ms", str(args.token_interval_ms)]
+        if tool_script is not None:
+            openai_args += ["--tool-script", json.dumps(tool_script)]
+        self.processes.append(subprocess.Popen(openai_args, cwd=BENCH_DIR))
+        try:
+            wait_for_port(self.openai_port, self.processes[-1])
+            if with_server:
+                self._start_server(args)
+        except Exception:
+            self.close()
+            raise
+
+    def _start_server(self, args: argparse.Namespace):
+        server_port = free_port()
+        self.server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve-sse", "--port", str(server_port),
+             "--openai-url", self.openai_url] + _shared_cli(args),
+            cwd=SERVER_DIR)
+        self.processes.append(self.server)
+        wait_for_port(server_port, self.server)
+        self.server_base_url = f"http://127.0.0.1:{server_port}"
+        self.server_url = f"{self.server_base_url}/sse"
+
+    def server_memory(self) -> Dict[str, float]:
+        return process_memory_mb(self.server.pid) if self.server else {}
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _shared_cli(args: argparse.Namespace) -> List[str]:
+    return ["--cosmos-latency-ms", str(args.cosmos_latency_ms), "--cosmos-query-ru", str(args.cosmos_query_ru),
+            "--passages", str(args.passages), "--dimensions", str(args.dimensions)]
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+def serve_sse(args: argparse.Namespace):
+    """
+    Run main.py's FastAPI app against the fake Cosmos DB client (used as a child process).
+    """
+    os.environ.update(fake_environment(args.openai_url))
+    install_fake_cosmos(args)
+    sys.path.insert(0, SERVER_DIR)
+    import uvicorn
+    from main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def scenario_sse(args: argparse.Namespace) -> Dict[str, Any]:
+    return run_server_sessions(args, "/sse")
+
+
+def scenario_http(args: argparse.Namespace) -> Dict[str, Any]:
+    return run_server_sessions(args, "/mcp")
+
+
+def run_server_sessions(args: argparse.Namespace, path: str) -> Dict[str, Any]:
+    sys.path.insert(0, BENCH_DIR)
+    from mcp_sse_client import run_session
+
+    services = Services(args)
+    url = services.server_base_url + path
+    try:
+        async def worker(iterations: int) -> List[tuple]:
+            samples = []
+            for _ in range(iterations):
+                samples += await run_session(url, SERVER_STEPS)
+            return samples
+
+        async def main():
+            await run_session(url, SERVER_STEPS[:1])  # warm-up
+            started = time.perf_counter()
+            results = await asyncio.gather(*[worker(args.iterations) for _ in range(args.concurrency)])
+            return [sample for result in results for sample in result], time.perf_counter() - started
+
+        samples, elapsed = asyncio.run(main())
+        summary = summarize(samples, elapsed)
+        summary.update(services.server_memory())
+        return summary
+    finally:
+        services.close()
+
+
+def run_functions_worker(args: argparse.Namespace, openai_url: str) -> tuple:
+    """
+    Drive the Functions tool handlers in this process the way one Python worker
+    process runs them: async handlers on the event loop, sync handlers on a thread
+    pool of --threadpool-threads threads (PYTHON_THREADPOOL_THREAD_COUNT).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.environ.update(fake_environment(openai_url))
+    install_fake_cosmos(args)
+    sys.path.insert(0, FUNCTIONS_DIR)
+    import function_app
+
+    handlers = {}
+    for function in function_app.app.get_functions():
+        handler = function.get_user_function()
+        handlers[handler.__name__] = handler
+    executor = ThreadPoolExecutor(max_workers=args.threadpool_threads)
+
+    async def invoke(step: Dict[str, Any]) -> tuple:
+        handler = handlers[step["name"]]
+        request = json.dumps({"arguments": step["arguments"]})
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(request)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(executor, handler, request)
+            ok = result is not None
+        except Exception as e:
+            print(f"Handler {step['name']} failed: {e}", file=sys.stderr)
+            ok = False
+        return step["name"], time.perf_counter() - started, ok
+
+    async def worker(iterations: int) -> List[tuple]:
+        return [await invoke(step) for _ in range(iterations) for step in FUNCTIONS_STEPS]
+
+    async def main():
+        if hasattr(function_app, "warm_up"):
+            await function_app.warm_up()
+        await invoke(FUNCTIONS_STEPS[0])  # warm-up
+        started = time.perf_counter()
+        results = await asyncio.gather(*[worker(args.iterations) for _ in range(args.concurrency)])
+        return [sample for result in results for sample in result], time.perf_counter() - started
+
+    try:
+        return asyncio.run(main())
+    finally:
+        executor.shutdown(wait=False)
+
+
+def functions_worker(args: argparse.Namespace):
+    """
+    One simulated Functions worker process (used as a child process); prints its samples as JSON.
+    """
+    samples, elapsed = run_functions_worker(args, args.openai_url)
+    print(json.dumps({"samples": samples, "elapsed": elapsed, "memory": process_memory_mb()}))
+
+
+def scenario_functions(args: argparse.Namespace) -> Dict[str, Any]:
+    services = Services(args, with_server=False)
+    try:
+        settings = {"worker_processes": args.worker_processes, "threadpool_threads": args.threadpool_threads}
+        if args.worker_processes <= 1:
+            samples, elapsed = run_functions_worker(args, services.openai_url)
+            summary = summarize(samples, elapsed)
+            summary.update(process_memory_mb())
+            summary.update(settings)
+            return summary
+
+        # FUNCTIONS_WORKER_PROCESS_COUNT: the invocations are spread over several processes
+        children = []
+        for index in range(args.worker_processes):
+            concurrency = args.concurrency // args.worker_processes + (1 if index < args.concurrency % args.worker_processes else 0)
+            if concurrency == 0:
+                continue
+            command = [sys.executable, os.path.abspath(__file__), "functions-worker",
+                       "--openai-url", services.openai_url, "--concurrency", str(concurrency),
+                       "--iterations", str(args.iterations)] + _shared_cli(args)
+            if args.threadpool_threads:
+                command += ["--threadpool-threads", str(args.threadpool_threads)]
+            children.append(subprocess.Popen(command, stdout=subprocess.PIPE, text=True))
+        outputs = []
+        for child in children:
+            stdout, _ = child.communicate()
+            if child.returncode != 0:
+                raise RuntimeError(f"Functions worker exited with code {child.returncode}")
+            outputs.append(json.loads(stdout.strip().splitlines()[-1]))
+
+        samples = [tuple(sample) for output in outputs for sample in output["samples"]]
+        summary = summarize(samples, max(output["elapsed"] for output in outputs))
+        summary["peak_rss_mb"] = round(sum(output["memory"]["peak_rss_mb"] for output in outputs), 1)
+        summary["rss_mb"] = round(sum(output["memory"]["rss_mb"] for output in outputs), 1)
+        summary.update(settings)
+        return summary
+    finally:
+        services.close()
+
+
+def scenario_gradio(args: argparse.Namespace) -> Dict[str, Any]:
+    services = Services(args, tool_script=CHAT_TOOL_SCRIPT)
+    try:
+        os.environ.update(fake_environment(services.openai_url))
+        install_fake_cosmos(args)
+        sys.path.insert(0, GRADIO_DIR)
+        from mcp_client_wrapper import MCPClientWrapper
+
+        samples: List[tuple] = []
+        lock = threading.Lock()
+
+        def worker(index: int):
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            client = MCPClientWrapper()
+            client.connect(services.server_url, "", None)
+            for turn in range(args.iterations):
+                started = time.perf_counter()
+                ok = True
+                try:
+                    client.process_message(f"question {turn} from user {index}", [], f"bench-user-{index}")
+                except Exception as e:
+                    print(f"Gradio turn failed: {e}")
+                    ok = False
+                with lock:
+                    samples.append(("turn", time.perf_counter() - started, ok))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = summarize(samples, time.perf_counter() - started)
+        summary.update(process_memory_mb())
+        summary["server"] = services.server_memory()
+        return summary
+    finally:
+        services.close()
+
+
+def scenario_chainlit(args: argparse.Namespace) -> Dict[str, Any]:
+    import contextvars
+    from types import SimpleNamespace
+
+    sys.path.insert(0, BENCH_DIR)
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    services = Services(args, tool_script=CHAT_TOOL_SCRIPT)
+    try:
+        os.environ.update(fake_environment(services.openai_url))
+        install_fake_cosmos(args)
+        sys.path.insert(0, CHAINLIT_DIR)
+        import chat_service
+
+        current_session: contextvars.ContextVar = contextvars.ContextVar("bench_session")
+
+        class UserSession(dict):
+            def get(self, key, default=None):
+                return current_session.get()["user_session"].get(key, default)
+
+            def set(self, key, value):
+                current_session.get()["user_session"][key] = value
+
+        async def call_tool(mcp_name, function_name, function_args):
+            result = await current_session.get()["mcp"].call_tool(function_name, function_args)
+            return json.dumps([{"type": "text", "text": item.text} for item in result.content if hasattr(item, "text")])
+
+        # ChatService only needs the Chainlit user session and the tool step, both replaced here
+        chat_service.cl = SimpleNamespace(user_session=UserSession())
+        chat_service.call_tool = call_tool
+
+        async def worker(index: int) -> List[tuple]:
+            samples = []
+            async with sse_client(url=services.server_url) as streams:
+                async with ClientSession(*streams) as session:
+                    await session.initialize()
+                    listed = (await session.list_tools()).tools
+                    tools = [{"name": t.name, "description": t.description, "parameters": t.inputSchema} for t in listed]
+                    current_session.set({"mcp": session, "user_session": {"mcp_tools": {"bench": tools}}})
+                    service = chat_service.ChatService()
+                    for turn in range(args.iterations):
+                        service.messages = []
+                        started = time.perf_counter()
+                        ok = True
+                        try:
+                            async for _ in service.generate_response(f"question {turn} from user {index}",
+                                                                     [{"type": "function", "function": t} for t in tools]):
+                                pass
+                        except Exception as e:
+                            print(f"Chainlit turn failed: {e}")
+                            ok = False
+                        samples.append(("turn", time.perf_counter() - started, ok))
+            return samples
+
+        async def main():
+            started = time.perf_counter()
+            results = await asyncio.gather(*[worker(i) for i in range(args.concurrency)])
+            return [sample for result in results for sample in result], time.perf_counter() - started
+
+        samples, elapsed = asyncio.run(main())
+        summary = summarize(samples, elapsed)
+        summary.update(process_memory_mb())
+        summary["server"] = services.server_memory()
+        return summary
+    finally:
+        services.close()
+
+
+SCENARIO_FUNCTIONS = {
+    "sse": scenario_sse,
+    "http": scenario_http,
+    "functions": scenario_functions,
+    "gradio": scenario_gradio,
+    "chainlit": scenario_chainlit,
+}
+
+
+# ---------------------------------------------------------------------------
+# Baselines
+# ---------------------------------------------------------------------------
+
+def compare_with_baseline(scenario: str, result: Dict[str, Any], tolerance: float) -> List[str]:
+    path = os.path.join(BASELINE_DIR, f"{scenario}.json")
+    if not os.path.exists(path):
+        # Reported like a regression, so a scenario without a baseline cannot pass unnoticed
+        return [f"no baseline at {os.path.relpath(path)}; record one with --save-baseline"]
+    with open(path, "r") as baseline_file:
+        baseline = json.load(baseline_file)["result"]
+    regressions = []
+    for key in ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+        if baseline.get(key) and result.get(key, 0) > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key} {baseline[key]} -> {result[key]}")
+    if baseline.get("throughput_ops") and result.get("throughput_ops", 0) < baseline["throughput_ops"] * (1 - tolerance):
+        regressions.append(f"throughput_ops {baseline['throughput_ops']} -> {result['throughput_ops']}")
+    return regressions
+
+
+def save_baseline(scenario: str, result: Dict[str, Any], args: argparse.Namespace):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    settings = {key: value for key, value in vars(args).items() if key not in ("command", "scenario", "save_baseline")}
+    with open(os.path.join(BASELINE_DIR, f"{scenario}.json"), "w") as baseline_file:
+        json.dump({"settings": settings, "recorded": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                   "result": result}, baseline_file, indent=2)
+
+
+def run_benchmarks(args: argparse.Namespace) -> int:
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    if len(scenarios) > 1:
+        # Each host imports its own embeddings/telemetry modules, so scenarios run in separate processes
+        status = 0
+        for scenario in scenarios:
+            command = [sys.executable, os.path.abspath(__file__), "bench", "--scenario", scenario] + _bench_cli(args)
+            status |= subprocess.call(command)
+        return status
+
+    scenario = scenarios[0]
+    result = SCENARIO_FUNCTIONS[scenario](args)
+    if args.save_baseline:
+        save_baseline(scenario, result, args)
+    regressions = compare_with_baseline(scenario, result, args.tolerance)
+    print(json.dumps({"scenario": scenario, "result": result, "regressions": regressions}, indent=2))
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def _bench_cli(args: argparse.Namespace) -> List[str]:
+    cli = ["--concurrency", str(args.concurrency), "--iterations", str(args.iterations),
+           "--embedding-latency-ms", str(args.embedding_latency_ms),
+           "--first-token-latency-ms", str(args.first_token_latency_ms),
+           "--token-interval-ms", str(args.token_interval_ms),
+           "--tolerance", str(args.tolerance),
+           "--worker-processes", str(args.worker_processes)] + _shared_cli(args)
+    if args.threadpool_threads:
+        cli += ["--threadpool-threads", str(args.threadpool_threads)]
+    if args.save_baseline:
+        cli.append("--save-baseline")
+    if args.fail_on_regression:
+        cli.append("--fail-on-regression")
+    return cli
+
+
+def add_shared_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5.0)
+    parser.add_argument("--cosmos-query-ru", type=float, default=2.8)
+    parser.add_argument("--passages", type=int, default=100)
+    parser.add_argument("--dimensions", type=int, default=3072)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    bench = commands.add_parser("bench", help="Run benchmark scenarios (default).")
+    bench.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--iterations", type=int, default=10, help="Sessions or turns per concurrent worker.")
+    bench.add_argument("--embedding-latency-ms", type=float, default=40.0)
+    bench.add_argument("--first-token-latency-ms", type=float, default=300.0)
+    bench.add_argument("--token-interval-ms", type=float, default=15.0)
+    bench.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change before a regression is reported.")
+    bench.add_argument("--save-baseline", action="store_true")
+    bench.add_argument("--fail-on-regression", action="store_true")
+    bench.add_argument("--worker-processes", type=int, default=int(os.getenv("FUNCTIONS_WORKER_PROCESS_COUNT", "1")),
+                       help="functions scenario: simulated FUNCTIONS_WORKER_PROCESS_COUNT.")
+    bench.add_argument("--threadpool-threads", type=int, default=int(os.getenv("PYTHON_THREADPOOL_THREAD_COUNT", "0")) or None,
+                       help="functions scenario: simulated PYTHON_THREADPOOL_THREAD_COUNT for sync handlers.")
+    add_shared_arguments(bench)
+
+    serve = commands.add_parser("serve-sse", help=argparse.SUPPRESS)
+    serve.add_argument("--port", type=int, required=True)
+    serve.add_argument("--openai-url", required=True)
+    add_shared_arguments(serve)
+
+    functions = commands.add_parser("functions-worker", help=argparse.SUPPRESS)
+    functions.add_argument("--openai-url", required=True)
+    functions.add_argument("--concurrency", type=int, required=True)
+    functions.add_argument("--iterations", type=int, required=True)
+    functions.add_argument("--threadpool-threads", type=int, default=None)
+    add_shared_arguments(functions)
+
+    argv = sys.argv[1:]
+    if not argv or argv[0].startswith("-"):
+        argv = ["bench"] + argv
+    args = parser.parse_args(argv)
+    if args.command == "serve-sse":
+        serve_sse(args)
+    elif args.command == "functions-worker":
+        functions_worker(args)
+    else:
+        sys.exit(run_benchmarks(args))
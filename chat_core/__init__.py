@@ -0,0 +1,4 @@
+"""
+Chat turn helpers shared by the Chainlit and Gradio clients in mcp_client: tool result
+compaction, speculative tool calls, tool selection and the completion cache.
+"""
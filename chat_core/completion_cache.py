@@ -0,0 +1,283 @@
+"""
+Exact-match cache of streamed chat completions.
+
+The clients call the model with temperature=0, so the same messages and tool schemas
+give the same answer, including the same tool-call decision; users also ask the same
+starter questions again and again. A streamed completion is stored under a hash of
+its canonical request (model, messages, tools and the other parameters) once the
+stream has been read to the end, and an identical request later replays the stored
+chunks without waiting on the model.
+
+Entries live in an in-process LRU (COMPLETION_CACHE_SIZE entries, expiring after
+COMPLETION_CACHE_TTL_SECONDS). With COMPLETION_CACHE_COSMOS=true they are also
+written to a Cosmos DB container shared by all replicas, where the container's TTL
+expires them. Only requests with temperature=0 are cached.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from openai.types.chat import ChatCompletionChunk
+from cosmosdb_core.telemetry import record_request_charge, registry
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE", "true").lower() == "true"
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "512"))
+COMPLETION_CACHE_TTL_SECONDS = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "3600"))
+COMPLETION_CACHE_COSMOS = os.getenv("COMPLETION_CACHE_COSMOS", "false").lower() == "true"
+COMPLETION_CACHE_DATABASE = os.getenv("CHAT_HISTORY_DATABASE", "agent_threads")
+COMPLETION_CACHE_CONTAINER = os.getenv("COMPLETION_CACHE_CONTAINER", "completion_cache")
+
+# Cosmos DB items are limited to 2 MB
+MAX_SHARED_ENTRY_BYTES = 1_500_000
+
+registry.counter("completion_cache_lookups_total", "Cacheable chat completions by outcome (hit, shared_hit, miss).")
+registry.counter("completion_cache_tokens_saved_total", "Prompt and completion tokens of chat completions replayed from the cache.")
+
+logger = logging.getLogger("completion_cache")
+
+
+def _canonical(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return str(value)
+
+
+def completion_key(request: Dict[str, Any]) -> str:
+    """
+    Hash of the parameters that determine a completion (stream options do not).
+    """
+    canonical = {key: value for key, value in request.items() if key not in ("stream", "stream_options")}
+    text = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_canonical)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _only(delta: Dict[str, Any], *keys: str) -> bool:
+    return set(delta) <= set(keys)
+
+
+def _mergeable(previous: Dict[str, Any], chunk: Dict[str, Any]) -> bool:
+    # Single-choice chunks that only carry more text or more arguments of the same tool call
+    if "usage" in previous or "usage" in chunk:
+        return False
+    if len(previous.get("choices", [])) != 1 or len(chunk.get("choices", [])) != 1:
+        return False
+    before, after = previous["choices"][0], chunk["choices"][0]
+    if before.get("finish_reason") or after.get("finish_reason"):
+        return False
+    if not _only(before, "index", "delta") or not _only(after, "index", "delta"):
+        return False
+    old, new = before.get("delta", {}), after.get("delta", {})
+    if _only(old, "content", "role") and _only(new, "content") and "content" in old and "content" in new:
+        return True
+    old_calls, new_calls = old.get("tool_calls") or [], new.get("tool_calls") or []
+    if len(old_calls) != 1 or len(new_calls) != 1 or not _only(old, "tool_calls", "role") or not _only(new, "tool_calls"):
+        return False
+    old_call, new_call = old_calls[0], new_calls[0]
+    return (old_call.get("index") == new_call.get("index") and _only(new_call, "index", "function")
+            and _only(new_call.get("function", {}), "arguments"))
+
+
+def coalesce(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Join consecutive text (and tool-call argument) deltas, so an answer is stored as
+    a few chunks instead of one per token.
+    """
+    merged: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        if merged and _mergeable(merged[-1], chunk):
+            old = merged[-1]["choices"][0]["delta"]
+            new = chunk["choices"][0]["delta"]
+            if "content" in new:
+                old["content"] = (old.get("content") or "") + (new["content"] or "")
+            else:
+                function = old["tool_calls"][0].setdefault("function", {})
+                function["arguments"] = (function.get("arguments") or "") + (new["tool_calls"][0]["function"].get("arguments") or "")
+            continue
+        merged.append(json.loads(json.dumps(chunk)))
+    return merged
+
+
+class _ReplayStream:
+    """
+    A cached completion with the interface of the SDK's AsyncStream.
+    """
+    def __init__(self, chunks: List[Dict[str, Any]]):
+        self._chunks = iter([ChatCompletionChunk.model_validate(chunk) for chunk in chunks])
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            yield chunk
+
+    async def close(self):
+        self._chunks = iter(())
+
+    aclose = close
+
+
+class _RecordingStream:
+    """
+    Passes a completion stream through and hands its chunks to on_complete once it
+    has been read to the end.
+    """
+    def __init__(self, stream, on_complete):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._chunks: List[Dict[str, Any]] = []
+        self._on_complete = on_complete
+        self._closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            try:
+                chunk = await self._iterator.__anext__()
+            except StopAsyncIteration:
+                if not self._closed:
+                    self._closed = True
+                    self._on_complete(self._chunks)
+                return
+            self._chunks.append(chunk.model_dump(mode="json", exclude_none=True))
+            yield chunk
+
+    async def close(self):
+        self._closed = True
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            await close()
+
+    aclose = close
+
+
+class CosmosCompletionStore:
+    """
+    Completions shared by the replicas, one item per request hash. The container's
+    default TTL expires them.
+    """
+    def __init__(self, database: str = COMPLETION_CACHE_DATABASE, container: str = COMPLETION_CACHE_CONTAINER,
+                 ttl_seconds: float = COMPLETION_CACHE_TTL_SECONDS):
+        self.database = database
+        self.container = container
+        self.ttl_seconds = int(ttl_seconds)
+        self._container = None
+
+    def _get_container(self):
+        # The sync SDK runs in a worker thread, so the store does not depend on the caller's event loop
+        if self._container is None:
+            from azure.cosmos import CosmosClient, PartitionKey
+
+            client = CosmosClient(url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"), credential=os.getenv("COSMOSDB_ACCOUNT_KEY"))
+            database = client.create_database_if_not_exists(self.database)
+            self._container = database.create_container_if_not_exists(
+                id=self.container,
+                partition_key=PartitionKey(path="/id"),
+                default_ttl=self.ttl_seconds
+            )
+        return self._container
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+        try:
+            item = self._get_container().read_item(key, partition_key=key, response_hook=record_request_charge)
+        except CosmosResourceNotFoundError:
+            return None
+        return {"chunks": item["chunks"], "usage": item.get("usage")}
+
+    def _write(self, key: str, entry: Dict[str, Any]):
+        self._get_container().upsert_item({"id": key, **entry, "stored": time.time()}, response_hook=record_request_charge)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def put(self, key: str, entry: Dict[str, Any]):
+        await asyncio.to_thread(self._write, key, entry)
+
+
+class CompletionCache:
+    """
+    Drop-in for client.chat.completions.create(**request) that replays cached streams.
+    """
+    def __init__(self, size: int = COMPLETION_CACHE_SIZE, ttl_seconds: float = COMPLETION_CACHE_TTL_SECONDS,
+                 shared: Optional[CosmosCompletionStore] = None, enabled: bool = COMPLETION_CACHE_ENABLED):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        if shared is None and COMPLETION_CACHE_COSMOS:
+            shared = CosmosCompletionStore(ttl_seconds=ttl_seconds)
+        self.shared = shared
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending = set()
+
+    def cacheable(self, request: Dict[str, Any]) -> bool:
+        return self.enabled and request.get("stream") is True and request.get("temperature") == 0
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        found = self._entries.get(key)
+        if found is None:
+            return None
+        stored_at, entry = found
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = (time.monotonic(), entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _store(self, key: str, chunks: List[Dict[str, Any]]):
+        if not any(choice.get("finish_reason") for chunk in chunks for choice in chunk.get("choices", [])):
+            return
+        usage = next((chunk["usage"] for chunk in chunks if chunk.get("usage")), None)
+        entry = {"chunks": coalesce([{k: v for k, v in chunk.items() if k != "usage"} for chunk in chunks]), "usage": usage}
+        self._put(key, entry)
+        if self.shared is not None and len(json.dumps(entry)) <= MAX_SHARED_ENTRY_BYTES:
+            task = asyncio.get_running_loop().create_task(self._share(key, entry))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _share(self, key: str, entry: Dict[str, Any]):
+        try:
+            await self.shared.put(key, entry)
+        except Exception as e:
+            logger.warning(f"Error writing the completion to the shared cache: {e}")
+
+    async def create(self, client, **request):
+        """
+        The completion stream for request: replayed from the cache, or from the model
+        and recorded.
+        """
+        if not self.cacheable(request):
+            return await client.chat.completions.create(**request)
+        key = completion_key(request)
+        entry, outcome = self._get(key), "hit"
+        if entry is None and self.shared is not None:
+            try:
+                entry, outcome = await self.shared.get(key), "shared_hit"
+            except Exception as e:
+                logger.warning(f"Error reading the shared completion cache: {e}")
+            if entry is not None:
+                self._put(key, entry)
+        if entry is not None:
+            registry.add("completion_cache_lookups_total", 1, outcome=outcome)
+            usage = entry.get("usage") or {}
+            saved = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+            if saved:
+                registry.add("completion_cache_tokens_saved_total", saved)
+            return _ReplayStream(entry["chunks"])
+        registry.add("completion_cache_lookups_total", 1, outcome="miss")
+        stream = await client.chat.completions.create(**request)
+        return _RecordingStream(stream, lambda chunks: self._store(key, chunks))
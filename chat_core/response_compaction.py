@@ -0,0 +1,230 @@
+"""
+Compaction of MCP tool results before they are added to the conversation.
+
+Tool results stay in the message list and are re-sent to the model on every later
+iteration of a turn, so large payloads (3072-float embeddings, whole documents,
+long passages) are paid for again and again. Each result is reduced to fit
+TOOL_RESULT_TOKEN_BUDGET: vectors are elided, long strings truncated, long lists
+capped and repeated passages replaced by a reference. When anything was removed
+the full result is kept in memory under a handle, and the model can page through
+it with the local fetch_full_result tool.
+"""
+import json
+import os
+import re
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from cosmosdb_core.telemetry import registry
+from cosmosdb_core.tokens import count_tokens
+
+COMPACTION_ENABLED = os.getenv("TOOL_RESULT_COMPACTION", "true").lower() == "true"
+TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "2000"))
+MAX_STRING_CHARS = int(os.getenv("TOOL_RESULT_MAX_STRING_CHARS", "600"))
+MAX_ROWS = int(os.getenv("TOOL_RESULT_MAX_ROWS", "20"))
+MAX_STORED_RESULTS = int(os.getenv("TOOL_RESULT_STORE_SIZE", "32"))
+
+FETCH_FULL_RESULT_TOOL = "fetch_full_result"
+# Lists of at least this many numbers are treated as vectors
+VECTOR_MIN_LENGTH = 16
+# Strings shorter than this are not worth deduplicating
+DEDUPLICATE_MIN_CHARS = 80
+_VECTOR_LITERAL = re.compile(r"\[\s*-?\d[\d.eE+-]*(?:\s*,\s*-?\d[\d.eE+-]*){%d,}\s*\]" % (VECTOR_MIN_LENGTH - 1))
+
+registry.counter("tool_result_tokens_total", "Tokens of tool results before (original) and after (compacted) compaction.")
+
+def fetch_full_result_tool() -> Dict[str, Any]:
+    """
+    Function definition of the local tool that returns the complete data of a compacted result.
+    """
+    return {
+        "name": FETCH_FULL_RESULT_TOOL,
+        "description": "Get the complete data of a tool result that was compacted. Only use it when the "
+                       "compacted result does not contain what you need. Long results are returned in "
+                       "pages; pass the returned next_offset to get the following page.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "handle": {"type": "string", "description": "The handle given in the _compacted field of the result."},
+                "offset": {"type": "integer", "description": "Character offset to start from.", "default": 0},
+            },
+            "required": ["handle"],
+        },
+    }
+
+
+def _is_vector(value) -> bool:
+    return isinstance(value, list) and len(value) >= VECTOR_MIN_LENGTH and \
+        all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+
+
+class _Compaction:
+    """
+    One compaction pass with fixed limits. Records whether anything was dropped.
+    """
+    def __init__(self, max_chars: int, max_rows: int):
+        self.max_chars = max_chars
+        self.max_rows = max_rows
+        self.seen: Dict[str, str] = {}
+        self.changed = False
+
+    def value(self, value, path: str = "$"):
+        if _is_vector(value):
+            self.changed = True
+            return f"<vector of {len(value)} numbers>"
+        if isinstance(value, str):
+            return self.string(value, path)
+        if isinstance(value, list):
+            items = [self.value(item, f"{path}[{i}]") for i, item in enumerate(value[:self.max_rows])]
+            if len(value) > self.max_rows:
+                self.changed = True
+                items.append(f"<{len(value) - self.max_rows} more items>")
+            return items
+        if isinstance(value, dict):
+            return {key: self.value(item, f"{path}.{key}") for key, item in value.items()}
+        return value
+
+    def string(self, value: str, path: str) -> str:
+        if len(value) >= DEDUPLICATE_MIN_CHARS:
+            first = self.seen.setdefault(value, path)
+            if first != path:
+                self.changed = True
+                return f"<same as {first}>"
+        if _VECTOR_LITERAL.search(value):
+            # Generated queries inline the query embedding
+            self.changed = True
+            value = _VECTOR_LITERAL.sub(lambda m: f"<vector of {m.group(0).count(',') + 1} numbers>", value)
+        if len(value) > self.max_chars:
+            self.changed = True
+            return value[:self.max_chars] + f"... <{len(value) - self.max_chars} more characters>"
+        return value
+
+
+def _drop_keys(*keys: str) -> Callable[[Any], Any]:
+    def summarize(data):
+        if isinstance(data, dict) and any(key in data for key in keys):
+            return {key: value for key, value in data.items() if key not in keys}
+        return data
+    return summarize
+
+
+def _embedding_summary(data):
+    if isinstance(data, dict) and _is_vector(data.get("result")):
+        vector = data["result"]
+        return {**data, "result": f"<vector of {len(vector)} numbers>",
+                "preview": [round(v, 4) for v in vector[:4]]}
+    return data
+
+
+# Tool-specific reductions applied before the generic pass. The generated SQL of the
+# search tools repeats the query embedding and is of no use to the model.
+SUMMARIZERS: Dict[str, Callable[[Any], Any]] = {
+    "get_embedding": _embedding_summary,
+    "do_vector_search": _drop_keys("query"),
+    "do_hybrid_search": _drop_keys("query"),
+    "get_sample_documents": _drop_keys("query"),
+}
+
+
+class ToolResultCompactor:
+    """
+    Compacts the tool results of one conversation and keeps the full version of the
+    most recent ones for fetch_full_result.
+    """
+    def __init__(self, token_budget: int = TOKEN_BUDGET, max_chars: int = MAX_STRING_CHARS,
+                 max_rows: int = MAX_ROWS, max_stored: int = MAX_STORED_RESULTS, enabled: bool = COMPACTION_ENABLED):
+        self.token_budget = token_budget
+        self.max_chars = max_chars
+        self.max_rows = max_rows
+        self.max_stored = max_stored
+        self.enabled = enabled
+        self._results: "OrderedDict[str, str]" = OrderedDict()
+        self._next_handle = 1
+
+    def _store(self, text: str) -> str:
+        handle = f"r{self._next_handle}"
+        self._next_handle += 1
+        self._results[handle] = text
+        while len(self._results) > self.max_stored:
+            self._results.popitem(last=False)
+        return handle
+
+    def _reduce(self, tool_name: str, data) -> Optional[Any]:
+        summarize = SUMMARIZERS.get(tool_name)
+        reduced = summarize(data) if summarize else data
+        changed = reduced is not data
+        max_chars, max_rows = self.max_chars, self.max_rows
+        # Tighten the limits until the result fits the budget
+        while True:
+            compaction = _Compaction(max_chars, max_rows)
+            compacted = compaction.value(reduced)
+            changed = changed or compaction.changed
+            if count_tokens(json.dumps(compacted, default=str)) <= self.token_budget or \
+                    (max_chars <= 100 and max_rows <= 1):
+                return compacted if changed else None
+            max_chars, max_rows = max(100, max_chars // 2), max(1, max_rows // 2)
+
+    def compact(self, tool_name: str, text: str) -> str:
+        """
+        Compacted version of the text of a tool result, or the text itself when it is
+        already small. Compacted results carry a _compacted field with their handle.
+        """
+        if not self.enabled or not text:
+            return text
+        original_tokens = count_tokens(text)
+        registry.add("tool_result_tokens_total", original_tokens, tool=tool_name, stage="original")
+        if original_tokens <= self.token_budget and not _VECTOR_LITERAL.search(text):
+            registry.add("tool_result_tokens_total", original_tokens, tool=tool_name, stage="compacted")
+            return text
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = text
+        compacted = self._reduce(tool_name, data)
+        if compacted is None:
+            registry.add("tool_result_tokens_total", original_tokens, tool=tool_name, stage="compacted")
+            return text
+
+        handle = self._store(text)
+        note = {
+            "handle": handle,
+            "original_tokens": original_tokens,
+            "note": f"Vectors, long strings, long lists or repeated passages were shortened. "
+                    f"Call {FETCH_FULL_RESULT_TOOL} with this handle only if you need the complete data.",
+        }
+        if isinstance(compacted, dict):
+            result = json.dumps({**compacted, "_compacted": note}, default=str)
+        else:
+            result = json.dumps({"result": compacted, "_compacted": note}, default=str)
+        if count_tokens(result) > self.token_budget:
+            # Still too large (e.g. a very wide document): cut the serialized text
+            result = result[:self.token_budget * 4] + f"... <truncated, use {FETCH_FULL_RESULT_TOOL} with handle {handle}>"
+        registry.add("tool_result_tokens_total", count_tokens(result), tool=tool_name, stage="compacted")
+        return result
+
+    def fetch(self, handle: str, offset: int = 0) -> str:
+        """
+        A page of the full text of a compacted result, as much as fits in the token budget.
+        """
+        text = self._results.get(handle)
+        if text is None:
+            return json.dumps({"error": f"No stored result with handle {handle}; call the original tool again."})
+        offset = max(0, int(offset or 0))
+        page_chars = self.token_budget * 4
+        page = text[offset:offset + page_chars]
+        next_offset = offset + len(page)
+        return json.dumps({
+            "handle": handle,
+            "offset": offset,
+            "data": page,
+            "next_offset": next_offset if next_offset < len(text) else None,
+            "total_characters": len(text),
+        })
+
+    def compact_items(self, tool_name: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Compact the text parts of an MCP content list.
+        """
+        return [{**item, "text": self.compact(tool_name, item["text"])} if item.get("type") == "text" else item
+                for item in items]
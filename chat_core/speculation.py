@@ -0,0 +1,155 @@
+"""
+Speculative execution of tool calls while the model is still streaming their arguments.
+
+The function name of a tool call arrives in the first chunk, the arguments follow
+token by token. For read-only tools, as soon as the arguments that determine the
+work (the query of a vector search, the container of describe_container) have
+been parsed, the call is started with the remaining arguments at their schema
+defaults. When the final arguments match, the running call is reused; otherwise
+it is cancelled and the real call is made, which still finds the query embedding
+in the server's embedding cache.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from cosmosdb_core.telemetry import registry
+
+SPECULATION_ENABLED = os.getenv("SPECULATIVE_TOOL_CALLS", "true").lower() == "true"
+
+# Read-only tools that may be started early, with the arguments that must be complete first
+# (tool names of the container server and of the Azure Functions server)
+SPECULATIVE_TOOLS: Dict[str, List[str]] = {
+    "do_vector_search": ["database", "container", "query"],
+    "do_hybrid_search": ["database", "container", "query", "top_k"],
+    "do_federated_vector_search": ["targets", "query"],
+    "get_embedding": ["text"],
+    "describe_container": ["database", "container"],
+    "get_collection_schema": ["database", "container"],
+    "get_container_metadata": ["database", "container"],
+    "vector_search": ["database", "container", "query"],
+    "hybrid_search": ["database", "container", "query", "top_k"],
+    "get_embeddings": ["query"],
+}
+
+registry.counter("speculative_tool_calls_total", "Speculatively started tool calls by outcome (hit, miss, unused).")
+
+logger = logging.getLogger("speculation")
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class IncrementalArguments:
+    """
+    Parser of a JSON object that arrives in pieces. After each feed, values holds the
+    top-level members whose value is complete; nested values are returned whole.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.values: Dict[str, Any] = {}
+        self._pos = 0
+        self._opened = False
+        self.closed = False
+
+    def _skip(self, pos: int) -> int:
+        while pos < len(self.buffer) and self.buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        self.buffer += chunk
+        while not self.closed:
+            pos = self._skip(self._pos)
+            if pos >= len(self.buffer):
+                break
+            if not self._opened:
+                if self.buffer[pos] != "{":
+                    # Not an object; leave it to json.loads on the final text
+                    self.closed = True
+                    break
+                self._opened = True
+                self._pos = pos + 1
+                continue
+            if self.buffer[pos] == ",":
+                self._pos = pos + 1
+                continue
+            if self.buffer[pos] == "}":
+                self.closed = True
+                break
+            try:
+                key, pos = _decoder.raw_decode(self.buffer, pos)
+                pos = self._skip(pos)
+                if pos >= len(self.buffer) or self.buffer[pos] != ":":
+                    break
+                pos = self._skip(pos + 1)
+                value, end = _decoder.raw_decode(self.buffer, pos)
+            except ValueError:
+                # The member is not complete yet
+                break
+            if end >= len(self.buffer) and not isinstance(value, (str, list, dict)):
+                # A number or literal at the end of the buffer may still grow ("1" -> "10")
+                break
+            self.values[key] = value
+            self._pos = end
+        return self.values
+
+
+def _consume(task: asyncio.Task):
+    # A speculative call nobody awaits must not log "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+def schema_defaults(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    properties = (schema or {}).get("properties", {})
+    return {name: spec["default"] for name, spec in properties.items() if "default" in spec}
+
+
+class SpeculativeCall:
+    """
+    Tracks one streaming tool call and starts it early when it is safe to.
+    """
+    def __init__(self, function_name: str, call: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 schema: Optional[Dict[str, Any]] = None, enabled: bool = SPECULATION_ENABLED):
+        self.function_name = function_name
+        self.call = call
+        self.defaults = schema_defaults(schema)
+        self.required = SPECULATIVE_TOOLS.get(function_name) if enabled else None
+        self.arguments = IncrementalArguments()
+        self.task: Optional[asyncio.Task] = None
+        self.started_with: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: str):
+        values = self.arguments.feed(chunk)
+        if self.task is None and self.required is not None and all(name in values for name in self.required):
+            self.started_with = {**self.defaults, **values}
+            self.task = asyncio.ensure_future(self.call(dict(values)))
+            self.task.add_done_callback(_consume)
+
+    async def result(self, final_arguments: Dict[str, Any]):
+        """
+        The result of the call with the final arguments, reusing the speculative call
+        when it was started with the same (default-completed) arguments.
+        """
+        if self.task is not None:
+            if {**self.defaults, **final_arguments} == self.started_with:
+                registry.add("speculative_tool_calls_total", 1, tool=self.function_name, outcome="hit")
+                try:
+                    return await self.task
+                except Exception as e:
+                    logger.warning(f"Speculative call of {self.function_name} failed, calling again: {e}")
+            else:
+                registry.add("speculative_tool_calls_total", 1, tool=self.function_name, outcome="miss")
+                self.task.cancel()
+        return await self.call(final_arguments)
+
+    def cancel(self):
+        """
+        Drop a speculative call whose tool call never completed.
+        """
+        if self.task is not None and not self.task.done():
+            registry.add("speculative_tool_calls_total", 1, tool=self.function_name, outcome="unused")
+            self.task.cancel()
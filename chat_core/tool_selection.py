@@ -0,0 +1,160 @@
+"""
+Relevance-based pruning of the tool schemas sent with each chat completion.
+
+Every completion call carries the schemas of all offered tools, so each MCP server
+attached to the client adds prompt tokens (and latency) to every call. When more
+than TOOL_SELECTION_TOP_N tools are offered, the user's message is embedded and only
+the TOOL_SELECTION_TOP_N tools whose descriptions are most similar (cosine) are sent,
+plus the pinned ones: the tools in TOOL_SELECTION_PINNED and the local
+fetch_full_result tool. Tool description embeddings are computed once per process
+and cached, as float32 arrays decoded from the base64 embeddings (4 bytes per
+dimension instead of a Python float each). If the embeddings request fails, all
+tools are sent.
+
+The tool_schema_tokens_saved_total counter reports the prompt tokens left out.
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from chat_core.response_compaction import FETCH_FULL_RESULT_TOOL
+from cosmosdb_core.telemetry import record_embedding_tokens, registry
+from cosmosdb_core.tokens import count_tokens
+
+TOOL_SELECTION_ENABLED = os.getenv("TOOL_SELECTION", "true").lower() == "true"
+TOOL_SELECTION_TOP_N = int(os.getenv("TOOL_SELECTION_TOP_N", "8"))
+TOOL_SELECTION_PINNED = [name.strip() for name in os.getenv("TOOL_SELECTION_PINNED", "").split(",") if name.strip()]
+TOOL_SELECTION_EMBEDDINGS_DEPLOYMENT = os.getenv("TOOL_SELECTION_EMBEDDINGS_DEPLOYMENT",
+                                                 os.getenv("openai_embeddings_deployment", ""))
+TOOL_SELECTION_CACHE_SIZE = int(os.getenv("TOOL_SELECTION_CACHE_SIZE", "1024"))
+
+registry.counter("tool_schema_tokens_saved_total", "Prompt tokens of tool schemas left out of chat completions by tool selection.")
+registry.counter("tool_selections_total", "Chat turns whose tools were pruned or, when the embeddings request failed, sent in full (pruned, failed).")
+
+logger = logging.getLogger("tool_selection")
+
+# Embeddings of tool descriptions, shared by every conversation in the process
+_tool_embeddings: "OrderedDict[str, array]" = OrderedDict()
+_tool_embeddings_lock = threading.Lock()
+
+
+def tool_text(tool: Dict[str, Any]) -> str:
+    """
+    The text embedded for a tool: its name, description and parameter descriptions.
+    """
+    function = tool.get("function", tool)
+    parts = [function.get("name", ""), function.get("description") or ""]
+    for name, schema in ((function.get("parameters") or {}).get("properties") or {}).items():
+        description = schema.get("description") if isinstance(schema, dict) else None
+        parts.append(f"{name}: {description}" if description else name)
+    return "\n".join(parts)
+
+
+def _vector(embedding) -> array:
+    """
+    A float32 array from a base64 embedding, or from a list of floats when the
+    deployment ignores encoding_format.
+    """
+    if not isinstance(embedding, str):
+        return array("f", embedding)
+    vector = array("f")
+    vector.frombytes(base64.b64decode(embedding))
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+
+def _cosine(a: array, b: array) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _tool_name(tool: Dict[str, Any]) -> str:
+    return tool.get("function", tool).get("name", "")
+
+
+class Selection:
+    """
+    The tools to send for one chat turn and the schema tokens saved per completion call.
+    """
+    def __init__(self, tools: List[Dict[str, Any]], saved_tokens: int = 0):
+        self.tools = tools
+        self.saved_tokens = saved_tokens
+
+    def record(self):
+        """
+        Count the saved tokens of one completion call made with this selection.
+        """
+        if self.saved_tokens > 0:
+            registry.add("tool_schema_tokens_saved_total", self.saved_tokens)
+
+
+class ToolSelector:
+    """
+    Picks the tools relevant to a user message. client is an async OpenAI client that
+    can reach the embeddings deployment.
+    """
+    def __init__(self, client, deployment: str = TOOL_SELECTION_EMBEDDINGS_DEPLOYMENT,
+                 top_n: int = TOOL_SELECTION_TOP_N, pinned: Optional[List[str]] = None,
+                 enabled: bool = TOOL_SELECTION_ENABLED):
+        self.client = client
+        self.deployment = deployment
+        self.top_n = top_n
+        self.pinned = set(TOOL_SELECTION_PINNED if pinned is None else pinned) | {FETCH_FULL_RESULT_TOOL}
+        self.enabled = enabled and bool(deployment)
+
+    async def _embed(self, texts: List[str]) -> List[array]:
+        response = await self.client.embeddings.create(input=texts, model=self.deployment, encoding_format="base64")
+        record_embedding_tokens(response.usage.total_tokens)
+        return [_vector(item.embedding) for item in sorted(response.data, key=lambda d: d.index)]
+
+    async def _vectors(self, tools: List[Dict[str, Any]], message: str):
+        """
+        Embeddings of the tools (from the cache where possible) and of the message,
+        fetched in one request.
+        """
+        texts = [tool_text(tool) for tool in tools]
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        with _tool_embeddings_lock:
+            cached = [_tool_embeddings.get(key) for key in keys]
+        missing = {key: text for key, text, embedding in zip(keys, texts, cached) if embedding is None}
+        vectors = await self._embed(list(missing.values()) + [message])
+        embedded = dict(zip(missing, vectors))
+        if embedded:
+            with _tool_embeddings_lock:
+                _tool_embeddings.update(embedded)
+                while len(_tool_embeddings) > TOOL_SELECTION_CACHE_SIZE:
+                    _tool_embeddings.popitem(last=False)
+        return [embedding if embedding is not None else embedded[key] for key, embedding in zip(keys, cached)], vectors[-1]
+
+    async def select(self, message: str, tools: List[Dict[str, Any]]) -> Selection:
+        """
+        The pinned tools plus the top_n tools most similar to the message, in their
+        original order.
+        """
+        candidates = [tool for tool in tools if _tool_name(tool) not in self.pinned]
+        if not self.enabled or not message or len(candidates) <= self.top_n:
+            return Selection(tools)
+        try:
+            tool_vectors, message_vector = await self._vectors(candidates, message)
+        except Exception as e:
+            logger.warning(f"Tool selection failed, sending all tools: {e}")
+            registry.add("tool_selections_total", 1, outcome="failed")
+            return Selection(tools)
+
+        scores = {id(tool): _cosine(message_vector, vector) for tool, vector in zip(candidates, tool_vectors)}
+        chosen = set(sorted(scores, key=scores.get, reverse=True)[:self.top_n])
+        selected = [tool for tool in tools if _tool_name(tool) in self.pinned or id(tool) in chosen]
+        saved = count_tokens(json.dumps(tools)) - count_tokens(json.dumps(selected))
+        registry.add("tool_selections_total", 1, outcome="pruned")
+        logger.info("tools=%d selected=%d saved_tokens=%d", len(tools), len(selected), saved)
+        return Selection(selected, saved)
@@ -0,0 +1,44 @@
+"""
+Cosmos DB data access shared by the MCP servers in azure_containers and azure_functions.
+
+Both hosts import this package instead of keeping their own copies of the queries,
+embedding cache and client setup, so a fix or tuning change lands in one place. The
+telemetry, profiling and http_clients modules are shared the same way, by the
+servers and by the chat clients.
+"""
+from cosmosdb_core.queries import (
+    DEFAULT_SIMILARITY_THRESHOLD,
+    DEFAULT_TOP_K,
+    SYSTEM_PROPERTIES,
+    QuerySpec,
+    parse_fields,
+    property_path,
+)
+from cosmosdb_core.document_cache import DOCUMENT_CACHE_ENABLED, DocumentCache
+from cosmosdb_core.data_access import AsyncCosmosData, CosmosData, passages, schema_of, shared_client
+from cosmosdb_core.embeddings import Embedder, EmbeddingCache, text_hash
+from cosmosdb_core.vectors import as_list
+from cosmosdb_core.result_format import FORMATS, RESULT_FORMAT, encode_result
+
+__all__ = [
+    "DEFAULT_SIMILARITY_THRESHOLD",
+    "DEFAULT_TOP_K",
+    "SYSTEM_PROPERTIES",
+    "QuerySpec",
+    "parse_fields",
+    "property_path",
+    "DOCUMENT_CACHE_ENABLED",
+    "DocumentCache",
+    "AsyncCosmosData",
+    "CosmosData",
+    "passages",
+    "schema_of",
+    "shared_client",
+    "Embedder",
+    "EmbeddingCache",
+    "text_hash",
+    "as_list",
+    "FORMATS",
+    "RESULT_FORMAT",
+    "encode_result",
+]
@@ -0,0 +1,269 @@
+"""
+Tool operations on Cosmos DB, shared by the container and Azure Functions servers.
+
+Each operation is a query from queries.py plus the shape of its result, so both
+hosts send the same requests and return the same {"result", "query"} payloads.
+CosmosData runs them on the sync SDK, AsyncCosmosData on azure.cosmos.aio.
+"""
+import threading
+
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from cosmosdb_core import queries
+from cosmosdb_core.document_cache import DocumentCache, point_of, point_read, top_level_partition_key
+from cosmosdb_core.queries import QuerySpec
+
+_MISSING = object()
+_clients: Dict[tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(endpoint: Optional[str], key: Optional[str] = None, asynchronous: bool = False, **kwargs):
+    """
+    One CosmosClient per endpoint and flavour for the whole process, so every caller
+    shares its connection pool, session tokens and partition-map cache. Without a
+    key the client authenticates with DefaultAzureCredential.
+    """
+    cache_key = (endpoint, key, asynchronous)
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            if asynchronous:
+                from azure.cosmos.aio import CosmosClient
+            else:
+                from azure.cosmos import CosmosClient
+            if key is None:
+                if asynchronous:
+                    from azure.identity.aio import DefaultAzureCredential
+                else:
+                    from azure.identity import DefaultAzureCredential
+                credential = DefaultAzureCredential()
+            else:
+                credential = key
+            client = _clients[cache_key] = CosmosClient(url=endpoint, credential=credential, **kwargs)
+        return client
+
+
+def schema_of(document: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Field names and types of a document, without the system properties.
+    """
+    return {key: type(value).__name__ for key, value in document.items() if key not in queries.SYSTEM_PROPERTIES}
+
+
+def passages(items: List[Dict[str, Any]], similarity_threshold: Optional[float] = None,
+             distance_function: Optional[str] = None) -> List[str]:
+    if similarity_threshold is None:
+        return [item["passage"] for item in items]
+    return [item["passage"] for item in items
+            if queries.within_threshold(float(item["SimilarityScore"]), similarity_threshold, distance_function)]
+
+
+class _Operations(ABC):
+    """
+    The operations of the tools. _run returns the payload for the sync client and an
+    awaitable of it for the async one. Field-filter lookups go through document_cache
+    when one is given. segment(name) returns a context manager around the time spent
+    on Cosmos DB (used by the profilers of the hosts).
+    """
+    def __init__(self, client, response_hook: Optional[Callable] = None,
+                 document_cache: Optional[DocumentCache] = None,
+                 segment: Optional[Callable[[str], ContextManager]] = None):
+        self.client = client
+        self.response_hook = response_hook
+        self.document_cache = document_cache
+        self.segment = segment or (lambda name: nullcontext())
+        self._partition_keys: Dict[tuple, Optional[str]] = {}
+
+    def container(self, database: str, container: str):
+        return self.client.get_database_client(database).get_container_client(container)
+
+    @abstractmethod
+    def _run(self, database: str, container: str, spec: QuerySpec, shape: Callable, first: bool = False):
+        """
+        Run spec and return {"result": shape(items or first item), "query"}, or None when
+        first is set and nothing matches.
+        """
+
+    def _document_by_field_steps(self, database: str, container: str, field: str, value: Any, fields):
+        """
+        The field-filter lookup and its cache logic as a generator of the Cosmos DB calls
+        it needs, so the sync and async classes only differ in how they make them. It
+        yields ("partition_key",), ("query", spec) or ("read", point, etag) and is sent
+        the result: the partition key, the first document or None, and the document,
+        empty for 304 Not Modified or _MISSING for 404. It returns the payload.
+        """
+        spec = queries.field_filter(field, value, fields)
+        cache = self.document_cache
+        if cache is None:
+            document = yield ("query", spec)
+            return None if document is None else {"result": document, "query": spec.query}
+
+        key = cache.key(database, container, spec)
+        entry = cache.get(key)
+        if entry is not None and entry.point is None:
+            return cache.hit(entry)
+        if entry is not None:
+            document = yield ("read", entry.point, entry.etag)
+            if document is _MISSING:
+                cache.deleted(key)
+                return None
+            if not document:
+                return cache.revalidated(entry)
+            return cache.store(key, spec, document, entry.fields, entry.point, changed=True)
+
+        names = queries.parse_fields(fields)
+        partition_key = (yield ("partition_key",)) if field == "id" else None
+        point = point_read(field, value, names, partition_key)
+        if point is not None:
+            document = yield ("read", point, None)
+            if document is _MISSING:
+                return None
+            return cache.store(key, spec, document, names, point)
+        document = yield ("query", spec)
+        if document is None:
+            return None
+        return cache.store(key, spec, document, [], point_of(field, names, document, partition_key))
+
+    def _read_options(self, etag: Optional[str]) -> Dict[str, Any]:
+        if etag is None:
+            return {"response_hook": self.response_hook}
+        return {"etag": etag, "match_condition": MatchConditions.IfModified, "response_hook": self.response_hook}
+
+    def count(self, database: str, container: str):
+        return self._run(database, container, queries.COUNT, str, first=True)
+
+    def sample_documents(self, database: str, container: str, n: int = 1, fields=None):
+        return self._run(database, container, queries.sample(n, fields), lambda items: items)
+
+    def schema(self, database: str, container: str):
+        return self._run(database, container, queries.SCHEMA_SAMPLE, schema_of, first=True)
+
+    def vector_search(self, database: str, container: str, query_vector: List[float], top_k: Optional[int] = None,
+                      similarity_threshold: Optional[float] = None, distance_function: Optional[str] = None):
+        threshold = queries.DEFAULT_SIMILARITY_THRESHOLD if similarity_threshold is None else float(similarity_threshold)
+        return self._run(database, container, queries.vector_search(query_vector, top_k),
+                         lambda items: passages(items, threshold, distance_function))
+
+    def hybrid_search(self, database: str, container: str, query_text: str, query_vector: List[float],
+                      top_k: Optional[int] = None):
+        return self._run(database, container, queries.hybrid_search(query_text, query_vector, top_k), passages)
+
+
+class CosmosData(_Operations):
+    """
+    Tool operations on a sync CosmosClient.
+    """
+    def query(self, database: str, container: str, spec: QuerySpec):
+        return self.container(database, container).query_items(
+            query=spec.query,
+            parameters=spec.parameters or None,
+            enable_cross_partition_query=True,
+            response_hook=self.response_hook,
+        )
+
+    def _run(self, database, container, spec, shape, first=False):
+        with self.segment("cosmos"):
+            items = self.query(database, container, spec)
+            if first:
+                item = next(iter(items), _MISSING)
+                if item is _MISSING:
+                    return None
+                return {"result": shape(item), "query": spec.query}
+            return {"result": shape(list(items)), "query": spec.query}
+
+    def partition_key(self, database: str, container: str) -> Optional[str]:
+        key = (database, container)
+        if key not in self._partition_keys:
+            properties = self.container(database, container).read(response_hook=self.response_hook)
+            paths = (properties.get("partitionKey") or {}).get("paths", [])
+            self._partition_keys[key] = top_level_partition_key(paths[0]) if len(paths) == 1 else None
+        return self._partition_keys[key]
+
+    def document_by_field(self, database: str, container: str, field: str, value: Any, fields=None):
+        with self.segment("cosmos"):
+            return self._document_by_field(database, container, field, value, fields)
+
+    def _document_by_field(self, database, container, field, value, fields):
+        steps = self._document_by_field_steps(database, container, field, value, fields)
+        try:
+            call = next(steps)
+            while True:
+                call = steps.send(self._call(database, container, *call))
+        except StopIteration as done:
+            return done.value
+
+    def _call(self, database, container, operation, *args):
+        if operation == "partition_key":
+            return self.partition_key(database, container)
+        if operation == "query":
+            return next(iter(self.query(database, container, args[0])), None)
+        point, etag = args
+        try:
+            return self.container(database, container).read_item(point[0], partition_key=point[1],
+                                                                 **self._read_options(etag))
+        except CosmosResourceNotFoundError:
+            return _MISSING
+
+
+class AsyncCosmosData(_Operations):
+    """
+    Tool operations on an azure.cosmos.aio CosmosClient (queries fan out across
+    partitions by default there).
+    """
+    def query(self, database: str, container: str, spec: QuerySpec):
+        return self.container(database, container).query_items(
+            query=spec.query,
+            parameters=spec.parameters or None,
+            response_hook=self.response_hook,
+        )
+
+    async def _run(self, database, container, spec, shape, first=False):
+        with self.segment("cosmos"):
+            items = self.query(database, container, spec)
+            if first:
+                try:
+                    item = await items.__anext__()
+                except StopAsyncIteration:
+                    return None
+                return {"result": shape(item), "query": spec.query}
+            return {"result": shape([item async for item in items]), "query": spec.query}
+
+    async def partition_key(self, database: str, container: str) -> Optional[str]:
+        key = (database, container)
+        if key not in self._partition_keys:
+            properties = await self.container(database, container).read(response_hook=self.response_hook)
+            paths = (properties.get("partitionKey") or {}).get("paths", [])
+            self._partition_keys[key] = top_level_partition_key(paths[0]) if len(paths) == 1 else None
+        return self._partition_keys[key]
+
+    async def document_by_field(self, database: str, container: str, field: str, value: Any, fields=None):
+        with self.segment("cosmos"):
+            return await self._document_by_field(database, container, field, value, fields)
+
+    async def _document_by_field(self, database, container, field, value, fields):
+        steps = self._document_by_field_steps(database, container, field, value, fields)
+        try:
+            call = next(steps)
+            while True:
+                call = steps.send(await self._call(database, container, *call))
+        except StopIteration as done:
+            return done.value
+
+    async def _call(self, database, container, operation, *args):
+        if operation == "partition_key":
+            return await self.partition_key(database, container)
+        if operation == "query":
+            try:
+                return await self.query(database, container, args[0]).__anext__()
+            except StopAsyncIteration:
+                return None
+        point, etag = args
+        try:
+            return await self.container(database, container).read_item(point[0], partition_key=point[1],
+                                                                       **self._read_options(etag))
+        except CosmosResourceNotFoundError:
+            return _MISSING
@@ -0,0 +1,161 @@
+"""
+Read-through cache of get_document_by_field_filter results.
+
+Agents look up the same field/value pairs again and again within a conversation
+and across users. Results are cached per (database, container, query, parameters)
+together with the document's _etag and _ts. Lookups by id resolve to a point read
+once the partition key value is known: a cached result is then revalidated with a
+conditional read (If-None-Match), which costs one RU and returns no body while the
+document is unchanged. Other lookups expire after DOCUMENT_CACHE_TTL_SECONDS. The
+cache is bounded by the estimated size of the stored results.
+"""
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from cosmosdb_core.queries import QuerySpec
+
+DOCUMENT_CACHE_ENABLED = os.getenv("DOCUMENT_CACHE_ENABLED", "true").lower() == "true"
+DOCUMENT_CACHE_TTL_SECONDS = float(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "30"))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# The ways a lookup can be answered, reported through on_event
+HIT = "hit"                  # fresh result within the TTL
+REVALIDATED = "revalidated"  # conditional read: the document did not change
+CHANGED = "changed"          # conditional read: the document changed
+MISS = "miss"                # not cached, expired or evicted
+DELETED = "deleted"          # conditional read: the document is gone
+
+
+class CachedLookup:
+    __slots__ = ("payload", "etag", "ts", "point", "fields", "stored_at", "size")
+
+    def __init__(self, payload: Dict[str, Any], etag: Optional[str], ts: Optional[int],
+                 point: Optional[Tuple[str, Any]], fields: List[str], size: int):
+        self.payload = payload
+        self.etag = etag
+        self.ts = ts
+        self.point = point
+        self.fields = fields
+        self.stored_at = time.monotonic()
+        self.size = size
+
+
+def project(document: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """
+    The fields of a document the way a SELECT c.a, c.b query returns them.
+    """
+    if not fields:
+        return document
+    return {name: document[name] for name in fields if name in document}
+
+
+def top_level_partition_key(path: Optional[str]) -> Optional[str]:
+    # Point reads need the partition key value, read here from a top-level property
+    if path and path.count("/") == 1:
+        return path[1:]
+    return None
+
+
+class DocumentCache:
+    """
+    LRU cache of field-filter lookups, bounded by max_bytes.
+    """
+    def __init__(self, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES, ttl_seconds: float = DOCUMENT_CACHE_TTL_SECONDS,
+                 on_event: Optional[Callable[[str], None]] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_event = on_event
+        self.bytes = 0
+        self._entries: "OrderedDict[tuple, CachedLookup]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _record(self, outcome: str):
+        if self.on_event is not None:
+            self.on_event(outcome)
+
+    @staticmethod
+    def key(database: str, container: str, spec: QuerySpec) -> tuple:
+        return database, container, spec.query, json.dumps(spec.parameters, sort_keys=True, default=str)
+
+    def get(self, key: tuple) -> Optional[CachedLookup]:
+        """
+        The cached lookup, if it can be returned as is or revalidated with a point read.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.point is None and time.monotonic() - entry.stored_at > self.ttl_seconds:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def hit(self, entry: CachedLookup) -> Dict[str, Any]:
+        self._record(HIT)
+        return entry.payload
+
+    def revalidated(self, entry: CachedLookup) -> Dict[str, Any]:
+        entry.stored_at = time.monotonic()
+        self._record(REVALIDATED)
+        return entry.payload
+
+    def deleted(self, key: tuple):
+        with self._lock:
+            self._remove(key)
+        self._record(DELETED)
+
+    def store(self, key: tuple, spec: QuerySpec, document: Dict[str, Any], fields: List[str],
+              point: Optional[Tuple[str, Any]], changed: bool = False) -> Dict[str, Any]:
+        """
+        Cache the document found by a lookup and return the tool payload for it.
+        """
+        self._record(CHANGED if changed else MISS)
+        payload = {"result": project(document, fields), "query": spec.query}
+        size = len(json.dumps(payload, default=str))
+        if size > self.max_bytes:
+            return payload
+        entry = CachedLookup(payload, document.get("_etag"), document.get("_ts"),
+                             point if document.get("_etag") else None, fields, size)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        return payload
+
+    def invalidate(self, database: Optional[str] = None, container: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._entries if database in (None, k[0]) and container in (None, k[1])]:
+                self._remove(key)
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+
+def point_read(field: str, value: Any, fields: List[str], partition_key: Optional[str]) -> Optional[Tuple[str, Any]]:
+    """
+    The (id, partition key value) of a lookup that can be answered by a point read
+    before anything is cached: a lookup by id in a container partitioned on /id.
+    """
+    if field == "id" and partition_key == "id" and all("." not in name for name in fields):
+        return str(value), value
+    return None
+
+
+def point_of(field: str, fields: List[str], document: Dict[str, Any],
+             partition_key: Optional[str]) -> Optional[Tuple[str, Any]]:
+    """
+    The (id, partition key value) to revalidate a lookup by id whose query returned
+    the whole document.
+    """
+    if field == "id" and not fields and partition_key and "id" in document and partition_key in document:
+        return document["id"], document[partition_key]
+    return None
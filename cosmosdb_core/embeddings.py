@@ -0,0 +1,144 @@
+"""
+Query embeddings with truncation to the model's input limit and an LRU cache keyed
+on the hash of the (truncated) text, for sync, async and batched callers.
+
+Embeddings are requested in base64 and kept as float32 buffers (see vectors.py).
+"""
+import hashlib
+import threading
+
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, List, Optional
+from cosmosdb_core.vectors import ENCODING_FORMAT, decode
+
+MAX_INPUT_TOKENS = 8192
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of embeddings.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            embedding = self._items.get(key)
+            if embedding is not None:
+                self._items.move_to_end(key)
+            return embedding
+
+    def put(self, key: str, embedding):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = embedding
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+class Embedder:
+    """
+    Embeds text with one embedding model. client and async_client are callables that
+    return the (shared) OpenAI clients; on_usage receives the tokens of each request
+    and segment(name) times tokenization and embedding requests for the profilers.
+    """
+    def __init__(self, model: Optional[str], client: Callable[[], Any], async_client: Optional[Callable[[], Any]] = None,
+                 cache_size: int = 4096, batch_size: int = 16, max_tokens: int = MAX_INPUT_TOKENS,
+                 on_usage: Optional[Callable[[int], None]] = None, tokenizer=None,
+                 segment: Optional[Callable[[str], ContextManager]] = None):
+        if tokenizer is None:
+            import tiktoken
+            # Tokenizer of text-embedding-3-large
+            tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.model = model
+        self.client = client
+        self.async_client = async_client
+        self.cache = EmbeddingCache(cache_size)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.on_usage = on_usage
+        self.tokenizer = tokenizer
+        self.segment = segment or (lambda name: nullcontext())
+
+    def truncate(self, text: str, max_tokens: Optional[int] = None) -> str:
+        max_tokens = max_tokens or self.max_tokens
+        with self.segment("tokenization"):
+            tokens = self.tokenizer.encode(text)
+            if len(tokens) > max_tokens:
+                text = self.tokenizer.decode(tokens[:max_tokens])
+        return text
+
+    def _prepare(self, text: str):
+        if self.model is None:
+            raise ValueError("Embedding model deployment name is not set.")
+        text = self.truncate(text)
+        key = text_hash(text)
+        return text, key, self.cache.get(key)
+
+    def _store(self, key: str, response):
+        if self.on_usage is not None:
+            self.on_usage(response.usage.total_tokens)
+        embedding = decode(response.data[0].embedding)
+        self.cache.put(key, embedding)
+        return embedding
+
+    def embed(self, text: str):
+        text, key, cached = self._prepare(text)
+        if cached is not None:
+            return cached
+        with self.segment("embedding"):
+            response = self.client().embeddings.create(input=text, model=self.model, encoding_format=ENCODING_FORMAT)
+        return self._store(key, response)
+
+    async def embed_async(self, text: str):
+        """
+        Async version of embed; the caller does not hold a thread while it waits on Azure OpenAI.
+        """
+        text, key, cached = self._prepare(text)
+        if cached is not None:
+            return cached
+        with self.segment("embedding"):
+            response = await self.async_client().embeddings.create(input=text, model=self.model,
+                                                                   encoding_format=ENCODING_FORMAT)
+        return self._store(key, response)
+
+    def embed_batch(self, texts: List[str]) -> List[Any]:
+        """
+        Embed several texts, serving repeated inputs from the cache and sending the
+        misses in batches of batch_size.
+        """
+        if self.model is None:
+            raise ValueError("Embedding model deployment name is not set.")
+
+        texts = [self.truncate(text) for text in texts]
+        keys = [text_hash(text) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+
+        missing = {}
+        for index, key in enumerate(keys):
+            if results[index] is None:
+                missing.setdefault(key, texts[index])
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            with self.segment("embedding"):
+                response = self.client().embeddings.create(input=[text for _, text in batch], model=self.model,
+                                                           encoding_format=ENCODING_FORMAT)
+            if self.on_usage is not None:
+                self.on_usage(response.usage.total_tokens)
+            for (key, _), item in zip(batch, sorted(response.data, key=lambda d: d.index)):
+                embedding = decode(item.embedding)
+                self.cache.put(key, embedding)
+                missing[key] = embedding
+
+        return [result if result is not None else missing[key] for result, key in zip(results, keys)]
@@ -0,0 +1,158 @@
+"""
+Process-wide HTTP clients for Azure OpenAI.
+
+Every OpenAI client created here shares one tuned httpx connection pool (one per
+event loop for async clients), so TCP and TLS connections are reused across chat
+sessions, embeddings and tool calls instead of being set up per client. HTTP/2 is
+used when the h2 package is installed. Pool utilization is exported as the
+http_pool_connections gauge.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+from typing import Dict, Any, List, Tuple
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from cosmosdb_core.telemetry import registry
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and HTTP2_AVAILABLE
+
+_lock = threading.Lock()
+_sync_client: httpx.Client = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_openai_clients: Dict[Tuple, Any] = {}
+# Async OpenAI clients per event loop; they are dropped with the loop's pool
+_async_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2_ENABLED,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "timeout": httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    }
+
+
+def sync_http_client() -> httpx.Client:
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = DefaultHttpxClient(**_client_options())
+        return _sync_client
+
+
+def _drop_closed_loops():
+    # Open connections refer to their loop, so a loop that was closed without being
+    # collected would otherwise keep its entries (and the loop) alive; called under _lock
+    for loop in [loop for loop in _async_clients if loop.is_closed()]:
+        _async_clients.pop(loop, None)
+        _async_openai_clients.pop(loop, None)
+
+
+def async_http_client(loop: asyncio.AbstractEventLoop = None) -> httpx.AsyncClient:
+    """
+    The pooled async client of an event loop, the running one by default (async
+    connections cannot be shared between loops).
+    """
+    loop = loop or asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            _drop_closed_loops()
+            client = DefaultAsyncHttpxClient(**_client_options())
+            _async_clients[loop] = client
+        return client
+
+
+def azure_openai_client(azure_endpoint: str, api_key: str, api_version: str, **kwargs) -> AzureOpenAI:
+    """
+    Shared sync Azure OpenAI client for the given endpoint and settings.
+    """
+    key = ("sync", azure_endpoint, api_key, api_version, tuple(sorted(kwargs.items())))
+    with _lock:
+        client = _openai_clients.get(key)
+    if client is None:
+        client = AzureOpenAI(azure_endpoint=azure_endpoint, api_key=api_key, api_version=api_version,
+                             http_client=sync_http_client(), **kwargs)
+        with _lock:
+            client = _openai_clients.setdefault(key, client)
+    return client
+
+
+def async_azure_openai_client(azure_endpoint: str, api_key: str, api_version: str,
+                              loop: asyncio.AbstractEventLoop = None, **kwargs) -> AsyncAzureOpenAI:
+    """
+    Shared async Azure OpenAI client for the given endpoint and settings on an event
+    loop, the running one by default.
+    """
+    loop = loop or asyncio.get_running_loop()
+    key = (azure_endpoint, api_key, api_version, tuple(sorted(kwargs.items())))
+    with _lock:
+        clients = _async_openai_clients.get(loop)
+        if clients is None:
+            clients = _async_openai_clients[loop] = {}
+        client = clients.get(key)
+    if client is None:
+        client = AsyncAzureOpenAI(azure_endpoint=azure_endpoint, api_key=api_key, api_version=api_version,
+                                  http_client=async_http_client(loop), **kwargs)
+        with _lock:
+            client = clients.setdefault(key, client)
+    return client
+
+
+def _pool_connections(client) -> List[Any]:
+    # httpx keeps its connection pool on the transport; the attribute is private, so degrade quietly
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """
+    Connections per pool: total, idle, and in use, with the configured limit.
+    """
+    with _lock:
+        _drop_closed_loops()
+        clients = ([("sync", _sync_client)] if _sync_client is not None else []) + \
+                  [("async", client) for client in list(_async_clients.values())]
+    stats = []
+    for kind, client in clients:
+        connections = _pool_connections(client)
+        idle = sum(1 for c in connections if c.is_idle())
+        stats.append({
+            "pool": kind,
+            "http2": HTTP2_ENABLED,
+            "connections": len(connections),
+            "idle": idle,
+            "in_use": len(connections) - idle,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+        })
+    return stats
+
+
+def _pool_observations():
+    totals: Dict[Tuple[str, str], int] = {}
+    for stats in pool_stats():
+        for state in ("idle", "in_use"):
+            key = (stats["pool"], state)
+            totals[key] = totals.get(key, 0) + stats[state]
+    return [({"pool": pool, "state": state}, value) for (pool, state), value in totals.items()]
+
+
+registry.gauge("http_pool_connections", "Open connections of the shared HTTP pools by state.", _pool_observations)
@@ -0,0 +1,352 @@
+"""
+On-demand wall-clock profiles of MCP tool calls and chat turns.
+
+A tool call or chat turn is profiled when it is picked by PROFILE_SAMPLE_RATE or,
+with PROFILE_ALLOW_REQUESTS=true, when it asks for it (an X-Profile: true header,
+"profile": true in the MCP request _meta or, for the Azure Functions tools, a
+"profile": true tool argument). With PROFILE_REQUEST_SECRET set, the request must
+pass that secret as the value instead of true. Profiling stops once PROFILE_DIR
+holds PROFILE_MAX_FILES files or PROFILE_MAX_BYTES bytes. The profile is written
+to PROFILE_DIR as <time>-<kind>-<name>-<request id>-<unique suffix> with:
+
+    .speedscope.json  stack samples of the handler's thread every PROFILE_INTERVAL_MS
+                      (PROFILE_FORMAT=speedscope, open in https://www.speedscope.app)
+    .pstats           a cProfile of the handler (PROFILE_FORMAT=pstats, read with pstats)
+    .json             the duration and the time spent in each segment
+
+Segments (tokenization, embedding, cosmos, llm) are marked with segment() around the
+calls that wait on them. Their times are wall-clock and inclusive; segments of
+concurrent tasks in the same call overlap. The samples cover the whole thread, so on
+an event loop they include other requests running at the same time.
+"""
+import contextvars
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+try:
+    from mcp.server.lowlevel.server import request_ctx as mcp_request_ctx
+except ImportError:
+    mcp_request_ctx = None
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_ALLOW_REQUESTS = os.getenv("PROFILE_ALLOW_REQUESTS", "false").lower() == "true"
+PROFILE_REQUEST_SECRET = os.getenv("PROFILE_REQUEST_SECRET", "")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(256 * 1024 * 1024)))
+PROFILE_HEADER = "x-profile"
+REQUEST_ID_HEADER = "x-request-id"
+
+SEGMENTS = ("tokenization", "embedding", "cosmos", "llm")
+
+logger = logging.getLogger("profiling")
+
+
+class Profile:
+    """
+    Samples and segment times of one profiled tool call or chat turn.
+    """
+    def __init__(self, kind: str, name: str, request_id: str, format: str):
+        self.kind = kind
+        self.name = name
+        self.request_id = request_id
+        self.format = format
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.last_sample = self.started
+        self.segments: Dict[str, float] = {}
+        self.samples: List[Tuple[Tuple[Tuple[str, str, int], ...], float]] = []
+        self.cprofile: Optional[cProfile.Profile] = None
+
+    def add(self, segment_name: str, seconds: float):
+        self.segments[segment_name] = self.segments.get(segment_name, 0.0) + seconds
+
+
+_current_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("profiling_profile", default=None)
+_active_segments: contextvars.ContextVar[Tuple[str, ...]] = contextvars.ContextVar("profiling_segments", default=())
+
+
+@contextmanager
+def segment(name: str):
+    """
+    Time a block of the current profile as segment name (a no-op when not profiling).
+    """
+    profile = _current_profile.get()
+    active = _active_segments.get()
+    if profile is None or name in active:
+        yield
+        return
+    token = _active_segments.set(active + (name,))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+        _active_segments.reset(token)
+
+
+async def timed_stream(stream, name: str):
+    """
+    Iterate an async stream, adding the time spent waiting for each item to segment name.
+    """
+    iterator = stream.__aiter__()
+    while True:
+        with segment(name):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+def _flag(value) -> Optional[bool]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _request_flag(value) -> Optional[bool]:
+    # Callers may only ask for profiles when the deployment allows it
+    if value is None or not PROFILE_ALLOW_REQUESTS:
+        return None
+    if PROFILE_REQUEST_SECRET:
+        return True if hmac.compare_digest(str(value).encode(), PROFILE_REQUEST_SECRET.encode()) else None
+    return _flag(value)
+
+
+def requested(headers: Optional[Mapping[str, str]]) -> Optional[bool]:
+    """
+    Whether the HTTP headers of a request ask for a profile (None when they do not
+    say, or when requests may not ask).
+    """
+    if not headers:
+        return None
+    return _request_flag(headers.get(PROFILE_HEADER) or headers.get(PROFILE_HEADER.title()))
+
+
+def tool_request(args: tuple, kwargs: Dict[str, Any]) -> Tuple[Optional[bool], Optional[str]]:
+    """
+    (profile requested, request id) of the tool call being handled: from the MCP
+    request's HTTP headers or _meta, or from a "profile" argument of an Azure
+    Functions tool (whose handlers receive the arguments as a JSON string).
+    """
+    flag, request_id = None, None
+    if mcp_request_ctx is not None:
+        context = mcp_request_ctx.get(None)
+        if context is not None:
+            headers = getattr(context.request, "headers", None)
+            if headers is not None:
+                flag = requested(headers)
+                request_id = headers.get(REQUEST_ID_HEADER)
+            meta_flag = getattr(context.meta, "profile", None) if context.meta is not None else None
+            if meta_flag is not None:
+                flag = _request_flag(meta_flag)
+            request_id = request_id or str(context.request_id)
+    if "profile" in kwargs:
+        flag = _request_flag(kwargs["profile"])
+    elif args and isinstance(args[0], str) and '"profile"' in args[0]:
+        try:
+            arguments = json.loads(args[0]).get("arguments", {})
+            flag = _request_flag(arguments.get("profile"))
+        except (ValueError, AttributeError):
+            pass
+    return flag, request_id
+
+
+class _Sampler:
+    """
+    One background thread recording the stacks of the threads with an active profile.
+    """
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._profiles: Dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles[id(profile)] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            self._profiles.pop(id(profile), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            with self._lock:
+                profiles = list(self._profiles.values())
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                profile.samples.append((tuple(reversed(stack)), now - profile.last_sample))
+                profile.last_sample = now
+
+
+_sampler = _Sampler(PROFILE_INTERVAL_MS / 1000.0)
+_cprofile_busy = False
+_cprofile_lock = threading.Lock()
+
+
+def _start_capture(profile: Profile):
+    global _cprofile_busy
+    if profile.format == "pstats":
+        # Only one cProfile can be active at a time; overlapping calls are sampled instead
+        with _cprofile_lock:
+            if not _cprofile_busy:
+                _cprofile_busy = True
+                profile.cprofile = cProfile.Profile()
+                profile.cprofile.enable()
+                return
+        profile.format = "speedscope"
+    _sampler.add(profile)
+
+
+def _stop_capture(profile: Profile):
+    global _cprofile_busy
+    if profile.cprofile is not None:
+        profile.cprofile.disable()
+        with _cprofile_lock:
+            _cprofile_busy = False
+    else:
+        _sampler.remove(profile)
+
+
+def _speedscope(profile: Profile, duration: float) -> Dict[str, Any]:
+    frames: List[Dict[str, Any]] = []
+    indexes: Dict[Tuple[str, str, int], int] = {}
+    samples, weights = [], []
+    for stack, weight in profile.samples:
+        sample = []
+        for frame in stack:
+            index = indexes.get(frame)
+            if index is None:
+                index = indexes[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            sample.append(index)
+        samples.append(sample)
+        weights.append(weight)
+    title = f"{profile.kind} {profile.name} {profile.request_id}"
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": title,
+        "exporter": "cosmosdb-mcp profiling",
+        "shared": {"frames": frames},
+        "profiles": [{"type": "sampled", "name": title, "unit": "seconds", "startValue": 0,
+                      "endValue": duration, "samples": samples, "weights": weights}],
+    }
+
+
+_budget_warned = False
+
+
+def _within_budget() -> bool:
+    """
+    Whether PROFILE_DIR still has room for another profile.
+    """
+    global _budget_warned
+    files = size = 0
+    try:
+        with os.scandir(PROFILE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files += 1
+                    size += entry.stat().st_size
+    except FileNotFoundError:
+        return True
+    if files < PROFILE_MAX_FILES and size < PROFILE_MAX_BYTES:
+        return True
+    if not _budget_warned:
+        _budget_warned = True
+        logger.warning(f"Not profiling: {PROFILE_DIR} holds {files} files and {size} bytes "
+                       f"(PROFILE_MAX_FILES={PROFILE_MAX_FILES}, PROFILE_MAX_BYTES={PROFILE_MAX_BYTES})")
+    return False
+
+
+def _write(profile: Profile, duration: float, failed: bool) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in profile.name)
+    safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in profile.request_id)
+    # Request ids restart per MCP session, so a unique suffix keeps concurrent profiles apart
+    base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{profile.kind}-{safe_name}-{safe_id}-{uuid.uuid4().hex[:8]}")
+    if profile.cprofile is not None:
+        path = f"{base}.pstats"
+        profile.cprofile.dump_stats(path)
+    else:
+        path = f"{base}.speedscope.json"
+        with open(path, "w", encoding="utf-8") as profile_file:
+            json.dump(_speedscope(profile, duration), profile_file)
+    summary = {
+        "kind": profile.kind,
+        "name": profile.name,
+        "request_id": profile.request_id,
+        "status": "error" if failed else "ok",
+        "duration_ms": round(duration * 1000.0, 2),
+        "segments_ms": {name: round(profile.segments.get(name, 0.0) * 1000.0, 2) for name in SEGMENTS},
+        "profile": os.path.basename(path),
+    }
+    with open(f"{base}.json", "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    logger.info("profile=%s duration_ms=%.1f segments_ms=%s", path, duration * 1000.0, json.dumps(summary["segments_ms"]))
+    return path
+
+
+@contextmanager
+def profiled(kind: str, name: str, enabled: Optional[bool] = None, request_id: Optional[str] = None):
+    """
+    Profile the block when enabled is True, or when enabled is None and the call
+    is sampled. Nested blocks (a tool called within a profiled turn) add to the
+    outer profile.
+    """
+    if _current_profile.get() is not None:
+        yield
+        return
+    if enabled is None:
+        enabled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if not enabled or not _within_budget():
+        yield
+        return
+
+    profile = Profile(kind, name, request_id or uuid.uuid4().hex[:16], PROFILE_FORMAT)
+    token = _current_profile.set(profile)
+    _start_capture(profile)
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _stop_capture(profile)
+        _current_profile.reset(token)
+        try:
+            _write(profile, time.perf_counter() - profile.started, failed)
+        except Exception as e:
+            logger.error(f"Error writing the profile of {kind} {name}: {e}")
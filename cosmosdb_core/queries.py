@@ -0,0 +1,110 @@
+"""
+Cosmos DB SQL of the MCP tools.
+
+Values supplied by the agent (filter values, vectors, limits) are passed as query
+parameters, so a tool always sends the same query text: the gateway can reuse its
+query plan and a quote in a value cannot change the query. Field names cannot be
+parameters and are written as property paths instead.
+"""
+import json
+import os
+import re
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
+from cosmosdb_core.vectors import as_list
+
+DEFAULT_TOP_K = 5
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("VECTOR_SEARCH_SIMILARITY_THRESHOLD", "0.5"))
+SYSTEM_PROPERTIES = ["_rid", "_self", "_etag", "_attachments", "_ts"]
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class QuerySpec(NamedTuple):
+    query: str
+    parameters: List[Dict[str, Any]] = []
+
+
+def parameters(**values) -> List[Dict[str, Any]]:
+    return [{"name": f"@{name}", "value": value} for name, value in values.items()]
+
+
+def property_path(field: str) -> str:
+    """
+    Path of a (possibly nested, dot-separated) field: c.name, or c["na-me"] for
+    names that are not identifiers.
+    """
+    path = "c"
+    for part in field.strip().split("."):
+        path += f".{part}" if _IDENTIFIER.match(part) else f"[{json.dumps(part)}]"
+    return path
+
+
+def parse_fields(fields: Union[None, str, Iterable[str]]) -> List[str]:
+    """
+    Field names from a comma-separated string or a list; empty for all fields ("*").
+    """
+    if fields is None:
+        return []
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    names = [name.strip() for name in fields if name and name.strip()]
+    return [] if names in ([], ["*"]) else names
+
+
+def projection(fields: Union[None, str, Iterable[str]]) -> str:
+    names = parse_fields(fields)
+    return ", ".join(property_path(name) for name in names) if names else "*"
+
+
+def full_text_terms(text: str) -> str:
+    """
+    The words of a query as a FullTextScore term list, quoted as JSON strings.
+    """
+    return json.dumps(text.split())
+
+
+COUNT = QuerySpec("SELECT VALUE COUNT(1) FROM c")
+SCHEMA_SAMPLE = QuerySpec("SELECT TOP 1 * FROM c")
+
+
+def field_filter(field: str, value: Any, fields: Union[None, str, Iterable[str]] = None) -> QuerySpec:
+    return QuerySpec(f"SELECT {projection(fields)} FROM c WHERE {property_path(field)} = @value",
+                     parameters(value=value))
+
+
+def sample(n: int, fields: Union[None, str, Iterable[str]] = None) -> QuerySpec:
+    return QuerySpec(f"SELECT TOP @n {projection(fields)} FROM c", parameters(n=int(n)))
+
+
+def policy_path(path: str) -> str:
+    """
+    Property path of a path from an indexing or vector embedding policy ("/a/b").
+    """
+    return property_path(path.strip("/").replace("/", "."))
+
+
+def vector_search(query_vector: List[float], top_k: Optional[int] = None, vector_path: str = "/embedding") -> QuerySpec:
+    vector = policy_path(vector_path)
+    return QuerySpec(
+        f"SELECT TOP @top_k c.pid, c.passage, VectorDistance({vector}, @embedding) AS SimilarityScore "
+        f"FROM c ORDER BY VectorDistance({vector}, @embedding)",
+        parameters(top_k=int(top_k or DEFAULT_TOP_K), embedding=as_list(query_vector)))
+
+
+def within_threshold(score: float, threshold: float, distance_function: Optional[str] = None) -> bool:
+    """
+    Whether a VectorDistance score passes a threshold: at or above it for the cosine and
+    dotproduct similarities, at or below it for euclidean, where lower means closer.
+    """
+    if distance_function == "euclidean":
+        return score <= threshold
+    return score >= threshold
+
+
+def hybrid_search(query_text: str, query_vector: List[float], top_k: Optional[int] = None) -> QuerySpec:
+    # The search terms are part of the query text: FullTextScore takes them as literals
+    return QuerySpec(
+        f"SELECT TOP @top_k c.pid, c.passage FROM c ORDER BY RANK RRF("
+        f"FullTextScore(c.passage, {full_text_terms(query_text)}), VectorDistance(c.embedding, @embedding))",
+        parameters(top_k=int(top_k or DEFAULT_TOP_K), embedding=as_list(query_vector)))
@@ -0,0 +1,115 @@
+"""
+Compact encodings of the documents returned by the sample and field-filter tools.
+
+A tool result is sent to the agent as JSON and stays in the conversation, so its
+size is paid in MCP payload bytes and again in prompt tokens on every later call.
+RESULT_FORMAT (or a tool's format argument) picks how documents are written:
+
+    json      the documents as stored
+    compact   without system properties, strings cut at RESULT_MAX_STRING_CHARS
+              and vectors replaced by "<vector of N numbers>"
+    columns   compact, with the field names written once:
+              {"columns": [...], "rows": [[...], ...]} (a missing field is null)
+    table     compact, as CSV text: a header line, then one line per document
+              ("csv" is accepted as well)
+
+A single document (the field filter's result) is written compact by columns, since
+one row gains nothing from a shared header.
+"""
+import csv
+import io
+import json
+import os
+import random
+
+from typing import Any, Callable, Dict, List, Optional
+from cosmosdb_core.queries import SYSTEM_PROPERTIES
+from cosmosdb_core.tokens import count_tokens
+
+FORMATS = ("json", "compact", "columns", "table")
+RESULT_FORMAT = os.getenv("RESULT_FORMAT", "columns").lower()
+RESULT_MAX_STRING_CHARS = int(os.getenv("RESULT_MAX_STRING_CHARS", "500"))
+# Share of encode_result calls whose sizes are measured for on_size; measuring costs a
+# JSON dump and a tokenization of the result, so most calls skip it
+RESULT_SIZE_SAMPLE_RATE = float(os.getenv("RESULT_SIZE_SAMPLE_RATE", "0.1"))
+# Numeric lists longer than this are summarized as vectors
+VECTOR_MIN_LENGTH = 16
+
+def compact_value(value, max_chars: int = RESULT_MAX_STRING_CHARS):
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + f"... (+{len(value) - max_chars} chars)"
+    if isinstance(value, list):
+        if len(value) > VECTOR_MIN_LENGTH and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+            return f"<vector of {len(value)} numbers>"
+        return [compact_value(v, max_chars) for v in value]
+    if isinstance(value, dict):
+        return {k: compact_value(v, max_chars) for k, v in value.items()}
+    return value
+
+
+def compact_document(document: Dict[str, Any], max_chars: int = RESULT_MAX_STRING_CHARS) -> Dict[str, Any]:
+    """
+    A document without system properties and with long values shortened.
+    """
+    return {k: compact_value(v, max_chars) for k, v in document.items() if k not in SYSTEM_PROPERTIES}
+
+
+def columns(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    names: Dict[str, None] = {}
+    for document in documents:
+        names.update(dict.fromkeys(document))
+    return {"columns": list(names), "rows": [[document.get(name) for name in names] for document in documents]}
+
+
+def table(documents: List[Dict[str, Any]]) -> str:
+    header = columns(documents)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(header["columns"])
+    for row in header["rows"]:
+        writer.writerow(["" if v is None else v if isinstance(v, (str, int, float)) else json.dumps(v) for v in row])
+    return output.getvalue()
+
+
+def encode(result, format: str, max_chars: int = RESULT_MAX_STRING_CHARS):
+    """
+    A document or list of documents in format.
+    """
+    if format == "json" or not isinstance(result, (dict, list)):
+        return result
+    documents = [result] if isinstance(result, dict) else result
+    if not all(isinstance(document, dict) for document in documents):
+        return result
+    documents = [compact_document(document, max_chars) for document in documents]
+    if format == "table":
+        return table(documents)
+    if format == "columns" and isinstance(result, list):
+        return columns(documents)
+    return documents[0] if isinstance(result, dict) else documents
+
+
+def encode_result(payload: Optional[Dict[str, Any]], format: Optional[str] = None,
+                  on_size: Optional[Callable[[str, int, int, int, int], None]] = None,
+                  sample_rate: Optional[float] = None):
+    """
+    The tool payload {"result", "query"} with its result encoded in format (RESULT_FORMAT
+    when empty or unknown). For a sample_rate share of the calls (RESULT_SIZE_SAMPLE_RATE
+    by default), on_size receives the format and the bytes and tokens of the result as
+    JSON and as encoded.
+    """
+    format = (format or "").strip().lower().replace("csv", "table")
+    if format not in FORMATS:
+        format = RESULT_FORMAT if RESULT_FORMAT in FORMATS else "columns"
+    if not isinstance(payload, dict) or "result" not in payload:
+        return payload
+    encoded = encode(payload["result"], format)
+    sample_rate = RESULT_SIZE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if on_size is not None and sample_rate > 0 and (sample_rate >= 1 or random.random() < sample_rate):
+        original_text = json.dumps(payload["result"], default=str)
+        original_bytes, original_tokens = len(original_text.encode("utf-8")), count_tokens(original_text)
+        if encoded is payload["result"]:
+            on_size(format, original_bytes, original_bytes, original_tokens, original_tokens)
+        else:
+            encoded_text = encoded if isinstance(encoded, str) else json.dumps(encoded, default=str)
+            on_size(format, original_bytes, len(encoded_text.encode("utf-8")), original_tokens, count_tokens(encoded_text))
+    return {**payload, "result": encoded}
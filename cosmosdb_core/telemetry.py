@@ -0,0 +1,322 @@
+"""
+Latency, RU charge, payload size and token metrics for MCP tools and chat turns.
+
+Metrics are kept in an in-process registry that can be rendered in the Prometheus
+text format, and are mirrored to OpenTelemetry instruments when the
+opentelemetry package is installed (the API is a no-op until an SDK is configured).
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from cosmosdb_core.profiling import profiled, tool_request
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    otel_metrics = None
+
+logger = logging.getLogger("telemetry")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+MAX_TRACKED_CONVERSATIONS = 1000
+
+
+class CallStats:
+    """
+    Resource usage accumulated while one tool call or chat turn is running.
+    """
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+        self.request_charge = 0.0
+        self.embedding_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_charge": round(self.request_charge, 2),
+            "embedding_tokens": self.embedding_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+_current_call: contextvars.ContextVar[Optional[CallStats]] = contextvars.ContextVar("telemetry_call", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, list]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._gauges: Dict[str, Callable[[], List[Tuple[Dict[str, str], float]]]] = {}
+        self._otel: Dict[str, Any] = {}
+        self._meter = otel_metrics.get_meter("cosmosdb-mcp") if otel_metrics is not None else None
+
+    def counter(self, name: str, description: str):
+        self._help[name] = ("counter", description)
+        self._counters.setdefault(name, {})
+        if self._meter is not None and name not in self._otel:
+            self._otel[name] = self._meter.create_counter(name, description=description)
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...], unit: str = ""):
+        self._help[name] = ("histogram", description)
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+        if self._meter is not None and name not in self._otel:
+            self._otel[name] = self._meter.create_histogram(name, unit=unit, description=description)
+
+    def gauge(self, name: str, description: str, callback: Callable[[], List[Tuple[Dict[str, str], float]]]):
+        """
+        Gauge read when metrics are collected; callback returns (labels, value) pairs.
+        """
+        self._help[name] = ("gauge", description)
+        self._gauges[name] = callback
+        if self._meter is not None and name not in self._otel:
+            def observe(options):
+                return [otel_metrics.Observation(value, attributes=labels) for labels, value in callback()]
+            self._otel[name] = self._meter.create_observable_gauge(name, callbacks=[observe], description=description)
+
+    def add(self, metric: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[metric]
+            series[key] = series.get(key, 0.0) + value
+        if metric in self._otel:
+            self._otel[metric].add(value, attributes=labels)
+
+    def observe(self, metric: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._buckets[metric]
+        with self._lock:
+            state = self._histograms[metric].get(key)
+            if state is None:
+                # One count per bucket plus +Inf, then sum
+                state = [0] * (len(buckets) + 1) + [0.0]
+                self._histograms[metric][key] = state
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(buckets)] += 1
+            state[-1] += value
+        if metric in self._otel:
+            self._otel[metric].record(value, attributes=labels)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, description) in self._help.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, value in self._counters[name].items():
+                        lines.append(f"{name}{_labels(key)} {value}")
+                    continue
+                if kind == "gauge":
+                    for labels, value in self._gauges[name]():
+                        lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+                    continue
+                buckets = self._buckets[name]
+                for key, state in self._histograms[name].items():
+                    cumulative = 0
+                    for i, bound in enumerate(buckets):
+                        cumulative += state[i]
+                        lines.append(f"{name}_bucket{_labels(key, le=str(bound))} {cumulative}")
+                    cumulative += state[len(buckets)]
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {state[-1]}")
+                    lines.append(f"{name}_count{_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Tuple, **extra) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+registry = Registry()
+registry.histogram("mcp_tool_duration_seconds", "Wall-clock duration of MCP tool calls.", LATENCY_BUCKETS, unit="s")
+registry.histogram("mcp_tool_response_bytes", "Size of the serialized MCP tool result.", BYTES_BUCKETS, unit="By")
+registry.counter("mcp_tool_calls_total", "MCP tool calls by status.")
+registry.counter("cosmos_request_charge_total", "Request units charged by Cosmos DB.")
+registry.counter("embedding_tokens_total", "Tokens sent to the embeddings model.")
+registry.counter("document_cache_lookups_total", "Field-filter lookups by document cache outcome (hit, revalidated, changed, miss, deleted).")
+registry.counter("llm_prompt_tokens_total", "Prompt tokens sent to the chat model.")
+registry.counter("llm_completion_tokens_total", "Completion tokens returned by the chat model.")
+registry.counter("tool_result_encoded_bytes_total", "Bytes of server tool results as JSON (original) and in their result format (encoded).")
+registry.counter("tool_result_encoded_tokens_total", "Tokens of server tool results as JSON (original) and in their result format (encoded).")
+registry.histogram("chat_turn_duration_seconds", "Duration of a chat turn including tool calls.", LATENCY_BUCKETS, unit="s")
+
+# Totals per conversation, bounded so long-running clients do not grow without limit
+_conversations: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+_conversations_lock = threading.Lock()
+
+
+def _scope() -> Dict[str, str]:
+    call = _current_call.get()
+    if call is None:
+        return {"kind": "other", "operation": "other"}
+    return {"kind": call.kind, "operation": call.name}
+
+
+def record_request_charge(headers: Dict[str, Any], *_):
+    """
+    Response hook for Cosmos DB calls (pass it as response_hook=) that records the RU charge.
+    """
+    charge = float(headers.get("x-ms-request-charge", 0) or 0)
+    call = _current_call.get()
+    if call is not None:
+        call.request_charge += charge
+    registry.add("cosmos_request_charge_total", charge, **_scope())
+
+
+def record_embedding_tokens(tokens: int):
+    call = _current_call.get()
+    if call is not None:
+        call.embedding_tokens += tokens
+    registry.add("embedding_tokens_total", tokens, **_scope())
+
+
+def record_document_cache(outcome: str):
+    registry.add("document_cache_lookups_total", 1, outcome=outcome, **_scope())
+
+
+def record_result_size(format: str, original_bytes: int, encoded_bytes: int, original_tokens: int, encoded_tokens: int):
+    """
+    on_size hook of cosmosdb_core's encode_result.
+    """
+    registry.add("tool_result_encoded_bytes_total", original_bytes, format=format, encoding="original", **_scope())
+    registry.add("tool_result_encoded_bytes_total", encoded_bytes, format=format, encoding="encoded", **_scope())
+    registry.add("tool_result_encoded_tokens_total", original_tokens, format=format, encoding="original", **_scope())
+    registry.add("tool_result_encoded_tokens_total", encoded_tokens, format=format, encoding="encoded", **_scope())
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int):
+    call = _current_call.get()
+    if call is not None:
+        call.prompt_tokens += prompt_tokens
+        call.completion_tokens += completion_tokens
+    registry.add("llm_prompt_tokens_total", prompt_tokens, **_scope())
+    registry.add("llm_completion_tokens_total", completion_tokens, **_scope())
+
+
+def _response_size(result) -> int:
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return len(str(result))
+
+
+def _is_error(result) -> bool:
+    return result is None or (isinstance(result, dict) and "error" in result)
+
+
+def _finish_tool(tool_name: str, call: CallStats, started: float, result, failed: bool):
+    elapsed = time.perf_counter() - started
+    status = "error" if failed or _is_error(result) else "ok"
+    registry.observe("mcp_tool_duration_seconds", elapsed, tool=tool_name)
+    registry.add("mcp_tool_calls_total", 1, tool=tool_name, status=status)
+    if not failed:
+        registry.observe("mcp_tool_response_bytes", _response_size(result), tool=tool_name)
+    logger.info("tool=%s status=%s duration_ms=%.1f %s", tool_name, status, elapsed * 1000, json.dumps(call.to_dict()))
+
+
+def instrument_tool(tool_name: str):
+    """
+    Decorator recording latency, status, result size, RU charge and tokens of a tool,
+    and its profile when one is requested (see profiling.py).
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                call = CallStats("tool", tool_name)
+                token = _current_call.set(call)
+                started = time.perf_counter()
+                result, failed = None, True
+                try:
+                    with profiled("tool", tool_name, *tool_request(args, kwargs)):
+                        result = await fn(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    _current_call.reset(token)
+                    _finish_tool(tool_name, call, started, result, failed)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            call = CallStats("tool", tool_name)
+            token = _current_call.set(call)
+            started = time.perf_counter()
+            result, failed = None, True
+            try:
+                with profiled("tool", tool_name, *tool_request(args, kwargs)):
+                    result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _current_call.reset(token)
+                _finish_tool(tool_name, call, started, result, failed)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_turn(conversation_id: str, name: str = "chat", profile: Optional[bool] = None):
+    """
+    Measure one chat turn and add its usage to the totals of the conversation.
+    profile forces (True) or skips (False) a profile of the turn; None leaves it to
+    PROFILE_SAMPLE_RATE.
+    """
+    call = CallStats("chat", name)
+    token = _current_call.set(call)
+    started = time.perf_counter()
+    try:
+        with profiled("chat", name, profile):
+            yield call
+    finally:
+        _current_call.reset(token)
+        elapsed = time.perf_counter() - started
+        registry.observe("chat_turn_duration_seconds", elapsed, client=name)
+        with _conversations_lock:
+            totals = _conversations.pop(conversation_id, None) or {"turns": 0, "seconds": 0.0, "request_charge": 0.0,
+                                                                   "embedding_tokens": 0, "prompt_tokens": 0,
+                                                                   "completion_tokens": 0}
+            totals["turns"] += 1
+            totals["seconds"] += elapsed
+            for key, value in call.to_dict().items():
+                totals[key] += value
+            _conversations[conversation_id] = totals
+            while len(_conversations) > MAX_TRACKED_CONVERSATIONS:
+                _conversations.popitem(last=False)
+        logger.info("conversation=%s duration_ms=%.1f %s", conversation_id, elapsed * 1000, json.dumps(call.to_dict()))
+
+
+def conversation_totals(conversation_id: str) -> Optional[Dict[str, float]]:
+    with _conversations_lock:
+        totals = _conversations.get(conversation_id)
+        return dict(totals) if totals is not None else None
+
+
+def render_prometheus() -> str:
+    return registry.render_prometheus()
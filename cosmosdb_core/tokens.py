@@ -0,0 +1,25 @@
+"""
+Token counts for the chat model, shared by the result encodings of the servers and
+the tool result compaction of the clients.
+"""
+from cosmosdb_core.profiling import segment
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tokens of a text for the chat model, estimated from its length if tiktoken
+    cannot load its encoding.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    with segment("tokenization"):
+        return len(_encoding.encode(text, disallowed_special=()))
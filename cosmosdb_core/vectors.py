@@ -0,0 +1,58 @@
+"""
+Embeddings as float32 buffers.
+
+Asked for encoding_format="base64", Azure OpenAI returns each embedding as the
+base64 of its little-endian float32 values. Decoding that straight into a float32
+buffer (a read-only NumPy array over the decoded bytes, or array("f") without
+NumPy) skips building a list of Python floats: a 3072-dimension vector takes 12 KB
+instead of about 100 KB. Vectors stay in that form in the caches and in local
+similarity math, and become lists only where they are serialized to JSON: Cosmos DB
+query parameters and documents, and tool results.
+"""
+import base64
+import sys
+
+from array import array
+from typing import Any, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ENCODING_FORMAT = "base64"
+
+
+def from_base64(data: str):
+    """
+    A float32 vector from the base64 of its little-endian float32 values.
+    """
+    raw = base64.b64decode(data)
+    if np is not None:
+        return np.frombuffer(raw, dtype="<f4")
+    vector = array("f")
+    vector.frombytes(raw)
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+
+def decode(embedding: Any):
+    """
+    A float32 vector from the embedding of a response: base64, or a list of floats
+    from a deployment that ignores encoding_format.
+    """
+    if isinstance(embedding, str):
+        return from_base64(embedding)
+    if np is not None:
+        return np.asarray(embedding, dtype=np.float32)
+    return array("f", embedding)
+
+
+def as_list(vector) -> List[float]:
+    """
+    The vector as a list of floats, for JSON serialization.
+    """
+    if isinstance(vector, list):
+        return vector
+    return vector.tolist()
@@ -6,14 +6,17 @@ from typing import Dict
 from dotenv import load_dotenv
 from chat_service import ChatService
 from mcp import ClientSession
+from session_store import SessionRegistry, CosmosSpill, SPILL_TO_COSMOS
+from cosmosdb_core.telemetry import track_turn
+from cosmosdb_core.profiling import requested
 
 load_dotenv(override=True)
 
 logger = logging.getLogger("azure.core.pipeline.policies.http_logging_policy")
 logger.setLevel(logging.WARNING)
 
-chat_services = {}
-chat_messages = {}
+# Live chat services per thread, bounded and evicted when idle (see session_store.py)
+sessions = SessionRegistry(ChatService, spill=CosmosSpill() if SPILL_TO_COSMOS else None)
 
 def flatten(xss):
     return [x for xs in xss for x in xs]
@@ -39,8 +42,13 @@ async def on_chat_start():
 		thread_id = str(uuid.uuid4())
 
 		cl.user_session.set("thread_id", thread_id)
-		chat_services[thread_id] = ChatService()
-		chat_messages[thread_id] = []
+		await sessions.create(thread_id)
+
+@cl.on_chat_end
+async def on_chat_end():
+	thread_id = cl.user_session.get("thread_id")
+	if thread_id:
+		await sessions.end(thread_id)
 		
 @cl.on_message
 async def on_message(message: cl.Message):
@@ -50,13 +58,8 @@ async def on_message(message: cl.Message):
     
 	# Get the thread ID from the user session
 	thread_id = cl.user_session.get("thread_id")
-	chat_service: ChatService = chat_services.get(thread_id)
-    
-	if not chat_service:
-		raise ValueError("Chat service not found for the given thread ID.")
-    
-    # Restore conversation history
-	chat_service.messages = cl.user_session.get(f"messages-{thread_id}", [])
+	if not thread_id:
+		raise ValueError("Thread ID not found in the user session.")
     
 	msg = cl.Message(content="thinking...")
 
@@ -64,12 +67,14 @@ async def on_message(message: cl.Message):
 
 	msg = cl.Message(content="thinking...")
 
-	async for text in chat_service.generate_response(human_input=message.content, tools=tools):
-		msg.content = ""
-		await msg.stream_token(text)
-    
-    # Update the stored messages after processing
-	cl.user_session.set(f"messages-{thread_id}", chat_service.messages)
+	# The conversation history lives in the chat service only; an evicted service is restored here
+	async with sessions.session(thread_id) as chat_service:
+		# X-Profile: true on the chat page's connection profiles its turns
+		headers = getattr(cl.context.session, "http_headers", None)
+		with track_turn(thread_id, "chainlit", profile=requested(headers)):
+			async for text in chat_service.generate_response(human_input=message.content, tools=tools):
+				msg.content = ""
+				await msg.stream_token(text)
     
 if __name__ == "main":
     pass
\ No newline at end of file
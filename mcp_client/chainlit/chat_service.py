@@ -1,19 +1,32 @@
 import os
 import json
+import functools
 import chainlit as cl
 from openai import AsyncAzureOpenAI
 from mcp.types import TextContent, ImageContent
+from cosmosdb_core.telemetry import record_llm_usage
+from cosmosdb_core.profiling import segment, timed_stream
+from session_store import shared_openai_client
+from chat_core.response_compaction import ToolResultCompactor, FETCH_FULL_RESULT_TOOL, fetch_full_result_tool
+from chat_core.speculation import SpeculativeCall
+from chat_core.tool_selection import ToolSelector
+from chat_core.completion_cache import CompletionCache
+
+# Deterministic completions are replayed for every conversation in the process
+completion_cache = CompletionCache()
 
 class ChatService:
-    def __init__(self):
+    def __init__(self, client: AsyncAzureOpenAI = None):
         self.deployment_name = os.environ["CHAT_MODEL_NAME"]
-        self.client = AsyncAzureOpenAI(
-                azure_endpoint=os.environ["CHAT_MODEL_BASE_URL"],
-                api_key=os.environ["CHAT_MODEL_API_KEY"],
-                api_version=os.environ["CHAT_MODEL_API_VERSION"]
-            )
+        # Services share one client so connections are reused across conversations
+        self.client = client or shared_openai_client()
         self.messages = []
         self.active_streams = []
+        # Large tool results are shortened before they join the messages; the full
+        # versions stay here for the fetch_full_result tool
+        self.tool_results = ToolResultCompactor()
+        # Only the tools relevant to the user's message are sent with each completion
+        self.tool_selector = ToolSelector(self.client)
 
     async def process_response_stream(self, response_stream, tools, temperature=0):
         """
@@ -25,12 +38,14 @@ class ChatService:
         is_collecting_function_args = False
         collected_messages = []
         tool_called = False
+        speculation = None
 
         # Add to active streams for cleanup if needed
         self.active_streams.append(response_stream)
         
         try:
-            async for part in response_stream:
+            async for part in timed_stream(response_stream, "llm"):
+                self._record_usage(part)
                 if part.choices == []:
                     continue
                 delta = part.choices[0].delta
@@ -50,23 +65,21 @@ class ChatService:
                         if tool_call.function.name:
                             function_name = tool_call.function.name
                             tool_call_id = tool_call.id
+                            speculation = self._speculate(function_name)
                         
                         # Process function arguments delta
                         if tool_call.function.arguments:
                             function_arguments += tool_call.function.arguments
                             is_collecting_function_args = True
+                            # Read-only tools may start before the arguments are complete
+                            if speculation is not None:
+                                speculation.feed(tool_call.function.arguments)
                 
                 # Check if we've reached the end of a tool call
                 if finish_reason == "tool_calls" and is_collecting_function_args:
                     # Process the current tool call
                     print(f"function_name: {function_name} function_arguments: {function_arguments}")
                     function_args = json.loads(function_arguments)
-                    mcp_tools = cl.user_session.get("mcp_tools", {})
-                    mcp_name = None
-                    for connection_name, session_tools in mcp_tools.items():
-                        if any(tool.get("name") == function_name for tool in session_tools):
-                            mcp_name = connection_name
-                            break
 
                     # Add the assistant message with tool call
                     self.messages.append({
@@ -83,19 +96,28 @@ class ChatService:
                         ]
                     })
                     
+                    # The usage chunk follows the finish reason, read it before closing
+                    async for rest in response_stream:
+                        self._record_usage(rest)
+
                     # Safely close the current stream before starting a new one
                     if response_stream in self.active_streams:
                         self.active_streams.remove(response_stream)
                         await response_stream.close()
                     
-                    # Call the tool and add response to messages
-                    func_response = await call_tool(mcp_name, function_name, function_args)
-                    print(f"Function Response: {json.loads(func_response)}")
+                    # Call the tool and add its compacted response to messages
+                    if function_name == FETCH_FULL_RESULT_TOOL:
+                        page = self.tool_results.fetch(function_args.get("handle", ""), function_args.get("offset", 0))
+                        content = [{"type": "text", "text": page}]
+                    else:
+                        func_response = await call_tool(speculation, function_name, function_args)
+                        content = self.tool_results.compact_items(function_name, json.loads(func_response))
+                    print(f"Function Response: {content}")
                     self.messages.append({
                         "tool_call_id": tool_call_id,
                         "role": "tool",
                         "name": function_name,
-                        "content": json.loads(func_response),
+                        "content": content,
                     })
                     
                     # Set flag that tool was called and store the function name
@@ -110,6 +132,9 @@ class ChatService:
                         final_content = ''.join([msg for msg in collected_messages if msg is not None])
                         if final_content.strip():
                             self.messages.append({"role": "assistant", "content": final_content})
+
+                    async for rest in response_stream:
+                        self._record_usage(rest)
                     
                     # Remove from active streams after normal completion
                     if response_stream in self.active_streams:
@@ -117,6 +142,8 @@ class ChatService:
                     break  # Exit the loop instead of returning
                     
         except GeneratorExit:
+            if speculation is not None:
+                speculation.cancel()
             # Clean up this specific stream without recursive cleanup
             if response_stream in self.active_streams:
                 self.active_streams.remove(response_stream)
@@ -124,6 +151,8 @@ class ChatService:
             #raise
         except Exception as e:
             print(f"Error in process_response_stream: {e}")
+            if speculation is not None:
+                speculation.cancel()
             if response_stream in self.active_streams:
                 self.active_streams.remove(response_stream)
             self.last_error = str(e)
@@ -134,17 +163,25 @@ class ChatService:
     
     async def generate_response(self, human_input, tools, temperature=0):
         self.messages.append({"role": "user", "content": human_input})
+        selection = await self.tool_selector.select(human_input, tools)
+        tools = selection.tools
+        if self.tool_results.enabled:
+            tools = tools + [{"type": "function", "function": fetch_full_result_tool()}]
 
         # Handle multiple sequential function calls in a loop rather than recursively
         while True:
-            response_stream = await self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=self.messages,
-                tools=tools,
-                parallel_tool_calls=False,
-                stream=True,
-                temperature=temperature
-            )
+            selection.record()
+            with segment("llm"):
+                response_stream = await completion_cache.create(
+                    self.client,
+                    model=self.deployment_name,
+                    messages=self.messages,
+                    tools=tools,
+                    parallel_tool_calls=False,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    temperature=temperature
+                )
             
             try:
                 # Stream and process the response
@@ -170,6 +207,28 @@ class ChatService:
         async for token in self.process_response_stream(response_stream, tools, temperature):
             yield token
 
+    def _speculate(self, function_name):
+        """Track a tool call of an MCP tool so it can start while its arguments stream"""
+        if function_name == FETCH_FULL_RESULT_TOOL:
+            return None
+        for connection_name, session_tools in cl.user_session.get("mcp_tools", {}).items():
+            for tool in session_tools:
+                if tool.get("name") == function_name:
+                    call = functools.partial(call_mcp_tool, connection_name, function_name)
+                    return SpeculativeCall(function_name, call, tool.get("parameters"))
+        return SpeculativeCall(function_name, functools.partial(call_mcp_tool, None, function_name))
+
+    def _record_usage(self, part):
+        usage = getattr(part, "usage", None)
+        if usage is not None:
+            record_llm_usage(usage.prompt_tokens, usage.completion_tokens)
+
+    async def close(self):
+        """Release the streams and messages of this conversation (the shared client stays open)"""
+        await self._cleanup_streams()
+        self.messages = []
+        self.tool_results = ToolResultCompactor()
+
     async def _cleanup_streams(self):
         """Helper method to clean up all active streams"""
         for stream in self.active_streams:
@@ -180,8 +239,15 @@ class ChatService:
         self.active_streams = []
 
 
-@cl.step(type="tool") 
-async def call_tool(mcp_name, function_name, function_args):
+async def call_tool(speculation, function_name, function_args):
+    async with cl.Step(name=function_name, type="tool") as step:
+        step.input = function_args
+        # Reuses the call if it was started speculatively with the same arguments
+        step.output = await speculation.result(function_args)
+        return step.output
+
+
+async def call_mcp_tool(mcp_name, function_name, function_args):
     try:
         resp_items = []
         print(f"Function Name: {function_name} Function Args: {function_args}")
@@ -0,0 +1,235 @@
+"""
+Lifecycle of the per-thread chat services of the Chainlit app.
+
+Live services are kept in an LRU bounded by CHAINLIT_MAX_SESSIONS and are
+evicted when their chat ends or after CHAINLIT_SESSION_IDLE_SECONDS without a
+message. With CHAINLIT_SPILL_TO_COSMOS=true the messages of an evicted
+conversation are written to Cosmos DB and restored when the thread is used again;
+otherwise they are dropped.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+from openai import AsyncAzureOpenAI
+from cosmosdb_core.http_clients import async_azure_openai_client
+from cosmosdb_core.telemetry import record_request_charge
+
+MAX_SESSIONS = int(os.getenv("CHAINLIT_MAX_SESSIONS", "500"))
+SESSION_IDLE_SECONDS = float(os.getenv("CHAINLIT_SESSION_IDLE_SECONDS", "1800"))
+SPILL_TO_COSMOS = os.getenv("CHAINLIT_SPILL_TO_COSMOS", "false").lower() == "true"
+SPILL_DATABASE = os.getenv("CHAT_HISTORY_DATABASE", "agent_threads")
+SPILL_CONTAINER = os.getenv("CHAINLIT_SPILL_CONTAINER", "chainlit_sessions")
+SPILL_TTL_SECONDS = int(os.getenv("CHAINLIT_SPILL_TTL_SECONDS", str(7 * 24 * 3600)))
+
+logger = logging.getLogger("session_store")
+
+
+def shared_openai_client() -> AsyncAzureOpenAI:
+    """
+    One Azure OpenAI client (and connection pool) for every chat service in the process.
+    """
+    return async_azure_openai_client(
+        azure_endpoint=os.environ["CHAT_MODEL_BASE_URL"],
+        api_key=os.environ["CHAT_MODEL_API_KEY"],
+        api_version=os.environ["CHAT_MODEL_API_VERSION"]
+    )
+
+
+class CosmosSpill:
+    """
+    Stores the messages of idle conversations in a Cosmos DB container, one document per thread.
+    """
+    def __init__(self):
+        self._container = None
+
+    async def _get_container(self):
+        if self._container is None:
+            from azure.cosmos import PartitionKey
+            from azure.cosmos.aio import CosmosClient
+
+            client = CosmosClient(
+                url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"),
+                credential=os.getenv("COSMOSDB_ACCOUNT_KEY")
+            )
+            database = await client.create_database_if_not_exists(SPILL_DATABASE)
+            self._container = await database.create_container_if_not_exists(
+                id=SPILL_CONTAINER,
+                partition_key=PartitionKey(path="/thread_id"),
+                default_ttl=SPILL_TTL_SECONDS
+            )
+        return self._container
+
+    async def save(self, thread_id: str, messages: List[Dict[str, Any]]):
+        container = await self._get_container()
+        await container.upsert_item({
+            "id": thread_id,
+            "thread_id": thread_id,
+            "messages": messages,
+            "updated": time.time()
+        }, response_hook=record_request_charge)
+
+    async def load(self, thread_id: str) -> Optional[List[Dict[str, Any]]]:
+        from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+        container = await self._get_container()
+        try:
+            item = await container.read_item(thread_id, partition_key=thread_id, response_hook=record_request_charge)
+        except CosmosResourceNotFoundError:
+            return None
+        return item["messages"]
+
+
+class _Entry:
+    def __init__(self, service):
+        self.service = service
+        self.last_used = time.monotonic()
+        self.active = 0
+        # Set once the conversation has been restored from the spill store
+        self.ready = asyncio.Event()
+        # Set while the entry is being evicted; waited on by a thread that comes back meanwhile
+        self.evicting: Optional[asyncio.Event] = None
+
+
+class SessionRegistry:
+    """
+    LRU of live chat services keyed by thread id. A service in the middle of a turn, or
+    still being restored, is never evicted. An evicted entry stays registered until
+    its messages are saved, so a thread used again meanwhile waits and then restores
+    them instead of starting from stale or missing messages.
+    """
+    def __init__(self, factory, max_sessions: int = MAX_SESSIONS, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 spill: Optional[CosmosSpill] = None):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.spill = spill
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.evicted = 0
+        self.restored = 0
+
+    def __len__(self):
+        return sum(1 for entry in self._entries.values() if entry.evicting is None)
+
+    async def _current(self, thread_id: str) -> Optional[_Entry]:
+        # The thread's entry once it is ready, or None when it has none (or it was just evicted)
+        while True:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                return None
+            if entry.evicting is not None:
+                await entry.evicting.wait()
+                continue
+            await entry.ready.wait()
+            if self._entries.get(thread_id) is entry and entry.evicting is None:
+                self._entries.move_to_end(thread_id)
+                return entry
+
+    async def create(self, thread_id: str):
+        """
+        Register the service of a chat that started.
+        """
+        self._start_sweeper()
+        if await self._current(thread_id) is None:
+            entry = self._entries[thread_id] = _Entry(self.factory())
+            entry.ready.set()
+            await self._enforce_limit(keep=thread_id)
+
+    async def _load(self, thread_id: str) -> _Entry:
+        entry = await self._current(thread_id)
+        if entry is not None:
+            return entry
+        # Registered before restoring, so concurrent turns of the thread share this entry
+        entry = self._entries[thread_id] = _Entry(self.factory())
+        try:
+            if self.spill is not None:
+                try:
+                    messages = await self.spill.load(thread_id)
+                except Exception as e:
+                    logger.error(f"Error restoring conversation {thread_id}: {e}")
+                    messages = None
+                if messages:
+                    entry.service.messages = messages
+                    self.restored += 1
+        finally:
+            entry.ready.set()
+        await self._enforce_limit(keep=thread_id)
+        return entry
+
+    @asynccontextmanager
+    async def session(self, thread_id: str):
+        """
+        The chat service of a thread, restored from the spill store if it was evicted.
+        """
+        entry = await self._load(thread_id)
+        entry.active += 1
+        try:
+            yield entry.service
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+
+    @staticmethod
+    def _evictable(entry: _Entry) -> bool:
+        return entry.active == 0 and entry.evicting is None and entry.ready.is_set()
+
+    async def _evict(self, thread_id: str):
+        entry = self._entries.get(thread_id)
+        if entry is None or not self._evictable(entry):
+            return
+        entry.evicting = asyncio.Event()
+        self.evicted += 1
+        try:
+            if self.spill is not None and entry.service.messages:
+                try:
+                    await self.spill.save(thread_id, entry.service.messages)
+                except Exception as e:
+                    logger.error(f"Error saving conversation {thread_id}: {e}")
+        finally:
+            if self._entries.get(thread_id) is entry:
+                del self._entries[thread_id]
+            entry.evicting.set()
+        await entry.service.close()
+
+    async def _enforce_limit(self, keep: Optional[str] = None):
+        """
+        Evict least recently used services until at most max_sessions are live,
+        never the one of keep.
+        """
+        for thread_id, entry in list(self._entries.items()):
+            if len(self) <= self.max_sessions:
+                break
+            if thread_id != keep and self._evictable(entry):
+                await self._evict(thread_id)
+
+    async def end(self, thread_id: str):
+        """
+        Release the service of a chat that ended.
+        """
+        await self._evict(thread_id)
+
+    async def sweep(self):
+        """
+        Evict services that have been idle for longer than idle_seconds.
+        """
+        deadline = time.monotonic() - self.idle_seconds
+        for thread_id, entry in list(self._entries.items()):
+            if self._evictable(entry) and entry.last_used < deadline:
+                await self._evict(thread_id)
+
+    def _start_sweeper(self):
+        if self._sweeper is None and self.idle_seconds > 0:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_seconds))
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error evicting idle sessions: {e}")
@@ -12,6 +12,11 @@ def on_user_change(user: str) -> gr.Chatbot:
     return gr.Chatbot(value=messages, height=500, type="messages")
 
 
+def on_full_history(user: str) -> gr.Chatbot:
+    messages = mcp_client.load_user_messages(user, full=True)
+    return gr.Chatbot(value=messages, height=500, type="messages")
+
+
 def on_server_change(server_url: str) -> dict:
     showField = ".azurewebsites.net" in server_url
     return gr.update(visible=showField)
@@ -57,6 +62,8 @@ def gradio_interface():
         )
 
         dropdown_user.change(on_user_change, inputs=dropdown_user, outputs=chatbot)
+        full_history_btn = gr.Button("Load full history", size="sm")
+        full_history_btn.click(on_full_history, inputs=dropdown_user, outputs=chatbot)
         
         with gr.Row(equal_height=True):
             msg = gr.Textbox(
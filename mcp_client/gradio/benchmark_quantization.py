@@ -0,0 +1,160 @@
+"""
+Benchmark of the chat history embedding storage options.
+
+For every combination of dimensions and quantization mode this reports the bytes
+stored per vector, the size of the JSON document written to Cosmos DB, the
+recall@k of the quantized shortlist alone and after full-precision rescoring.
+With --measure-ru the documents are also written to a scratch container so the
+RU charge of writes and similarity queries can be compared.
+
+    python benchmark_quantization.py --count 5000 --queries 200
+    python benchmark_quantization.py --texts questions.txt --measure-ru
+"""
+import argparse
+import json
+import time
+import uuid
+import numpy as np
+
+from quantization import QuantizedIndex, normalize, quantize, encoded_size
+
+
+def synthetic_vectors(count: int, dimensions: int, seed: int = 7) -> np.ndarray:
+    # Clustered vectors so nearest neighbours are meaningful, like embeddings of related questions
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(count // 50, 1), dimensions)).astype(np.float32)
+    assignments = rng.integers(0, centers.shape[0], count)
+    vectors = centers[assignments] + 0.6 * rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def embedded_texts(path: str) -> np.ndarray:
+    from embeddings import generate_embeddings
+    with open(path, "r", encoding="utf-8") as text_file:
+        texts = [line.strip() for line in text_file if line.strip()]
+    return np.vstack([normalize(generate_embeddings(text)) for text in texts])
+
+
+def reduce_dimensions(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    # Equivalent to the embeddings `dimensions` parameter: truncate, then renormalize
+    reduced = vectors[:, :dimensions]
+    return reduced / np.linalg.norm(reduced, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ query
+    return np.argsort(-scores)[:k]
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, dimensions: int, mode: str, k: int, candidates: int):
+    full = vectors
+    reduced = reduce_dimensions(vectors, dimensions)
+    reduced_queries = reduce_dimensions(queries, dimensions)
+    truth = [set(exact_top_k(full, query, k)) for query in queries]
+
+    encoded = [quantize(vector, mode) for vector in reduced] if mode != "none" else None
+    index = None
+    if encoded is not None:
+        index = QuantizedIndex(mode)
+        for i, item in enumerate(encoded):
+            index.add(str(i), item)
+
+    shortlist_recall = []
+    rescored_recall = []
+    started = time.perf_counter()
+    for query, expected in zip(reduced_queries, truth):
+        if index is None:
+            shortlist = exact_top_k(reduced, query, candidates)
+        else:
+            shortlist = np.array([int(item_id) for item_id, _ in index.search(query, candidates)])
+        shortlist_recall.append(len(expected & set(shortlist[:k])) / k)
+        # Rescore the shortlist with the full-precision (reduced dimension) vectors
+        rescored = shortlist[np.argsort(-(reduced[shortlist] @ query))][:k]
+        rescored_recall.append(len(expected & set(rescored)) / k)
+    elapsed = time.perf_counter() - started
+
+    stored_bytes = dimensions * 4 + (encoded_size(encoded[0]) if encoded else 0)
+    document = {
+        "id": str(uuid.uuid4()),
+        "user": "benchmark",
+        "user_message_embeddings": reduced[0].tolist(),
+    }
+    if encoded:
+        document["user_message_embeddings_q"] = encoded[0]
+    return {
+        "dimensions": dimensions,
+        "quantization": mode,
+        "index_bytes_per_vector": encoded_size(encoded[0]) if encoded else dimensions * 4,
+        "stored_bytes_per_vector": stored_bytes,
+        "document_json_bytes": len(json.dumps(document)),
+        "recall_shortlist": round(float(np.mean(shortlist_recall)), 4),
+        "recall_rescored": round(float(np.mean(rescored_recall)), 4),
+        "query_ms": round(elapsed / len(queries) * 1000, 3),
+        "document": document,
+    }
+
+
+def measure_ru(row, count: int):
+    import os
+    from azure.cosmos import CosmosClient, PartitionKey
+
+    client = CosmosClient(url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"), credential=os.getenv("COSMOSDB_ACCOUNT_KEY"))
+    db = client.create_database_if_not_exists("agent_threads")
+    container_id = f"chat_history_benchmark_{uuid.uuid4().hex[:8]}"
+    container = db.create_container(
+        id=container_id,
+        partition_key=PartitionKey(path="/user", kind="Hash"),
+        vector_embedding_policy={"vectorEmbeddings": [{
+            "path": "/user_message_embeddings", "dataType": "float32",
+            "distanceFunction": "cosine", "dimensions": row["dimensions"]}]},
+        indexing_policy={
+            "includedPaths": [{"path": "/*"}],
+            "excludedPaths": [{"path": "/user_message_embeddings/*"}, {"path": "/user_message_embeddings_q/*"}],
+            "vectorIndexes": [{"path": "/user_message_embeddings", "type": "quantizedFlat"}]})
+    try:
+        write_charges = []
+        for _ in range(count):
+            document = dict(row["document"], id=str(uuid.uuid4()))
+            container.create_item(document)
+            write_charges.append(float(container.client_connection.last_response_headers["x-ms-request-charge"]))
+        items = container.query_items(
+            query="SELECT TOP 1 c.id, VectorDistance(c.user_message_embeddings, @e) AS s FROM c WHERE c.user = @user ORDER BY VectorDistance(c.user_message_embeddings, @e)",
+            parameters=[{"name": "@e", "value": row["document"]["user_message_embeddings"]}, {"name": "@user", "value": "benchmark"}],
+            partition_key="benchmark")
+        list(items)
+        row["write_ru"] = round(float(np.mean(write_charges)), 2)
+        row["similarity_query_ru"] = float(container.client_connection.last_response_headers["x-ms-request-charge"])
+    finally:
+        db.delete_container(container_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=5000, help="Number of synthetic vectors.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--texts", help="File with one text per line to embed instead of synthetic vectors.")
+    parser.add_argument("--dimensions", default="3072,1024,256")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--measure-ru", action="store_true", help="Write documents to a scratch container to measure RU.")
+    args = parser.parse_args()
+
+    vectors = embedded_texts(args.texts) if args.texts else synthetic_vectors(args.count, 3072)
+    rng = np.random.default_rng(11)
+    picks = rng.choice(vectors.shape[0], min(args.queries, vectors.shape[0]), replace=False)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+    rows = []
+    for dimensions in [int(d) for d in args.dimensions.split(",")]:
+        for mode in ("none", "int8", "binary"):
+            row = evaluate(vectors, queries, dimensions, mode, args.k, args.candidates)
+            if args.measure_ru:
+                measure_ru(row, count=20)
+            row.pop("document")
+            rows.append(row)
+
+    columns = list(rows[0].keys())
+    print(" | ".join(columns))
+    for row in rows:
+        print(" | ".join(str(row.get(column, "")) for column in columns))
@@ -0,0 +1,205 @@
+"""
+Retention of the chat history container.
+
+Every stored turn is one document holding the embedding of the user message, so a
+user's partition, and with it the cost of loading the history and of the similar
+message lookups, grows with every turn. Two mechanisms keep it bounded:
+
+- TTL: chat history containers are created with TTL enabled but no default expiry
+  (default_ttl=-1). With CHAT_HISTORY_TTL_SECONDS set, each stored turn carries that
+  "ttl" and Cosmos DB deletes it once it expires.
+- Compaction: this job keeps the newest CHAT_HISTORY_HOT_TURNS turns of each user
+  as they are and rolls the older ones into archive documents ("kind": "archive")
+  holding the text of up to CHAT_HISTORY_ARCHIVE_TURNS turns, without embeddings.
+  Each archive document is created in the same transactional batch that deletes
+  its turns, so a turn is never lost or duplicated. Archive documents expire after
+  CHAT_HISTORY_ARCHIVE_TTL_SECONDS when it is set.
+
+    python chat_history_retention.py --database agent_threads --container chat_history
+    python chat_history_retention.py --database agent_threads --container chat_history --user alice --keep 50
+    python chat_history_retention.py --database agent_threads --container chat_history --interval-seconds 3600
+
+For each compacted user the job reports the RU charge of the history query and of
+the similar-message query before and after.
+"""
+import argparse
+import json
+import os
+import time
+
+from typing import Any, Dict, List, Optional
+from azure.cosmos import ContainerProxy
+
+CHAT_HISTORY_HOT_TURNS = int(os.getenv("CHAT_HISTORY_HOT_TURNS", "200"))
+CHAT_HISTORY_ARCHIVE_TURNS = int(os.getenv("CHAT_HISTORY_ARCHIVE_TURNS", "99"))
+CHAT_HISTORY_ARCHIVE_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_ARCHIVE_TTL_SECONDS", "0"))
+
+ARCHIVE_KIND = "archive"
+# The archive document and the deletes of its turns share one transactional batch (100 operations, 2 MB)
+MAX_ARCHIVE_TURNS = 99
+MAX_ARCHIVE_BYTES = 1_500_000
+
+HISTORY_QUERY = "SELECT c.kind, c.turns, c.user_message, c.assistant_message, c.timestamp FROM c WHERE c.user = @user AND (NOT IS_DEFINED(c.kind) OR c.kind = 'archive') ORDER BY c.timestamp ASC"
+SIMILAR_QUERY = "SELECT TOP 1 c.assistant_message, VectorDistance(c.user_message_embeddings, @embeddings) AS SimilarityScore FROM c WHERE c.user = @user AND NOT IS_DEFINED(c.kind) ORDER BY VectorDistance(c.user_message_embeddings, @embeddings)"
+
+
+class _Charges:
+    """
+    response_hook that adds up the RU charge of every page.
+    """
+    def __init__(self):
+        self.total = 0.0
+
+    def __call__(self, headers, _):
+        self.total += float(headers.get("x-ms-request-charge", 0))
+
+
+def history_turns(items) -> List[Dict[str, Any]]:
+    """
+    Turns of the documents returned by HISTORY_QUERY, with archived turns expanded.
+    """
+    turns = []
+    for item in items:
+        kind = item.get("kind")
+        if kind == ARCHIVE_KIND:
+            turns.extend(item.get("turns", []))
+        elif kind is None:
+            turns.append(item)
+    return turns
+
+
+def turn_messages(turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The user and assistant chat messages of turns.
+    """
+    messages = []
+    for turn in turns:
+        messages.append({"role": "user", "content": turn["user_message"]})
+        messages.append({"role": "assistant", "content": turn["assistant_message"]})
+    return messages
+
+
+def measure_queries(container: ContainerProxy, user: str) -> Dict[str, Any]:
+    """
+    RU charge of loading the user's history and of a similar-message lookup, probed
+    with the embedding of the user's newest turn.
+    """
+    history = _Charges()
+    documents = sum(1 for _ in container.query_items(query=HISTORY_QUERY, parameters=[{"name": "@user", "value": user}],
+                                                    partition_key=user, response_hook=history))
+    result = {"documents": documents, "history_request_charge": round(history.total, 2)}
+    probe = next(iter(container.query_items(
+        query="SELECT TOP 1 c.user_message_embeddings FROM c WHERE c.user = @user AND NOT IS_DEFINED(c.kind) ORDER BY c.timestamp DESC",
+        parameters=[{"name": "@user", "value": user}],
+        partition_key=user
+    )), None)
+    if probe is not None and probe.get("user_message_embeddings"):
+        similar = _Charges()
+        list(container.query_items(query=SIMILAR_QUERY, parameters=[
+            {"name": "@embeddings", "value": probe["user_message_embeddings"]},
+            {"name": "@user", "value": user}
+        ], partition_key=user, response_hook=similar))
+        result["similar_request_charge"] = round(similar.total, 2)
+    return result
+
+
+def _archives(turns: List[Dict[str, Any]], max_turns: int) -> List[List[Dict[str, Any]]]:
+    chunks: List[List[Dict[str, Any]]] = []
+    size = 0
+    for turn in turns:
+        turn_size = len(json.dumps(turn))
+        if not chunks or len(chunks[-1]) >= max_turns or size + turn_size > MAX_ARCHIVE_BYTES:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(turn)
+        size += turn_size
+    return chunks
+
+
+def compact_user(container: ContainerProxy, user: str, keep: int = CHAT_HISTORY_HOT_TURNS,
+                 archive_turns: int = CHAT_HISTORY_ARCHIVE_TURNS,
+                 archive_ttl: int = CHAT_HISTORY_ARCHIVE_TTL_SECONDS, measure: bool = True) -> Dict[str, Any]:
+    """
+    Roll all but the newest keep turns of user into archive documents.
+    """
+    parameters = [{"name": "@user", "value": user}]
+    turns = next(iter(container.query_items(
+        query="SELECT VALUE COUNT(1) FROM c WHERE c.user = @user AND NOT IS_DEFINED(c.kind)",
+        parameters=parameters,
+        partition_key=user
+    )), 0)
+    result: Dict[str, Any] = {"user": user, "turns": turns, "archived": 0}
+    if turns <= keep:
+        return result
+    if measure:
+        result["before"] = measure_queries(container, user)
+
+    oldest = list(container.query_items(
+        query="SELECT TOP @count c.id, c.user_message, c.assistant_message, c.timestamp FROM c WHERE c.user = @user AND NOT IS_DEFINED(c.kind) ORDER BY c.timestamp ASC",
+        parameters=parameters + [{"name": "@count", "value": turns - keep}],
+        partition_key=user
+    ))
+    writes = _Charges()
+    for chunk in _archives(oldest, max(1, min(archive_turns, MAX_ARCHIVE_TURNS))):
+        archive: Dict[str, Any] = {
+            "id": f"{ARCHIVE_KIND}-{chunk[0]['id']}",
+            "user": user,
+            "kind": ARCHIVE_KIND,
+            "turns": [{key: turn[key] for key in ("user_message", "assistant_message", "timestamp")} for turn in chunk],
+            # Sorts the archive with its turns in the history query
+            "timestamp": chunk[-1]["timestamp"],
+        }
+        if archive_ttl > 0:
+            archive["ttl"] = archive_ttl
+        operations = [("create", (archive,))] + [("delete", (turn["id"],)) for turn in chunk]
+        container.execute_item_batch(batch_operations=operations, partition_key=user, response_hook=writes)
+        result["archived"] += len(chunk)
+    result["write_request_charge"] = round(writes.total, 2)
+    if measure:
+        result["after"] = measure_queries(container, user)
+    return result
+
+
+def compact(container: ContainerProxy, users: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+    """
+    Compact the given users, or every user in the container.
+    """
+    started = time.time()
+    if users is None:
+        users = list(container.query_items(query="SELECT DISTINCT VALUE c.user FROM c", enable_cross_partition_query=True))
+    compacted = []
+    for user in users:
+        result = compact_user(container, user, **kwargs)
+        if result["archived"]:
+            compacted.append(result)
+            print(json.dumps(result))
+    return {
+        "users": len(users),
+        "compacted": len(compacted),
+        "archived": sum(result["archived"] for result in compacted),
+        "seconds": round(time.time() - started, 2),
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from azure.cosmos import CosmosClient
+
+    load_dotenv(dotenv_path=".env")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=os.getenv("CHAT_HISTORY_DATABASE", "agent_threads"))
+    parser.add_argument("--container", default=os.getenv("CHAT_HISTORY_CONTAINER", "chat_history"))
+    parser.add_argument("--user", action="append", help="Compact only this user (repeatable).")
+    parser.add_argument("--keep", type=int, default=CHAT_HISTORY_HOT_TURNS, help="Newest turns kept per user.")
+    parser.add_argument("--interval-seconds", type=float, default=0, help="Run again after this many seconds.")
+    parser.add_argument("--no-measure", action="store_true", help="Skip the before and after query RU measurements.")
+    args = parser.parse_args()
+
+    client = CosmosClient(url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"), credential=os.getenv("COSMOSDB_ACCOUNT_KEY"))
+    container = client.get_database_client(args.database).get_container_client(args.container)
+    while True:
+        print(json.dumps(compact(container, args.user, keep=args.keep, measure=not args.no_measure), indent=2))
+        if args.interval_seconds <= 0:
+            break
+        time.sleep(args.interval_seconds)
@@ -0,0 +1,289 @@
+"""
+Declarative definitions of the Cosmos DB containers used by the chat app.
+
+Each container is described by a ContainerSpec from which the vector embedding,
+full-text and indexing policies are derived. The module can also be run as a
+command to create containers or to migrate an existing container into a new,
+correctly indexed one:
+
+    python cosmos_provisioning.py create --kind chat_history --database agent_threads --container chat_history
+    python cosmos_provisioning.py create --kind passages --database <db> --container <container>
+    python cosmos_provisioning.py verify --kind chat_history --database agent_threads --container chat_history
+    python cosmos_provisioning.py migrate --kind chat_history --database agent_threads --source chat_history --target chat_history_v2
+"""
+import argparse
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+from azure.cosmos import CosmosClient, ContainerProxy, DatabaseProxy, PartitionKey
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+SYSTEM_FIELDS = ["_rid", "_self", "_etag", "_attachments", "_ts"]
+# Cosmos DB transactional batches are limited to 100 operations and 2 MB
+MAX_TRANSACTIONAL_BATCH = 100
+MAX_BATCH_BYTES = 1_800_000
+
+
+class ContainerSpec:
+    def __init__(self, container_id: str, partition_key_path: str,
+                 vector_path: Optional[str] = None, dimensions: int = 3072,
+                 distance_function: str = "cosine", vector_index_type: str = "diskANN",
+                 vector_index_shard_key: Optional[List[str]] = None,
+                 full_text_paths: Optional[List[str]] = None, excluded_paths: Optional[List[str]] = None,
+                 default_ttl: Optional[int] = None):
+        self.container_id = container_id
+        self.partition_key_path = partition_key_path
+        self.vector_path = vector_path
+        self.dimensions = dimensions
+        self.distance_function = distance_function
+        self.vector_index_type = vector_index_type
+        self.vector_index_shard_key = vector_index_shard_key
+        self.full_text_paths = full_text_paths or []
+        self.excluded_paths = excluded_paths or []
+        self.default_ttl = default_ttl
+
+    def vector_embedding_policy(self) -> Optional[Dict[str, Any]]:
+        if self.vector_path is None:
+            return None
+        return {
+            "vectorEmbeddings": [
+                {
+                    "path": self.vector_path,
+                    "dataType": "float32",
+                    "distanceFunction": self.distance_function,
+                    "dimensions": self.dimensions,
+                }
+            ]
+        }
+
+    def full_text_policy(self) -> Optional[Dict[str, Any]]:
+        if not self.full_text_paths:
+            return None
+        return {
+            "defaultLanguage": "en-US",
+            "fullTextPaths": [{"path": path, "language": "en-US"} for path in self.full_text_paths],
+        }
+
+    def indexing_policy(self) -> Dict[str, Any]:
+        excluded = ['/"_etag"/?'] + list(self.excluded_paths)
+        if self.vector_path is not None:
+            # Vectors are served by the vector index, keeping them out of the range index saves RU on writes
+            excluded.append(f"{self.vector_path}/*")
+        policy: Dict[str, Any] = {
+            "indexingMode": "consistent",
+            "automatic": True,
+            "includedPaths": [{"path": "/*"}],
+            "excludedPaths": [{"path": path} for path in excluded],
+        }
+        if self.vector_path is not None:
+            vector_index: Dict[str, Any] = {"path": self.vector_path, "type": self.vector_index_type}
+            if self.vector_index_shard_key and self.vector_index_type == "diskANN":
+                vector_index["vectorIndexShardKey"] = self.vector_index_shard_key
+            policy["vectorIndexes"] = [vector_index]
+        if self.full_text_paths:
+            policy["fullTextIndexes"] = [{"path": path} for path in self.full_text_paths]
+        return policy
+
+
+def chat_history_spec(container_id: str = "chat_history", dimensions: int = 3072) -> ContainerSpec:
+    # TTL on without a default expiry: turns and archives expire only when they carry a "ttl"
+    return ContainerSpec(
+        container_id=container_id,
+        partition_key_path="/user",
+        vector_path="/user_message_embeddings",
+        dimensions=dimensions,
+        vector_index_shard_key=["/user"],
+        excluded_paths=["/user_message_embeddings_q/*", "/assistant_message/?", "/turns/*"],
+        default_ttl=-1,
+    )
+
+
+def passage_spec(container_id: str, dimensions: int = 3072, partition_key_path: str = "/pid") -> ContainerSpec:
+    return ContainerSpec(
+        container_id=container_id,
+        partition_key_path=partition_key_path,
+        vector_path="/embedding",
+        dimensions=dimensions,
+        full_text_paths=["/passage"],
+    )
+
+
+SPECS = {
+    "chat_history": chat_history_spec,
+    "passages": passage_spec,
+}
+# Setting that holds the embedding dimensions of the app writing each kind of container
+# (the Gradio client for chat history, the MCP server for passages; 0 means 3072)
+DIMENSIONS_SETTINGS = {
+    "chat_history": "CHAT_HISTORY_EMBEDDING_DIMENSIONS",
+    "passages": "openai_embeddings_dimensions",
+}
+
+
+def _create_kwargs(spec: ContainerSpec) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {
+        "id": spec.container_id,
+        "partition_key": PartitionKey(path=spec.partition_key_path, kind="Hash"),
+        "indexing_policy": spec.indexing_policy(),
+    }
+    if spec.vector_embedding_policy() is not None:
+        kwargs["vector_embedding_policy"] = spec.vector_embedding_policy()
+    if spec.full_text_policy() is not None:
+        kwargs["full_text_policy"] = spec.full_text_policy()
+    if spec.default_ttl is not None:
+        kwargs["default_ttl"] = spec.default_ttl
+    return kwargs
+
+
+def ensure_container(database: DatabaseProxy, spec: ContainerSpec) -> ContainerProxy:
+    """
+    Create the container described by spec if it does not exist yet.
+    """
+    return database.create_container_if_not_exists(**_create_kwargs(spec))
+
+
+def verify_container(container: ContainerProxy, spec: ContainerSpec) -> List[str]:
+    """
+    Compare an existing container with its spec and return the differences that affect query cost.
+    """
+    properties = container.read()
+    problems = []
+    if properties["partitionKey"]["paths"] != [spec.partition_key_path]:
+        problems.append(f"partition key is {properties['partitionKey']['paths']}, expected {spec.partition_key_path}")
+
+    expected_vectors = (spec.vector_embedding_policy() or {}).get("vectorEmbeddings", [])
+    actual_vectors = properties.get("vectorEmbeddingPolicy", {}).get("vectorEmbeddings", [])
+    if [v["path"] for v in actual_vectors] != [v["path"] for v in expected_vectors]:
+        problems.append(f"vector embeddings on {[v['path'] for v in actual_vectors]}, expected {[v['path'] for v in expected_vectors]}")
+
+    indexing = properties.get("indexingPolicy", {})
+    actual_indexes = [index["path"] for index in indexing.get("vectorIndexes", [])]
+    expected_indexes = [index["path"] for index in spec.indexing_policy().get("vectorIndexes", [])]
+    if actual_indexes != expected_indexes:
+        problems.append(f"vector indexes on {actual_indexes}, expected {expected_indexes}")
+
+    actual_excluded = {path["path"] for path in indexing.get("excludedPaths", [])}
+    for path in spec.indexing_policy()["excludedPaths"]:
+        if path["path"] not in actual_excluded:
+            problems.append(f"path {path['path']} is not excluded from the range index")
+
+    actual_full_text = [index["path"] for index in indexing.get("fullTextIndexes", [])]
+    if sorted(actual_full_text) != sorted(spec.full_text_paths):
+        problems.append(f"full-text indexes on {actual_full_text}, expected {spec.full_text_paths}")
+
+    if spec.default_ttl is not None and properties.get("defaultTtl") != spec.default_ttl:
+        problems.append(f"default TTL is {properties.get('defaultTtl')}, expected {spec.default_ttl} (items' own ttl is ignored while TTL is off)")
+    return problems
+
+
+def _partition_key_value(document: Dict[str, Any], path: str):
+    value = document
+    for part in path.strip("/").split("/"):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _batches(documents: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Documents split into chunks that fit a transactional batch by count and by size.
+    """
+    chunks: List[List[Dict[str, Any]]] = []
+    size = 0
+    for document in documents:
+        document_size = len(json.dumps(document))
+        if not chunks or len(chunks[-1]) >= MAX_TRANSACTIONAL_BATCH or size + document_size > MAX_BATCH_BYTES:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(document)
+        size += document_size
+    return chunks
+
+
+def migrate_container(database: DatabaseProxy, source_id: str, spec: ContainerSpec,
+                      page_size: int = 500, concurrency: int = 8) -> Dict[str, Any]:
+    """
+    Copy every document of source_id into a new container created from spec.
+
+    Documents are grouped by partition key and written with transactional batches of
+    at most MAX_BATCH_BYTES, several partitions at a time. A batch the service still
+    rejects as too large is written one document at a time.
+    """
+    source = database.get_container_client(source_id)
+    target = ensure_container(database, spec)
+    started = time.time()
+    copied = 0
+    request_charge = 0.0
+
+    def write_group(partition_key, documents: List[Dict[str, Any]]) -> float:
+        charges = []
+        # The client's last_response_headers are shared between threads, so read the charge from a hook
+        hook = lambda headers, _: charges.append(float(headers.get("x-ms-request-charge", 0)))
+        for chunk in _batches(documents):
+            try:
+                target.execute_item_batch(batch_operations=[("upsert", (doc,)) for doc in chunk],
+                                          partition_key=partition_key, response_hook=hook)
+            except CosmosHttpResponseError as e:
+                if e.status_code not in (400, 413):
+                    raise
+                for document in chunk:
+                    target.upsert_item(document, response_hook=hook)
+        return sum(charges)
+
+    items = source.query_items(query="SELECT * FROM c", enable_cross_partition_query=True, max_item_count=page_size)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for page in items.by_page():
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for document in page:
+                for field in SYSTEM_FIELDS:
+                    document.pop(field, None)
+                key = json.dumps(_partition_key_value(document, spec.partition_key_path))
+                groups.setdefault(key, []).append(document)
+            futures = [executor.submit(write_group, json.loads(key), documents) for key, documents in groups.items()]
+            for future in futures:
+                request_charge += future.result()
+            copied += sum(len(documents) for documents in groups.values())
+            print(f"Copied {copied} documents to {spec.container_id}")
+
+    return {
+        "source": source_id,
+        "target": spec.container_id,
+        "copied": copied,
+        "seconds": round(time.time() - started, 2),
+        "write_request_charge": round(request_charge, 2),
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=".env")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["create", "verify", "migrate"])
+    parser.add_argument("--kind", choices=list(SPECS.keys()), required=True)
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--container", help="Container to create or verify.")
+    parser.add_argument("--source", help="Container to migrate from.")
+    parser.add_argument("--target", help="Container to migrate to.")
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="Vector dimensions; defaults to the setting of the app that writes the container.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    client = CosmosClient(url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"), credential=os.getenv("COSMOSDB_ACCOUNT_KEY"))
+    database = client.create_database_if_not_exists(args.database)
+    container_id = args.target if args.command == "migrate" else args.container
+    dimensions = args.dimensions or int(os.getenv(DIMENSIONS_SETTINGS[args.kind], "0")) or 3072
+    spec = SPECS[args.kind](container_id, dimensions=dimensions)
+
+    if args.command == "create":
+        ensure_container(database, spec)
+        print(f"Container {spec.container_id} is ready")
+    elif args.command == "verify":
+        problems = verify_container(database.get_container_client(spec.container_id), spec)
+        print("\n".join(problems) if problems else f"Container {spec.container_id} matches its spec")
+    else:
+        print(json.dumps(migrate_container(database, args.source, spec, concurrency=args.concurrency), indent=2))
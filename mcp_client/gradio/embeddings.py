@@ -1,8 +1,12 @@
-from openai import AzureOpenAI
+import base64
 import os
+import numpy as np
 import tiktoken
 
 from dotenv import load_dotenv
+from cosmosdb_core.http_clients import azure_openai_client
+from cosmosdb_core.telemetry import record_embedding_tokens
+from cosmosdb_core.profiling import segment
 
 # Load environment variables from .env file
 load_dotenv(dotenv_path=".env")
@@ -15,24 +19,39 @@ EMBEDDING_MODEL_NAME = os.getenv('openai_embeddings_model')
 
 # Load tokenizer for text-embedding-3-large
 tokenizer = tiktoken.get_encoding("cl100k_base")
-AOAI_client = AzureOpenAI(
+# Shares the process-wide connection pool with the other OpenAI clients
+AOAI_client = azure_openai_client(
     api_key=OPENAI_API_KEY,
     azure_endpoint=OPENAI_API_ENDPOINT,  # type: ignore
     azure_deployment=EMBEDDING_MODEL_DEPLOYMENT_NAME,
     api_version=OPENAI_API_VERSION)
 
 def truncate_text(text, max_tokens=8192):
-    tokens = tokenizer.encode(text)
-    if len(tokens) > max_tokens:
-        truncated_tokens = tokens[:max_tokens]
-        text = tokenizer.decode(truncated_tokens)
+    with segment("tokenization"):
+        tokens = tokenizer.encode(text)
+        if len(tokens) > max_tokens:
+            truncated_tokens = tokens[:max_tokens]
+            text = tokenizer.decode(truncated_tokens)
     return text
 
-def generate_embeddings(text: str):
+def generate_embeddings(text: str, dimensions: int | None = None) -> np.ndarray:
+    """
+    The embedding of text as a float32 array. It is requested in base64 and decoded
+    straight into the array, without a list of Python floats in between; convert it
+    with .tolist() where it is written to JSON.
+    """
     if EMBEDDING_MODEL_NAME is None:
         raise ValueError("Embedding model deployment name is not set.")
     
     text = truncate_text(text)
-    response = AOAI_client.embeddings.create(input=text, model=EMBEDDING_MODEL_NAME)
-    embeddings = response.model_dump()
-    return embeddings['data'][0]['embedding']
\ No newline at end of file
+    # text-embedding-3 models can shorten their output natively through the dimensions parameter
+    extra_args = {"dimensions": dimensions} if dimensions else {}
+    with segment("embedding"):
+        response = AOAI_client.embeddings.create(input=text, model=EMBEDDING_MODEL_NAME,
+                                                 encoding_format="base64", **extra_args)
+    record_embedding_tokens(response.usage.total_tokens)
+    embedding = response.data[0].embedding
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+    # Deployments that ignore encoding_format return floats
+    return np.asarray(embedding, dtype=np.float32)
\ No newline at end of file
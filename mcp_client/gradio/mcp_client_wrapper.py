@@ -1,19 +1,34 @@
 import asyncio
 import gradio as gr
+import numpy as np
 import os
 import json
 import pytz
+import threading
+import time
 import uuid
 
+from collections import OrderedDict
 from contextlib import AsyncExitStack
 from mcp import ClientSession
+from mcp.types import TextContent
 from mcp.client.sse import sse_client
 from typing import List, Dict, Any, Union
 from gradio.components.chatbot import ChatMessage
-from openai import AsyncAzureOpenAI
-from azure.cosmos import CosmosClient, ContainerProxy, PartitionKey
+from azure.cosmos import CosmosClient, ContainerProxy
 from azure.cosmos.exceptions import CosmosResourceNotFoundError
 from embeddings import generate_embeddings
+from cosmosdb_core.http_clients import async_azure_openai_client
+from quantization import QuantizedIndex, QUANTIZATION_MODES, quantize
+from cosmos_provisioning import chat_history_spec, ensure_container
+from chat_history_retention import HISTORY_QUERY, history_turns, turn_messages
+from recent_threads import RecentThreads
+from cosmosdb_core.telemetry import track_turn, record_llm_usage, record_request_charge
+from cosmosdb_core.profiling import requested, segment, timed_stream
+from chat_core.response_compaction import ToolResultCompactor, FETCH_FULL_RESULT_TOOL, fetch_full_result_tool
+from chat_core.speculation import SpeculativeCall
+from chat_core.tool_selection import ToolSelector
+from chat_core.completion_cache import CompletionCache
 from datetime import datetime
 
 class MCPClientWrapper:
@@ -24,15 +39,45 @@ class MCPClientWrapper:
         self.exit_stack: AsyncExitStack = None
         self.tools = []
         self.deployment_name = os.environ["CHAT_MODEL_NAME"]
-        self.openai_client = AsyncAzureOpenAI(
+        self.openai_client = async_azure_openai_client(
             azure_endpoint=os.environ["CHAT_MODEL_BASE_URL"],
             api_key=os.environ["CHAT_MODEL_API_KEY"],
-            api_version=os.environ["CHAT_MODEL_API_VERSION"]
+            api_version=os.environ["CHAT_MODEL_API_VERSION"],
+            loop=self.loop
         )
         self.chat_history_account = CosmosClient(
             url=os.getenv("COSMOSDB_ACCOUNT_ENDPOINT"),
             credential=os.getenv("COSMOSDB_ACCOUNT_KEY")
         )
+        # Optional compact storage of the chat history embeddings
+        self.embedding_dimensions = int(os.getenv("CHAT_HISTORY_EMBEDDING_DIMENSIONS", "3072"))
+        self.quantization = os.getenv("CHAT_HISTORY_QUANTIZATION", "none").lower()
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"CHAT_HISTORY_QUANTIZATION must be one of {', '.join(QUANTIZATION_MODES)}")
+        self.rescore_candidates = int(os.getenv("CHAT_HISTORY_RESCORE_CANDIDATES", "10"))
+        # LRU of the per-user quantized indexes, rebuilt once older than CHAT_HISTORY_INDEX_SECONDS
+        # so turns archived by the compaction job or expired by TTL drop out of them
+        self.max_user_indexes = int(os.getenv("CHAT_HISTORY_INDEX_USERS", "100"))
+        self.user_index_seconds = float(os.getenv("CHAT_HISTORY_INDEX_SECONDS", "3600"))
+        self.user_indexes: "OrderedDict[str, QuantizedIndex]" = OrderedDict()
+        self._user_indexes_lock = threading.Lock()
+        self.chat_history_database = os.getenv("CHAT_HISTORY_DATABASE", "agent_threads")
+        self.chat_history_spec = chat_history_spec(
+            os.getenv("CHAT_HISTORY_CONTAINER", "chat_history"),
+            dimensions=self.embedding_dimensions
+        )
+        self._chat_history_container: ContainerProxy = None
+        # Stored turns expire after this many seconds (0 keeps them until they are compacted)
+        self.chat_history_ttl = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", "0"))
+        # The last turns of each user, kept in one document for cheap history loads
+        self.recent_threads = RecentThreads()
+        # Large tool results are shortened before they join the history; the full
+        # versions stay here for the fetch_full_result tool
+        self.tool_results = ToolResultCompactor()
+        # Only the tools relevant to the user's message are sent with each completion
+        self.tool_selector = ToolSelector(self.openai_client)
+        # Deterministic completions are replayed instead of calling the model again
+        self.completion_cache = CompletionCache()
 
     def connect(self, server_sse_url, mcp_tools, key):
         # None and "" are falsy values so we just do this oneliner
@@ -43,33 +88,36 @@ class MCPClientWrapper:
         )
         return response
 
-    def process_message(self, message: str,  history: List[Union[Dict[str, Any], ChatMessage]], user: str):
+    def process_message(self, message: str,  history: List[Union[Dict[str, Any], ChatMessage]], user: str,
+                        request: gr.Request = None):
         history.append({"role": "user", "content": message})
-        self.loop.run_until_complete(self._process_query(message, history, user))
+        # X-Profile: true on the request profiles the turn
+        profile = requested(request.headers) if request is not None else None
+        self.loop.run_until_complete(self._process_query(message, history, user, profile))
         return history, gr.Textbox(value="")
     
-    def load_user_messages(self, user: str) -> List[Union[Dict[str, Any], ChatMessage]]:
+    def load_user_messages(self, user: str, full: bool = False) -> List[Union[Dict[str, Any], ChatMessage]]:
         try: 
-            db = self.chat_history_account.get_database_client("agent_threads")
-            container: ContainerProxy = db.get_container_client("chat_history")
+            container = self._get_chat_history_container(create=False)
+            if self.recent_threads.enabled and not full:
+                # The user's last turns are kept in one document, read by id and partition key
+                recent = self.recent_threads.read(container, user)
+                if recent is not None:
+                    return turn_messages(recent.get("turns", []))
+            # Archived turns come back as one document per archive; history_turns expands them
             items = container.query_items(
-                query="SELECT * FROM c WHERE c.user = @user ORDER BY c.timestamp ASC",
+                query=HISTORY_QUERY,
                 parameters=[
                     {"name": "@user", "value": user}
                 ],
-                enable_cross_partition_query=True
+                partition_key=user,
+                response_hook=record_request_charge
             )
-            messages = []
-            for item in items:
-                messages.append({
-                    "role": "user",
-                    "content": item["user_message"]
-                })
-                messages.append({
-                    "role": "assistant",
-                    "content": item["assistant_message"]
-                })
-            return messages
+            turns = history_turns(items)
+            if self.recent_threads.enabled and not full:
+                self.recent_threads.seed(container, user, turns, self.chat_history_ttl or None)
+                return turn_messages(turns[-self.recent_threads.size:])
+            return turn_messages(turns)
         except CosmosResourceNotFoundError:
             print(f"Container for user {user} not found.")
             return []
@@ -99,6 +147,8 @@ class MCPClientWrapper:
                     "parameters": tool.inputSchema,
                 }
             } for tool in response.tools]
+            if self.tool_results.enabled:
+                self.tools.append({"type": "function", "function": fetch_full_result_tool()})
 
             print(f"Connected to MCP server at URL {server_sse_url} with tools: {','.join([tool['function']['name'] for tool in self.tools])}")
             mcp_tools += f"MCP URL: {server_sse_url.strip('https://').split('/sse')[0]}/sse\nTools: {', '.join([tool['function']['name'] for tool in self.tools])}\n"
@@ -108,7 +158,12 @@ class MCPClientWrapper:
             mcp_tools += f"Error connecting to MCP server: {server_sse_url.strip('https://').split('/')[0]}\n"
             return mcp_tools
 
-    async def _process_query(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], user: str):
+    async def _process_query(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], user: str,
+                             profile: bool = None):
+        with track_turn(user, "gradio", profile=profile):
+            await self._run_turn(message, history, user)
+
+    async def _run_turn(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], user: str):
         similar_message = self._check_similar_message(message, user)
         if similar_message is not None:
             print(f"Similar message found: {similar_message}")
@@ -116,6 +171,7 @@ class MCPClientWrapper:
             self._store_chat_message(user, message, similar_message)
             return
 
+        selection = await self.tool_selector.select(message, self.tools)
         while True:
             messages = []
 
@@ -128,34 +184,72 @@ class MCPClientWrapper:
                 if role in ["user", "assistant", "system"]:
                     messages.append({"role": role, "content": content})
 
-            response_stream = await self.openai_client.chat.completions.create(
-                model=self.deployment_name,
-                messages=messages,
-                tools=self.tools,
-                parallel_tool_calls=False,
-                stream=True,
-                temperature=0
-            )
+            selection.record()
+            with segment("llm"):
+                response_stream = await self.completion_cache.create(
+                    self.openai_client,
+                    model=self.deployment_name,
+                    messages=messages,
+                    tools=selection.tools,
+                    parallel_tool_calls=False,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    temperature=0
+                )
 
             done = await self.process_response_stream(response_stream, history, message, user)
 
             if done:
                 break
 
-    def _check_similar_message(self, message: str, user: str) -> str:
-        try: 
-            db = self.chat_history_account.get_database_client("agent_threads")
-            container: ContainerProxy = db.get_container_client("chat_history")
-            message_embeddings = generate_embeddings(message)
+    def _embed_user_message(self, message: str) -> np.ndarray:
+        dimensions = self.embedding_dimensions if self.embedding_dimensions != 3072 else None
+        return generate_embeddings(message, dimensions=dimensions)
+
+    def _get_user_index(self, container: ContainerProxy, user: str) -> QuantizedIndex:
+        with self._user_indexes_lock:
+            index = self.user_indexes.get(user)
+            if index is not None and time.monotonic() - index.created < self.user_index_seconds:
+                self.user_indexes.move_to_end(user)
+                return index
+        index = QuantizedIndex(self.quantization)
+        with segment("cosmos"):
             items = container.query_items(
-                query="SELECT TOP 1 c.assistant_message, c.timestamp, VectorDistance(c.user_message_embeddings, @embeddings) AS SimilarityScore FROM c WHERE c.user = @user ORDER BY c.timestamp DESC",
+                query="SELECT c.id, c.user_message_embeddings_q FROM c WHERE c.user = @user AND c.user_message_embeddings_q.type = @type",
                 parameters=[
-                    {"name": "@embeddings", "value": message_embeddings},
-                    {"name": "@user", "value": user}
+                    {"name": "@user", "value": user},
+                    {"name": "@type", "value": self.quantization}
                 ],
-                enable_cross_partition_query=True
+                partition_key=user,
+                response_hook=record_request_charge
             )
-            message = next(items, None)
+            for item in items:
+                index.add(item["id"], item["user_message_embeddings_q"])
+        with self._user_indexes_lock:
+            self.user_indexes[user] = index
+            self.user_indexes.move_to_end(user)
+            while len(self.user_indexes) > self.max_user_indexes:
+                self.user_indexes.popitem(last=False)
+        return index
+
+    def _check_similar_message(self, message: str, user: str) -> str:
+        try: 
+            container = self._get_chat_history_container(create=False)
+            message_embeddings = self._embed_user_message(message)
+            if self.quantization != "none":
+                return self._check_similar_message_quantized(container, message_embeddings, user)
+            # Ordering by VectorDistance within the user's partition is served by the DiskANN index
+            with segment("cosmos"):
+                items = container.query_items(
+                    query="SELECT TOP 1 c.assistant_message, c.timestamp, VectorDistance(c.user_message_embeddings, @embeddings) AS SimilarityScore FROM c WHERE c.user = @user AND NOT IS_DEFINED(c.kind) ORDER BY VectorDistance(c.user_message_embeddings, @embeddings)",
+                    parameters=[
+                        {"name": "@embeddings", "value": message_embeddings.tolist()},
+                        {"name": "@user", "value": user}
+                    ],
+                    partition_key=user,
+                    response_hook=record_request_charge
+                )
+                message = next(items, None)
             print(f"Message: {message}")
             if message is not None and message["SimilarityScore"] > 0.95:
                 return message["assistant_message"]
@@ -164,13 +258,36 @@ class MCPClientWrapper:
             print(f"Container for user {user} not found.")
             return None
 
+    def _check_similar_message_quantized(self, container: ContainerProxy, message_embeddings: np.ndarray, user: str) -> str:
+        # Shortlist candidates from the local quantized index, then rescore them in full precision
+        shortlist = self._get_user_index(container, user).search(message_embeddings, self.rescore_candidates)
+        if not shortlist:
+            return None
+        with segment("cosmos"):
+            items = container.query_items(
+                query="SELECT TOP 1 c.assistant_message, VectorDistance(c.user_message_embeddings, @embeddings) AS SimilarityScore FROM c WHERE c.user = @user AND ARRAY_CONTAINS(@ids, c.id) ORDER BY VectorDistance(c.user_message_embeddings, @embeddings)",
+                parameters=[
+                    {"name": "@embeddings", "value": message_embeddings.tolist()},
+                    {"name": "@user", "value": user},
+                    {"name": "@ids", "value": [item_id for item_id, _ in shortlist]}
+                ],
+                partition_key=user,
+                response_hook=record_request_charge
+            )
+            message = next(items, None)
+        if message is not None and message["SimilarityScore"] > 0.95:
+            return message["assistant_message"]
+        return None
+
     async def process_response_stream(self, response_stream, history: List[Union[Dict[str, Any], ChatMessage]], message: str, user: str):
         function_arguments = ""
         function_name = ""
         is_collecting_function_args = False
         collected_messages = []
+        speculation = None
         
-        async for part in response_stream:
+        async for part in timed_stream(response_stream, "llm"):
+            self._record_usage(part)
             if part.choices == []:
                 continue
             delta = part.choices[0].delta
@@ -188,11 +305,15 @@ class MCPClientWrapper:
                     # Get function name
                     if tool_call.function.name:
                         function_name = tool_call.function.name
+                        speculation = self._speculate(function_name)
                     
                     # Process function arguments delta
                     if tool_call.function.arguments:
                         function_arguments += tool_call.function.arguments
                         is_collecting_function_args = True
+                        # Read-only tools may start before the arguments are complete
+                        if speculation is not None:
+                            speculation.feed(tool_call.function.arguments)
             
             # Check if we've reached the end of a tool call
             if finish_reason == "tool_calls" and is_collecting_function_args:
@@ -200,11 +321,24 @@ class MCPClientWrapper:
                 print(f"function_name: {function_name} function_arguments: {function_arguments}")
                 function_args = json.loads(function_arguments)
 
-                # Call the tool and add response to messages
-                func_response = await self.session.call_tool(function_name, function_args)
+                if function_name == FETCH_FULL_RESULT_TOOL:
+                    # Served from the compactor, not by the MCP server
+                    page = self.tool_results.fetch(function_args.get("handle", ""), function_args.get("offset", 0))
+                    history.append({
+                        "role": "system",
+                        "content": f"The full result {function_args.get('handle')} from offset {function_args.get('offset', 0)} is {page}",
+                    })
+                    continue
+
+                # Call the tool (or reuse the speculative call) and add response to messages
+                func_response = await speculation.result(function_args)
+                response_text = "\n".join(
+                    self.tool_results.compact(function_name, item.text) if isinstance(item, TextContent) else item.model_dump_json()
+                    for item in func_response.content
+                )
+
+                print(f"Function Response: {response_text}")
 
-                print(f"Function Response: {json.loads(func_response.model_dump_json())}")
-                
                 if not func_response.isError:
                     # Add the assistant message with tool call
                     history.append({
@@ -213,16 +347,16 @@ class MCPClientWrapper:
                         "content":f"Arguments: {function_args}"
                     })
                 else:
-                    print(f"Error calling the tool {function_name}: {func_response.content}")
+                    print(f"Error calling the tool {function_name}: {response_text}")
                     # Add the assistant message with error
                     history.append({
                         "role": "system",
-                        "content": f"Error calling the tool {function_name}: {func_response.content}",
+                        "content": f"Error calling the tool {function_name}: {response_text}",
                     })
                 
                 history.append({
                     "role": "system",
-                    "content": f"The response from the tool {function_name} with arguments {function_arguments} is {func_response}",
+                    "content": f"The response from the tool {function_name} with arguments {function_arguments} is {response_text}",
                 })
             
             # Check if we've reached the end of assistant's response
@@ -233,60 +367,58 @@ class MCPClientWrapper:
                     final_content = ''.join([msg for msg in collected_messages if msg is not None])
                     if final_content.strip():
                         history.append({"role": "assistant", "content": final_content})
+                        # The usage chunk follows the finish reason, read it before leaving
+                        async for rest in response_stream:
+                            self._record_usage(rest)
                         self._store_chat_message(user, message, final_content)
                         return True
 
         return False  # In case the loop ends without a return, we can handle it here if needed
 
+    def _speculate(self, function_name: str):
+        if function_name == FETCH_FULL_RESULT_TOOL:
+            return None
+        schema = next((tool["function"]["parameters"] for tool in self.tools
+                       if tool["function"]["name"] == function_name), None)
+        return SpeculativeCall(function_name, lambda args: self.session.call_tool(function_name, args), schema)
+
+    def _record_usage(self, part):
+        usage = getattr(part, "usage", None)
+        if usage is not None:
+            record_llm_usage(usage.prompt_tokens, usage.completion_tokens)
+
     def _store_chat_message(self, user: str, user_message: str, assistant_message: str):
-        user_message_embeddings = generate_embeddings(user_message)
+        user_message_embeddings = self._embed_user_message(user_message)
         message = {
             "id": str(uuid.uuid4()),
             "user": user,
             "user_message": user_message,
             "assistant_message": assistant_message,
-            "user_message_embeddings": user_message_embeddings,
+            "user_message_embeddings": user_message_embeddings.tolist(),
             "timestamp": datetime.now(tz=pytz.UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
         }
-        db = self.chat_history_account.create_database_if_not_exists("agent_threads")
-        vector_embedding_policy = { 
-            "vectorEmbeddings": 
-            [ 
-                { 
-                    "path": "/embedding", 
-                    "dataType": "float32", 
-                    "distanceFunction": "cosine", 
-                    "dimensions": 3072 
-                }, 
-            ]    
-        }
-        indexing_policy = {
-            "includedPaths": 
-            [ 
-                { 
-                    "path": "/*" 
-                } 
-            ], 
-            "excludedPaths": 
-            [ 
-                { 
-                    "path": "/\"_etag\"/?",
-                    "path": "/embedding/*",   
-                } 
-            ], 
-            "vectorIndexes": 
-            [ 
-                {
-                    "path": "/embedding", 
-                    "type": "diskANN",
-                    "vectorIndexShardKey": ["/user"]
-                } 
-            ]
-        }
+        if self.quantization != "none":
+            message["user_message_embeddings_q"] = quantize(user_message_embeddings, self.quantization)
+        if self.chat_history_ttl > 0:
+            message["ttl"] = self.chat_history_ttl
+        with segment("cosmos"):
+            container = self._get_chat_history_container(create=True)
+            if self.recent_threads.enabled:
+                self.recent_threads.store(container, message)
+            else:
+                container.create_item(message, response_hook=record_request_charge)
+        if self.quantization != "none":
+            with self._user_indexes_lock:
+                index = self.user_indexes.get(user)
+            if index is not None:
+                index.add(message["id"], message["user_message_embeddings_q"])
 
-        container: ContainerProxy = db.create_container_if_not_exists(
-            id = "chat_history",
-            partition_key=PartitionKey(path="/user", kind="Hash"),
-            vector_embedding_policy=vector_embedding_policy,
-            indexing_policy=indexing_policy)
-        container.create_item(message)
\ No newline at end of file
+    def _get_chat_history_container(self, create: bool) -> ContainerProxy:
+        # Provision the container once instead of on every stored turn
+        if self._chat_history_container is None:
+            if not create:
+                db = self.chat_history_account.get_database_client(self.chat_history_database)
+                return db.get_container_client(self.chat_history_spec.container_id)
+            db = self.chat_history_account.create_database_if_not_exists(self.chat_history_database)
+            self._chat_history_container = ensure_container(db, self.chat_history_spec)
+        return self._chat_history_container
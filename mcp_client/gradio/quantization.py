@@ -0,0 +1,99 @@
+import base64
+import threading
+import time
+import numpy as np
+
+from typing import Dict, Any, List, Optional, Tuple
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+
+def normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def quantize(vector, mode: str) -> Optional[Dict[str, Any]]:
+    """
+    Encode a float vector in the compact form stored next to the full-precision embedding.
+
+    int8 keeps one symmetric scale per vector (1 byte per dimension), binary keeps
+    only the sign of each dimension packed into bits (1 bit per dimension).
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if mode == "int8":
+        scale = float(np.max(np.abs(vector))) or 1.0
+        codes = np.clip(np.rint(vector / scale * 127.0), -127, 127).astype(np.int8)
+        return {"type": "int8", "scale": scale, "data": base64.b64encode(codes.tobytes()).decode("ascii")}
+    if mode == "binary":
+        bits = np.packbits(vector > 0)
+        return {"type": "binary", "dimensions": int(vector.shape[0]), "data": base64.b64encode(bits.tobytes()).decode("ascii")}
+    return None
+
+
+def decode_codes(encoded: Dict[str, Any]) -> np.ndarray:
+    raw = base64.b64decode(encoded["data"])
+    if encoded["type"] == "int8":
+        return np.frombuffer(raw, dtype=np.int8)
+    return np.frombuffer(raw, dtype=np.uint8)
+
+
+def encoded_size(encoded: Optional[Dict[str, Any]]) -> int:
+    return len(base64.b64decode(encoded["data"])) if encoded else 0
+
+
+class QuantizedIndex:
+    """
+    In-memory index of quantized vectors that produces a shortlist of candidate ids.
+
+    Scores are approximate: int8 codes are compared with an int32 dot product and
+    binary codes with the Hamming distance between sign bits. The shortlist is
+    meant to be rescored with the full-precision vectors.
+    """
+    def __init__(self, mode: str):
+        if mode not in ("int8", "binary"):
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+        self.mode = mode
+        self.ids: List[str] = []
+        self.codes: Optional[np.ndarray] = None
+        self._pending: List[np.ndarray] = []
+        self._lock = threading.Lock()
+        self.created = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, item_id: str, encoded: Dict[str, Any]):
+        with self._lock:
+            self.ids.append(item_id)
+            self._pending.append(decode_codes(encoded))
+
+    def _matrix(self) -> Optional[np.ndarray]:
+        if self._pending:
+            rows = ([self.codes] if self.codes is not None else []) + [np.vstack(self._pending)]
+            self.codes = np.vstack(rows)
+            self._pending = []
+        return self.codes
+
+    def nbytes(self) -> int:
+        with self._lock:
+            matrix = self._matrix()
+            return int(matrix.nbytes) if matrix is not None else 0
+
+    def search(self, query, k: int) -> List[Tuple[str, float]]:
+        with self._lock:
+            matrix = self._matrix()
+            if matrix is None or len(self.ids) == 0:
+                return []
+            if self.mode == "int8":
+                query_codes = decode_codes(quantize(query, "int8")).astype(np.int32)
+                scores = matrix.astype(np.int32) @ query_codes
+            else:
+                query_bits = np.packbits(np.asarray(query, dtype=np.float32) > 0)
+                # Fewer differing sign bits means more similar, so negate the distance
+                scores = -np.unpackbits(np.bitwise_xor(matrix, query_bits), axis=1).sum(axis=1)
+            k = min(k, len(self.ids))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.ids[i], float(scores[i])) for i in top]
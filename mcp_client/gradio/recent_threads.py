@@ -0,0 +1,143 @@
+"""
+Materialized recent conversation of each chat history user.
+
+Next to its turn documents, every user's partition holds one "recent" document with
+the text of the user's last CHAT_HISTORY_RECENT_TURNS turns (no embeddings). It is
+replaced in the same transactional batch that creates each new turn, conditioned on
+its etag, so it always matches the turns. Switching users in the chat view is then
+a point read instead of an ORDER BY query over the whole partition; the full history
+is still loaded with that query on request, or when the document does not exist yet
+(it is then created from the result). CHAT_HISTORY_RECENT_TURNS=0 turns this off.
+
+With a TTL, the recent document carries the TTL of the newest turn, so it outlives
+the older turns it holds; turns older than the TTL are dropped from it when it is
+rewritten and when it is read.
+"""
+import hashlib
+import os
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from azure.cosmos import ContainerProxy
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosResourceExistsError, CosmosResourceNotFoundError
+from cosmosdb_core.telemetry import record_request_charge
+
+CHAT_HISTORY_RECENT_TURNS = int(os.getenv("CHAT_HISTORY_RECENT_TURNS", "50"))
+# Users whose last seen recent document is remembered
+CHAT_HISTORY_RECENT_USERS = int(os.getenv("CHAT_HISTORY_RECENT_USERS", "1000"))
+
+RECENT_KIND = "recent"
+TURN_FIELDS = ("user_message", "assistant_message", "timestamp")
+MAX_ATTEMPTS = 5
+
+
+def recent_id(user: str) -> str:
+    # Item ids cannot contain the characters / \ ? and #, which user names may
+    return f"{RECENT_KIND}-{hashlib.sha256(user.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _live(turns: List[Dict[str, Any]], ttl: Optional[int]) -> List[Dict[str, Any]]:
+    """
+    The turns not yet expired by ttl seconds.
+    """
+    if not ttl or ttl < 0:
+        return turns
+    # Turn timestamps share this format, so they compare as strings
+    cutoff = (datetime.now(tz=timezone.utc) - timedelta(seconds=ttl)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return [turn for turn in turns if turn.get("timestamp", "") >= cutoff]
+
+
+def _recent_document(user: str, turns: List[Dict[str, Any]], ttl: Optional[int] = None) -> Dict[str, Any]:
+    document: Dict[str, Any] = {
+        "id": recent_id(user),
+        "user": user,
+        "kind": RECENT_KIND,
+        "turns": [{key: turn[key] for key in TURN_FIELDS if key in turn} for turn in _live(turns, ttl)],
+    }
+    if ttl:
+        document["ttl"] = ttl
+    return document
+
+
+class RecentThreads:
+    """
+    Reads and maintains the recent documents, remembering the last version seen for the
+    max_users most recently active users so storing a turn does not need a read first.
+    """
+    def __init__(self, size: int = CHAT_HISTORY_RECENT_TURNS, max_users: int = CHAT_HISTORY_RECENT_USERS):
+        self.size = size
+        self.enabled = size > 0
+        self.max_users = max_users
+        self._documents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _remember(self, user: str, document: Dict[str, Any]):
+        self._documents[user] = document
+        self._documents.move_to_end(user)
+        while len(self._documents) > self.max_users:
+            self._documents.popitem(last=False)
+
+    def read(self, container: ContainerProxy, user: str) -> Optional[Dict[str, Any]]:
+        """
+        The user's recent document, without expired turns, or None when it does not exist.
+        """
+        try:
+            document = container.read_item(recent_id(user), partition_key=user, response_hook=record_request_charge)
+        except CosmosResourceNotFoundError:
+            self._documents.pop(user, None)
+            return None
+        document["turns"] = _live(document.get("turns", []), document.get("ttl"))
+        self._remember(user, document)
+        return document
+
+    def seed(self, container: ContainerProxy, user: str, turns: List[Dict[str, Any]], ttl: Optional[int] = None):
+        """
+        Create the user's recent document from the newest of turns, unless it exists.
+        """
+        if not turns:
+            # Nothing to write yet; the user's first stored turn creates the document
+            self._remember(user, _recent_document(user, [], ttl))
+            return
+        try:
+            document = container.create_item(_recent_document(user, turns[-self.size:], ttl), response_hook=record_request_charge)
+        except CosmosResourceExistsError:
+            return
+        self._remember(user, document)
+
+    def store(self, container: ContainerProxy, turn: Dict[str, Any]):
+        """
+        Create the turn document and add the turn to the user's recent document.
+        """
+        user = turn["user"]
+        for _ in range(MAX_ATTEMPTS):
+            current = self._documents.get(user) or self.read(container, user)
+            if current is None:
+                # The user's older turns are unknown here; the next history load creates the document
+                container.create_item(turn, response_hook=record_request_charge)
+                return
+            if "_etag" not in current:
+                recent = _recent_document(user, [turn], turn.get("ttl"))
+                operations = [("create", (turn,)), ("create", (recent,))]
+            else:
+                recent = _recent_document(user, (current.get("turns", []) + [turn])[-self.size:], turn.get("ttl"))
+                operations = [("create", (turn,)), ("replace", (recent["id"], recent), {"if_match_etag": current["_etag"]})]
+            try:
+                results = container.execute_item_batch(batch_operations=operations, partition_key=user,
+                                                       response_hook=record_request_charge)
+            except CosmosBatchOperationError as e:
+                # Another replica stored a turn of this user in the meantime: reread and try again
+                if e.error_index != 1:
+                    raise
+                self._documents.pop(user, None)
+                continue
+            written = results[1]
+            self._remember(user, written.get("resourceBody", written))
+            return
+        # Keep the turn even if the recent document stays contended, and drop the document
+        # so the next history load rebuilds it from the turns
+        container.create_item(turn, response_hook=record_request_charge)
+        self._documents.pop(user, None)
+        try:
+            container.delete_item(recent_id(user), partition_key=user, response_hook=record_request_charge)
+        except CosmosResourceNotFoundError:
+            pass
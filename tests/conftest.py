@@ -0,0 +1,33 @@
+"""
+Shared setup of the unit tests: the apps import their modules by bare name, so their
+directories go on sys.path, and Cosmos DB is the in-process fake of the benchmarks.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Later entries take precedence; the server and the Gradio client both have an embeddings module,
+# and only the server's is imported by the modules under test
+for path in ("mcp_client/chainlit", "mcp_client/gradio", "azure_containers/cosmosdb", "benchmarks", ""):
+    sys.path.insert(0, os.path.join(ROOT_DIR, path))
+
+import fake_cosmos  # noqa: E402
+
+
+@pytest.fixture
+def cosmos():
+    """
+    The fake Cosmos DB module with an empty store and no latency.
+    """
+    latency = fake_cosmos.FakeCosmosSettings.latency_ms
+    fake_cosmos.FakeCosmosSettings.latency_ms = 0
+    with fake_cosmos._store_lock:
+        fake_cosmos._store.clear()
+    yield fake_cosmos
+    fake_cosmos.FakeCosmosSettings.latency_ms = latency
+    with fake_cosmos._store_lock:
+        fake_cosmos._store.clear()
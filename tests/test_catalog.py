@@ -0,0 +1,51 @@
+import threading
+
+import catalog as catalog_module
+from catalog import Catalog
+
+
+def seed(cosmos):
+    cosmos.seed("db", "passages", [{"id": "1", "pid": "a", "passage": "text"}], partition_key_path="/pid")
+    cosmos.seed("db", "threads", [{"id": "1", "user": "u", "title": "t"}], partition_key_path="/user")
+    return cosmos.FakeCosmosClient()
+
+
+def test_lookups_do_not_load_the_account_on_the_callers_thread(cosmos, monkeypatch):
+    catalog = Catalog(seed(cosmos), refresh_seconds=0)
+    refreshed_on = []
+    refresh = catalog.refresh
+    release = threading.Event()
+
+    def slow_refresh(database=None):
+        refreshed_on.append(threading.current_thread().name)
+        release.wait(5)
+        return refresh(database)
+
+    monkeypatch.setattr(catalog, "refresh", slow_refresh)
+    # Served while the first snapshot is still loading in the background
+    assert catalog.loading()
+    assert sorted(catalog.containers("db")) == ["passages", "threads"]
+    assert catalog.container("db", "missing") is None
+    release.set()
+    catalog._thread.join(5)
+
+    assert refreshed_on == ["catalog-refresh"]
+    assert not catalog.loading()
+    assert catalog.databases() == ["db"]
+
+
+def test_schemas_sampled_during_a_refresh_are_kept(cosmos, monkeypatch):
+    catalog = Catalog(seed(cosmos), refresh_seconds=0)
+    catalog.refresh()
+    catalog.schema("db", "passages")
+    sample_schema = catalog_module.sample_schema
+
+    def sample_and_look_up(client, database, container):
+        if container == "passages":
+            # A lookup samples another container while the refresh re-samples this one
+            catalog.schema("db", "threads")
+        return sample_schema(client, database, container)
+
+    monkeypatch.setattr(catalog_module, "sample_schema", sample_and_look_up)
+    catalog.refresh()
+    assert set(catalog._schemas) == {("db", "passages"), ("db", "threads")}
@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+from cosmosdb_core.telemetry import registry
+
+# embeddings.py builds its Azure OpenAI client on import; the tests replace the embeddings call
+for name, value in (("openai_key", "test"), ("openai_endpoint", "http://127.0.0.1:9"), ("openai_api_version", "2024-02-01")):
+    os.environ.setdefault(name, value)
+
+try:
+    # embeddings.py also loads the tiktoken encoding on import, which needs it cached or downloadable
+    import change_feed_worker
+    from change_feed_worker import MAX_BATCH_BYTES, ReembeddingWorker
+except Exception as e:
+    pytest.skip(f"change_feed_worker cannot be imported: {e}", allow_module_level=True)
+
+
+def fake_embeddings(texts):
+    return [[float(len(text))] * 3072 for text in texts]
+
+
+def passage_container(cosmos, count: int):
+    documents = [{"id": f"p{i}", "pid": f"group{i % 2}", "passage": f"passage {i}"} for i in range(count)]
+    cosmos.seed("db", "passages", documents, partition_key_path="/pid")
+    return cosmos.FakeCosmosClient().get_database_client("db").get_container_client("passages")
+
+
+def test_write_back_chunks_fit_a_transactional_batch(cosmos, monkeypatch, tmp_path):
+    monkeypatch.setattr(change_feed_worker, "generate_embeddings_batch", fake_embeddings)
+    container = passage_container(cosmos, 120)
+    batches = []
+    execute = container.execute_item_batch
+
+    def record(batch_operations, **kwargs):
+        batches.append(len(json.dumps([operation[1][1] for operation in batch_operations])))
+        return execute(batch_operations, **kwargs)
+
+    monkeypatch.setattr(container, "execute_item_batch", record)
+    worker = ReembeddingWorker(container, str(tmp_path / "state.json"))
+    worker.process([container.read_item(f"p{i}", partition_key=f"group{i % 2}") for i in range(120)])
+
+    assert worker.stats.written == 120 and worker.stats.failed == 0
+    assert batches and all(size <= MAX_BATCH_BYTES for size in batches)
+    assert len(container.read_item("p7", partition_key="group1")["embedding"]) == 3072
+
+
+def test_stats_are_exported_as_metrics(cosmos, monkeypatch, tmp_path):
+    monkeypatch.setattr(change_feed_worker, "generate_embeddings_batch", fake_embeddings)
+    container = passage_container(cosmos, 3)
+    worker = ReembeddingWorker(container, str(tmp_path / "state.json"))
+    worker.process([container.read_item(f"p{i}", partition_key=f"group{i % 2}") for i in range(3)])
+
+    series = registry._counters["change_feed_documents_total"]
+    assert series[(("container", "passages"), ("outcome", "embedded"))] >= 3
+    assert ({"container": "passages"}, worker.stats.lag_seconds) in registry._gauges["change_feed_lag_seconds"]()
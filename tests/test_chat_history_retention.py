@@ -0,0 +1,56 @@
+import chat_history_retention
+from chat_history_retention import ARCHIVE_KIND, HISTORY_QUERY, _archives, compact_user, history_turns
+
+
+def turn(user: str, i: int, text: str = "") -> dict:
+    return {
+        "id": f"{user}-{i:04d}",
+        "user": user,
+        "user_message": f"question {i}{text}",
+        "assistant_message": f"answer {i}",
+        "timestamp": f"2025-01-01T00:{i // 60:02d}:{i % 60:02d}.000000Z",
+        "user_message_embeddings": [0.1, 0.2, 0.3],
+    }
+
+
+def history_container(cosmos, turns):
+    cosmos.seed("agent_threads", "chat_history", turns, partition_key_path="/user")
+    return cosmos.FakeCosmosClient().get_database_client("agent_threads").get_container_client("chat_history")
+
+
+def test_archives_split_by_turn_count():
+    chunks = _archives([turn("u", i) for i in range(10)], 4)
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+
+
+def test_archives_split_by_size(monkeypatch):
+    monkeypatch.setattr(chat_history_retention, "MAX_ARCHIVE_BYTES", 1000)
+    chunks = _archives([turn("u", i, "x" * 300) for i in range(6)], 99)
+    assert len(chunks) > 1
+    assert sum(len(chunk) for chunk in chunks) == 6
+
+
+def test_history_turns_expands_archives_and_skips_other_kinds():
+    items = [
+        {"kind": ARCHIVE_KIND, "turns": [{"user_message": "a"}, {"user_message": "b"}]},
+        {"user_message": "c"},
+        {"kind": "recent", "turns": [{"user_message": "c"}]},
+    ]
+    assert [t["user_message"] for t in history_turns(items)] == ["a", "b", "c"]
+
+
+def test_compact_user_archives_old_turns_in_order(cosmos):
+    container = history_container(cosmos, [turn("alice", i) for i in range(10)])
+    result = compact_user(container, "alice", keep=3, archive_turns=4, measure=False)
+    assert result["archived"] == 7
+
+    items = list(container.query_items(query=HISTORY_QUERY, parameters=[{"name": "@user", "value": "alice"}],
+                                       partition_key="alice"))
+    assert sum(1 for item in items if item.get("kind") == ARCHIVE_KIND) == 2
+    assert [t["user_message"] for t in history_turns(items)] == [f"question {i}" for i in range(10)]
+    assert all("user_message_embeddings" not in t for item in items if item.get("kind") for t in item["turns"])
+
+
+def test_compact_user_keeps_short_histories(cosmos):
+    container = history_container(cosmos, [turn("bob", i) for i in range(3)])
+    assert compact_user(container, "bob", keep=5, measure=False)["archived"] == 0
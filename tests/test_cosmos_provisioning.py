@@ -0,0 +1,24 @@
+import json
+
+from cosmos_provisioning import MAX_BATCH_BYTES, MAX_TRANSACTIONAL_BATCH, _batches, chat_history_spec, migrate_container
+
+
+def turn(i: int) -> dict:
+    return {"id": f"t{i}", "user": f"u{i % 2}", "user_message_embeddings": [0.123456789] * 3072,
+            "timestamp": f"{i:04d}"}
+
+
+def test_batches_stay_under_the_size_and_count_limits():
+    chunks = _batches([turn(i) for i in range(250)])
+    assert sum(len(chunk) for chunk in chunks) == 250
+    assert all(len(chunk) <= MAX_TRANSACTIONAL_BATCH for chunk in chunks)
+    assert all(len(json.dumps(chunk)) <= MAX_BATCH_BYTES for chunk in chunks)
+
+
+def test_migrate_copies_large_documents(cosmos):
+    cosmos.seed("db", "chat_history", [turn(i) for i in range(120)], partition_key_path="/user")
+    database = cosmos.FakeCosmosClient().get_database_client("db")
+    result = migrate_container(database, "chat_history", chat_history_spec("chat_history_v2"))
+    assert result["copied"] == 120
+    target = database.get_container_client("chat_history_v2")
+    assert target.read_item("t119", partition_key="u1")["timestamp"] == "0119"
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from cosmosdb_core import AsyncCosmosData, CosmosData, DocumentCache
+
+
+def seed(cosmos):
+    cosmos.seed("db", "items", [{"id": "1", "pid": "a", "name": "one"}, {"id": "2", "pid": "b", "name": "two"}],
+                partition_key_path="/pid")
+
+
+def lookups(cosmos, data_class, client):
+    """
+    The same field-filter lookups through the sync or async class, awaited as needed.
+    """
+    data = data_class(client, document_cache=DocumentCache())
+    proxy = cosmos.FakeCosmosClient().get_database_client("db").get_container_client("items")
+
+    async def lookup(field, value, fields=None):
+        result = data.document_by_field("db", "items", field, value, fields)
+        return await result if asyncio.iscoroutine(result) else result
+
+    async def run():
+        found = [await lookup("name", "one"), await lookup("name", "one")]
+        proxy.upsert_item({"id": "1", "pid": "a", "name": "one", "extra": True})
+        found.append(await lookup("id", "1"))
+        found.append(await lookup("id", "1"))
+        proxy.delete_item("1", partition_key="a")
+        found.append(await lookup("id", "1"))
+        found.append(await lookup("name", "missing"))
+        return found
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_sync_and_async_lookups_agree(cosmos, asynchronous):
+    seed(cosmos)
+    if asynchronous:
+        found = lookups(cosmos, AsyncCosmosData, cosmos.FakeAsyncCosmosClient())
+    else:
+        found = lookups(cosmos, CosmosData, cosmos.FakeCosmosClient())
+    first, cached, by_id, revalidated, deleted, missing = found
+    assert first["result"]["name"] == "one" and cached == first
+    assert by_id["result"]["extra"] is True
+    assert revalidated == by_id
+    assert deleted is None and missing is None
+
+
+def test_without_a_cache_the_query_answers(cosmos):
+    seed(cosmos)
+    data = CosmosData(cosmos.FakeCosmosClient())
+    assert data.document_by_field("db", "items", "name", "two", "name")["result"] == {"name": "two"}
+    assert data.document_by_field("db", "items", "name", "three") is None
@@ -0,0 +1,29 @@
+import asyncio
+
+from catalog import Catalog
+from federated_search import federated_search
+
+DIMENSIONS = 4
+
+
+def seed_target(cosmos, container: str, distance_function: str, embeddings):
+    documents = [{"id": f"{container}-{i}", "pid": f"{container}-{i}", "passage": f"{container} {i}", "embedding": embedding}
+                 for i, embedding in enumerate(embeddings)]
+    policy = {"vectorEmbeddings": [{"path": "/embedding", "dataType": "float32",
+                                    "distanceFunction": distance_function, "dimensions": DIMENSIONS}]}
+    cosmos.seed("db", container, documents, partition_key_path="/pid", vector_embedding_policy=policy)
+
+
+def test_min_score_uses_each_targets_distance_function(cosmos):
+    query_vector = [1.0, 0.0, 0.0, 0.0]
+    # Cosine similarities 1.0, 0.0 and -1.0; euclidean distances 0.0, ~1.41 and 2.0
+    embeddings = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [-1.0, 0.0, 0.0, 0.0]]
+    seed_target(cosmos, "cosine", "cosine", embeddings)
+    seed_target(cosmos, "euclidean", "euclidean", embeddings)
+    client = cosmos.FakeCosmosClient()
+    targets = [{"database": "db", "container": "cosine"}, {"database": "db", "container": "euclidean"}]
+
+    found = asyncio.run(federated_search(client, Catalog(client, refresh_seconds=0), targets, query_vector,
+                                         top_k=10, min_score=0.5))
+    assert sorted(hit["passage"] for hit in found["result"]) == ["cosine 0", "euclidean 0"]
+    assert found["score_scale"] == "rank"
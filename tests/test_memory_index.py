@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from cosmosdb_core import CosmosData, queries
+from memory_index import MemoryVectorIndex
+
+DIMENSIONS = 8
+
+
+def seed_passages(cosmos, container: str, distance_function: str, count: int = 300):
+    rng = random.Random(container)
+    documents = [{
+        "id": f"{container}-{i}",
+        "pid": f"{container}-{i}",
+        "passage": f"passage {i}",
+        "embedding": [rng.uniform(-1, 1) for _ in range(DIMENSIONS)],
+    } for i in range(count)]
+    policy = {"vectorEmbeddings": [{"path": "/embedding", "dataType": "float32",
+                                    "distanceFunction": distance_function, "dimensions": DIMENSIONS}]}
+    cosmos.seed("db", container, documents, partition_key_path="/pid", vector_embedding_policy=policy)
+    return cosmos.FakeCosmosClient()
+
+
+def cosmos_top_k(client, container: str, query_vector, top_k: int):
+    spec = queries.vector_search(query_vector, top_k)
+    proxy = client.get_database_client("db").get_container_client(container)
+    return [(item["passage"], item["SimilarityScore"])
+            for item in proxy.query_items(spec.query, parameters=spec.parameters, enable_cross_partition_query=True)]
+
+
+@pytest.mark.parametrize("distance_function", ["cosine", "dotproduct", "euclidean"])
+def test_top_k_matches_the_cosmos_query(cosmos, distance_function):
+    client = seed_passages(cosmos, distance_function, distance_function)
+    index = MemoryVectorIndex(client, "db", distance_function)
+    index.load()
+    assert index.distance_function == distance_function
+    assert len(index) == 300
+
+    query_vector = [random.Random(1).uniform(-1, 1) for _ in range(DIMENSIONS)]
+    no_threshold = float("inf") if distance_function == "euclidean" else -1e9
+    found = index.search(query_vector, 10, no_threshold)
+    expected = cosmos_top_k(client, distance_function, query_vector, 10)
+    assert [passage for passage, _ in found] == [passage for passage, _ in expected]
+    assert [score for _, score in found] == pytest.approx([score for _, score in expected], abs=1e-4)
+
+
+def test_poll_adds_new_passages(cosmos):
+    client = seed_passages(cosmos, "passages", "cosine")
+    index = MemoryVectorIndex(client, "db", "passages")
+    index.load()
+    query_vector = [1.0] * DIMENSIONS
+    client.get_database_client("db").get_container_client("passages").upsert_item(
+        {"id": "new", "pid": "new", "passage": "new passage", "embedding": query_vector})
+    index.poll()
+    assert len(index) == 301
+    assert index.search(query_vector, 1, 0.0)[0][0] == "new passage"
+
+
+def test_threshold_and_top_k_bound_the_results(cosmos):
+    client = seed_passages(cosmos, "passages", "cosine")
+    index = MemoryVectorIndex(client, "db", "passages")
+    index.load()
+    query_vector = [1.0] * DIMENSIONS
+    assert len(index.search(query_vector, 5, -1.0)) == 5
+    assert all(score >= 0.5 for _, score in index.search(query_vector, 300, 0.5))
+
+
+def test_euclidean_threshold_is_a_maximum_distance(cosmos):
+    client = seed_passages(cosmos, "passages", "euclidean")
+    index = MemoryVectorIndex(client, "db", "passages")
+    index.load()
+    query_vector = [0.5] * DIMENSIONS
+    everything = index.search(query_vector, 300, float("inf"))
+    assert len(everything) == 300
+    # Between two scores, clear of the float32 rounding of the in-memory matrix
+    threshold = (everything[10][1] + everything[11][1]) / 2
+    near = index.search(query_vector, 300, threshold)
+    assert near == everything[:len(near)]
+    assert len(near) == 11 and all(score <= threshold for _, score in near)
+
+    # The same passages as the Cosmos DB query filtered by the same threshold
+    data = CosmosData(client)
+    assert data.vector_search("db", "passages", query_vector, 300, threshold, "euclidean")["result"] == [passage for passage, _ in near]
+
+
+def test_falls_back_when_it_cannot_answer(cosmos):
+    client = seed_passages(cosmos, "passages", "cosine")
+    index = MemoryVectorIndex(client, "db", "passages")
+    assert index.search([1.0] * DIMENSIONS, 5, 0.0) is None
+    index.load()
+    assert index.search([1.0] * (DIMENSIONS + 1), 5, 0.0) is None
+
+    small = MemoryVectorIndex(client, "db", "passages", max_passages=10)
+    small.load()
+    assert small.too_large
+    assert small.search([1.0] * DIMENSIONS, 5, 0.0) is None
+
+
+def test_snapshot_restores_the_same_results(cosmos, tmp_path):
+    client = seed_passages(cosmos, "passages", "euclidean")
+    index = MemoryVectorIndex(client, "db", "passages", snapshot_dir=str(tmp_path))
+    index.load()
+    index.save()
+    restored = MemoryVectorIndex(client, "db", "passages", snapshot_dir=str(tmp_path))
+    assert restored.restore()
+    query_vector = [0.1] * DIMENSIONS
+    assert restored.distance_function == "euclidean"
+    assert restored.search(query_vector, 5, -1e9) == index.search(query_vector, 5, -1e9)
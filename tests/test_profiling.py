@@ -0,0 +1,31 @@
+import os
+
+from cosmosdb_core import profiling
+from cosmosdb_core.profiling import profiled, requested, tool_request
+
+
+def test_requests_are_ignored_unless_allowed(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ALLOW_REQUESTS", False)
+    assert requested({"x-profile": "true"}) is None
+    assert tool_request(('{"arguments": {"profile": true}}',), {}) == (None, None)
+
+    monkeypatch.setattr(profiling, "PROFILE_ALLOW_REQUESTS", True)
+    assert requested({"x-profile": "true"}) is True
+    assert tool_request(('{"arguments": {"profile": true}}',), {})[0] is True
+
+
+def test_secret_must_match(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ALLOW_REQUESTS", True)
+    monkeypatch.setattr(profiling, "PROFILE_REQUEST_SECRET", "s3cret")
+    assert requested({"x-profile": "true"}) is None
+    assert requested({"x-profile": "s3cret"}) is True
+
+
+def test_profiles_have_unique_names_and_stop_at_the_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 4)
+    for _ in range(3):
+        with profiled("tool", "get_databases", True, request_id="1"):
+            pass
+    # Two files (profile and summary) per profile; the third found the directory full
+    assert len(os.listdir(tmp_path)) == 4
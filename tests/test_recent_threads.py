@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosResourceNotFoundError
+
+from recent_threads import RecentThreads, recent_id
+
+
+def history_container(cosmos):
+    cosmos.seed("agent_threads", "chat_history", [], partition_key_path="/user")
+    return cosmos.FakeCosmosClient().get_database_client("agent_threads").get_container_client("chat_history")
+
+
+def turn(user: str, i: int) -> dict:
+    return {
+        "id": f"{user}-{i}",
+        "user": user,
+        "user_message": f"question {i}",
+        "assistant_message": f"answer {i}",
+        "timestamp": datetime.now(tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+
+def recent_messages(container, user: str):
+    document = container.read_item(recent_id(user), partition_key=user)
+    return [t["user_message"] for t in document["turns"]]
+
+
+def test_store_keeps_the_last_turns(cosmos):
+    container = history_container(cosmos)
+    recent = RecentThreads(size=3)
+    recent.seed(container, "alice", [])
+    for i in range(5):
+        recent.store(container, turn("alice", i))
+    assert recent_messages(container, "alice") == ["question 2", "question 3", "question 4"]
+    assert container.read_item("alice-0", partition_key="alice")["user_message"] == "question 0"
+
+
+def test_stale_etag_is_retried_with_the_current_document(cosmos):
+    container = history_container(cosmos)
+    first, second = RecentThreads(size=10), RecentThreads(size=10)
+    first.seed(container, "alice", [])
+    first.store(container, turn("alice", 0))
+    second.read(container, "alice")
+    first.store(container, turn("alice", 1))
+    # second still holds the document from before turn 1
+    second.store(container, turn("alice", 2))
+    assert recent_messages(container, "alice") == ["question 0", "question 1", "question 2"]
+
+
+def test_persistent_conflict_keeps_the_turn_and_drops_the_document(cosmos, monkeypatch):
+    container = history_container(cosmos)
+    recent = RecentThreads(size=10)
+    recent.seed(container, "alice", [])
+    recent.store(container, turn("alice", 0))
+
+    def conflict(*args, **kwargs):
+        raise CosmosBatchOperationError(error_index=1, headers={}, status_code=412, message="conflict",
+                                        operation_responses=[])
+
+    monkeypatch.setattr(container, "execute_item_batch", conflict)
+    recent.store(container, turn("alice", 1))
+    assert container.read_item("alice-1", partition_key="alice")["user_message"] == "question 1"
+    try:
+        container.read_item(recent_id("alice"), partition_key="alice")
+        assert False, "the recent document should have been deleted"
+    except CosmosResourceNotFoundError:
+        pass
+
+
+def test_expired_turns_are_dropped(cosmos):
+    container = history_container(cosmos)
+    recent = RecentThreads(size=10)
+    old = dict(turn("alice", 0), timestamp="2000-01-01T00:00:00.000000Z", ttl=60)
+    recent.seed(container, "alice", [old], ttl=60)
+    recent.store(container, dict(turn("alice", 1), ttl=60))
+    assert recent_messages(container, "alice") == ["question 1"]
+
+
+def test_remembered_documents_are_bounded(cosmos):
+    container = history_container(cosmos)
+    recent = RecentThreads(size=10, max_users=2)
+    for user in ("a", "b", "c"):
+        recent.seed(container, user, [])
+    assert list(recent._documents) == ["b", "c"]
@@ -0,0 +1,61 @@
+import json
+
+from chat_core.response_compaction import ToolResultCompactor
+
+
+def test_small_result_is_unchanged():
+    compactor = ToolResultCompactor(token_budget=200)
+    text = json.dumps({"result": [{"id": "1", "passage": "short"}]})
+    assert compactor.compact("get_sample_documents", text) == text
+
+
+def test_reduce_elides_vectors_and_caps_rows():
+    compactor = ToolResultCompactor(token_budget=10_000, max_rows=3)
+    data = {"result": [{"id": str(i), "embedding": [0.5] * 32} for i in range(5)]}
+    reduced = compactor._reduce("get_sample_documents", data)
+    assert reduced["result"][0]["embedding"] == "<vector of 32 numbers>"
+    assert len(reduced["result"]) == 4
+    assert reduced["result"][-1] == "<2 more items>"
+
+
+def test_reduce_replaces_repeated_passages():
+    compactor = ToolResultCompactor(token_budget=10_000)
+    passage = "a long passage " * 10
+    reduced = compactor._reduce("do_vector_search", {"result": [{"passage": passage}, {"passage": passage}]})
+    assert reduced["result"][0]["passage"] == passage
+    assert reduced["result"][1]["passage"] == "<same as $.result[0].passage>"
+
+
+def test_reduce_tightens_limits_until_within_budget():
+    compactor = ToolResultCompactor(token_budget=100, max_chars=600, max_rows=20)
+    data = {"result": [{"id": str(i), "text": f"{i} " + "x" * 1000} for i in range(20)]}
+    reduced = compactor._reduce("get_sample_documents", data)
+    assert len(json.dumps(reduced)) < len(json.dumps(data)) // 10
+
+
+def test_reduce_returns_none_when_nothing_was_dropped():
+    compactor = ToolResultCompactor(token_budget=10_000)
+    assert compactor._reduce("get_databases", {"result": ["db1", "db2"]}) is None
+
+
+def test_fetch_pages_through_the_full_result():
+    compactor = ToolResultCompactor(token_budget=150)
+    text = json.dumps({"result": [{"id": str(i), "embedding": [0.25] * 64} for i in range(5)]})
+    compacted = json.loads(compactor.compact("get_sample_documents", text))
+    handle = compacted["_compacted"]["handle"]
+
+    pages, offset = [], 0
+    while offset is not None:
+        page = json.loads(compactor.fetch(handle, offset))
+        pages.append(page["data"])
+        offset = page["next_offset"]
+    assert "".join(pages) == text
+    assert len(pages) > 1
+
+
+def test_fetch_of_evicted_handle_reports_an_error():
+    compactor = ToolResultCompactor(token_budget=150, max_stored=1)
+    text = json.dumps({"result": [[0.5] * 256]})
+    first = json.loads(compactor.compact("get_sample_documents", text))["_compacted"]["handle"]
+    compactor.compact("get_sample_documents", text)
+    assert "error" in json.loads(compactor.fetch(first))
@@ -0,0 +1,66 @@
+import csv
+import io
+
+from cosmosdb_core.result_format import encode, encode_result
+
+DOCUMENTS = [
+    {"id": "1", "name": "alpha", "embedding": [0.5] * 32, "_rid": "x", "_etag": "e1", "_ts": 1},
+    {"id": "2", "name": "beta", "tags": ["a", "b"], "_rid": "y", "_etag": "e2", "_ts": 2},
+]
+
+
+def test_json_returns_the_documents_as_stored():
+    assert encode(DOCUMENTS, "json") is DOCUMENTS
+
+
+def test_compact_drops_system_properties_and_vectors():
+    encoded = encode(DOCUMENTS, "compact")
+    assert encoded[0] == {"id": "1", "name": "alpha", "embedding": "<vector of 32 numbers>"}
+    assert encoded[1] == {"id": "2", "name": "beta", "tags": ["a", "b"]}
+
+
+def test_compact_cuts_long_strings():
+    encoded = encode([{"text": "x" * 20}], "compact", max_chars=5)
+    assert encoded[0]["text"] == "xxxxx... (+15 chars)"
+
+
+def test_columns_write_field_names_once():
+    encoded = encode(DOCUMENTS, "columns")
+    assert encoded["columns"] == ["id", "name", "embedding", "tags"]
+    assert encoded["rows"] == [["1", "alpha", "<vector of 32 numbers>", None], ["2", "beta", None, ["a", "b"]]]
+
+
+def test_single_document_is_compact_not_columns():
+    assert encode(DOCUMENTS[1], "columns") == {"id": "2", "name": "beta", "tags": ["a", "b"]}
+
+
+def test_table_is_csv_with_a_header():
+    rows = list(csv.reader(io.StringIO(encode(DOCUMENTS, "table"))))
+    assert rows[0] == ["id", "name", "embedding", "tags"]
+    assert rows[2] == ["2", "beta", "", '["a", "b"]']
+
+
+def test_non_documents_are_left_alone():
+    assert encode(["db1", "db2"], "columns") == ["db1", "db2"]
+    assert encode(42, "table") == 42
+
+
+def test_encode_result_reports_sizes_and_accepts_csv():
+    sizes = []
+    payload = encode_result({"result": DOCUMENTS, "query": "SELECT * FROM c"}, "csv",
+                            on_size=lambda *args: sizes.append(args), sample_rate=1.0)
+    assert payload["query"] == "SELECT * FROM c"
+    assert payload["result"].startswith("id,name,embedding,tags\n")
+    format, original_bytes, encoded_bytes, original_tokens, encoded_tokens = sizes[0]
+    assert format == "table"
+    assert encoded_bytes < original_bytes
+    assert encoded_tokens < original_tokens
+
+
+def test_sizes_are_only_measured_for_sampled_calls():
+    sizes = []
+    for _ in range(20):
+        payload = encode_result({"result": DOCUMENTS, "query": "SELECT * FROM c"}, "columns",
+                                on_size=lambda *args: sizes.append(args), sample_rate=0.0)
+        assert "columns" in payload["result"]
+    assert sizes == []
@@ -0,0 +1,116 @@
+import asyncio
+
+from session_store import CosmosSpill, SessionRegistry
+
+
+class FakeService:
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class GatedSpill:
+    """
+    In-memory spill store whose saves wait until the gate opens.
+    """
+    def __init__(self):
+        self.saved = {}
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def save(self, thread_id, messages):
+        await self.gate.wait()
+        self.saved[thread_id] = list(messages)
+
+    async def load(self, thread_id):
+        return self.saved.get(thread_id)
+
+
+def test_create_evicts_least_recently_used():
+    async def run():
+        registry = SessionRegistry(FakeService, max_sessions=2, idle_seconds=3600)
+        await registry.create("a")
+        await registry.create("b")
+        async with registry.session("a"):
+            pass
+        await registry.create("c")
+        return registry
+
+    registry = asyncio.run(run())
+    assert sorted(registry._entries) == ["a", "c"]
+    assert registry.evicted == 1
+
+
+def test_loading_a_thread_never_evicts_it():
+    async def run():
+        registry = SessionRegistry(FakeService, max_sessions=1, idle_seconds=3600)
+        await registry.create("a")
+        async with registry.session("b") as service:
+            return registry, service.closed
+
+    registry, closed = asyncio.run(run())
+    assert not closed
+    assert list(registry._entries) == ["b"]
+
+
+def test_active_session_is_not_evicted():
+    async def run():
+        registry = SessionRegistry(FakeService, max_sessions=1, idle_seconds=3600)
+        async with registry.session("a") as service:
+            await registry.create("b")
+            return registry, service.closed
+
+    registry, closed = asyncio.run(run())
+    assert not closed
+    assert "a" in registry._entries
+
+
+def test_thread_returning_during_eviction_gets_saved_messages():
+    async def run():
+        spill = GatedSpill()
+        registry = SessionRegistry(FakeService, max_sessions=10, idle_seconds=3600, spill=spill)
+        async with registry.session("a") as service:
+            service.messages = [{"role": "user", "content": "hello"}]
+        spill.gate.clear()
+        ending = asyncio.create_task(registry.end("a"))
+        await asyncio.sleep(0)
+
+        async def reuse():
+            async with registry.session("a") as service:
+                return list(service.messages), service.closed
+
+        reusing = asyncio.create_task(reuse())
+        await asyncio.sleep(0.01)
+        waited = not reusing.done()
+        spill.gate.set()
+        await ending
+        return waited, await reusing, registry.restored
+
+    waited, (messages, closed), restored = asyncio.run(run())
+    assert waited
+    assert messages == [{"role": "user", "content": "hello"}]
+    assert not closed
+    assert restored == 1
+
+
+def test_sweep_spills_idle_sessions_to_cosmos(cosmos):
+    cosmos.seed("agent_threads", "chainlit_sessions", [], partition_key_path="/thread_id")
+    spill = CosmosSpill()
+    spill._container = cosmos.FakeAsyncCosmosClient().get_database_client("agent_threads") \
+        .get_container_client("chainlit_sessions")
+
+    async def run():
+        registry = SessionRegistry(FakeService, max_sessions=10, idle_seconds=0, spill=spill)
+        async with registry.session("a") as service:
+            service.messages = [{"role": "user", "content": "hello"}]
+        await registry.sweep()
+        evicted = len(registry)
+        async with registry.session("a") as service:
+            return evicted, list(service.messages)
+
+    evicted, messages = asyncio.run(run())
+    assert evicted == 0
+    assert messages == [{"role": "user", "content": "hello"}]